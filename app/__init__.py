@@ -1,16 +1,78 @@
 # app/__init__.py
+import asyncio
+import contextlib
+from contextlib import asynccontextmanager
+from anyio import to_thread
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.staticfiles import StaticFiles
 from app.routes import auth
 from app.routes import note
 from app.routes import diary
-from app.utils.database import init_db
+from app.routes import media
+from app.routes import emotion
+from app.routes import feed
+from app.routes import metrics
+from app.routes import sync
+from app.utils.config import get_settings
+from app.utils.database import init_db, close_db
+from app.utils.emotion_catalog import emotion_catalog
+from app.utils.log import RequestLoggingMiddleware, setup_logging, stop_logging
+from app.utils.media import shutdown_process_pool
+from app.utils.profiling import ProfilingMiddleware
+from app.utils.revocation import revocation_cache
+from app.utils.sync import change_hub
+
+def mount_media_files(app: FastAPI) -> None:
+    """
+    Serves uploaded media files. Mounted at startup rather than import, as
+    the path and directory come from the settings.
+    """
+    if any(getattr(route, "name", None) == "media-files" for route in app.routes):
+        return
+    settings = get_settings()
+    app.mount(
+        settings.MEDIA_BASE_URL,
+        StaticFiles(directory=settings.MEDIA_STORAGE_DIR, check_dir=False),
+        name="media-files"
+    )
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Per-worker setup and teardown of connections, pools and caches."""
+    setup_logging()
+    mount_media_files(app)
+    # Sync routes run in this threadpool
+    to_thread.current_default_thread_limiter().total_tokens = get_settings().THREADPOOL_SIZE
+    if get_settings().STORAGE_BACKEND == "memory":
+        # No database: default emotions, an empty revocation filter and no sync
+        emotion_catalog.load_defaults()
+        revocation_cache.add()
+        yield
+        shutdown_process_pool()
+        stop_logging()
+        return
+
+    await to_thread.run_sync(init_db)
+    await to_thread.run_sync(emotion_catalog.load)
+    await to_thread.run_sync(revocation_cache.rebuild)
+    revocation_sync = asyncio.create_task(revocation_cache.run_sync_loop())
+    change_hub.start()
+    yield
+    await to_thread.run_sync(change_hub.stop)
+    revocation_sync.cancel()
+    with contextlib.suppress(asyncio.CancelledError):
+        await revocation_sync
+    shutdown_process_pool()
+    close_db()
+    stop_logging()
 
 # Create FastAPI instance
 app = FastAPI(
     title="Migo Backend",
     description="Backend API for iOS Migo App",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # 配置 CORS
@@ -21,13 +83,16 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(ProfilingMiddleware)
+# Outermost, so the request ID is set before profiling starts
+app.add_middleware(RequestLoggingMiddleware)
 
 # Blueprints
 app.include_router(auth.router, prefix="/auth")
 app.include_router(note.router, prefix="/notes")
 app.include_router(diary.router, prefix="/diaries")
-
-@app.on_event("startup")
-def startup_event():
-    init_db()
-
+app.include_router(media.router, prefix="/media")
+app.include_router(emotion.router, prefix="/emotions")
+app.include_router(feed.router, prefix="/feed")
+app.include_router(metrics.router, prefix="/metrics")
+app.include_router(sync.router, prefix="/sync")
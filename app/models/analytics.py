@@ -0,0 +1,44 @@
+from datetime import date
+from typing import Dict, List, Optional
+from pydantic import BaseModel
+
+class EmotionTrend(BaseModel):
+    """
+    滾動情緒頻率。`series` 中每個值為截至該日的 `window` 天內，該情緒佔所有情緒標籤的比例；
+    第一個值對應 `start_date`，之後每隔 `step_days` 天一個值。
+    """
+    start_date: Optional[date] = None
+    window: int
+    step_days: int = 1
+    series: Dict[str, List[float]] = {}
+
+class DiaryStreaks(BaseModel):
+    """連續寫日記的天數"""
+    current: int = 0
+    longest: int = 0
+
+class WritingTimeTrend(BaseModel):
+    """寫作時間統計，`monthly_average_seconds` 以 YYYY-MM 為鍵"""
+    total_seconds: int = 0
+    average_seconds_per_day: float = 0.0
+    monthly_average_seconds: Dict[str, float] = {}
+    slope_seconds_per_day: float = 0.0
+
+class MetricCorrelation(BaseModel):
+    """imported_data 指標與當天是否出現某情緒之間的相關係數"""
+    metric: str
+    emotion: str
+    r: float
+    days: int
+
+class DiaryStatsResponse(BaseModel):
+    """日記統計的 API 響應模型"""
+    start_date: Optional[date] = None
+    end_date: Optional[date] = None
+    days: int = 0
+    entries: int = 0
+    emotion_distribution: Dict[str, int] = {}
+    emotion_trend: EmotionTrend
+    streaks: DiaryStreaks
+    writing_time: WritingTimeTrend
+    correlations: List[MetricCorrelation] = []
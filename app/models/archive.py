@@ -0,0 +1,31 @@
+from datetime import datetime
+from mongoengine import Document, LazyReferenceField, IntField, ListField, ObjectIdField, BinaryField, StringField, DateTimeField
+from app.models.user import User
+
+class DiaryArchive(Document):
+    """
+    一個用戶一個月份的舊日記，壓縮後存放在單一文件中。
+    `diary_ids` 與 `day_keys` 用於不解壓即可定位日記。
+    """
+    user_id = LazyReferenceField(User, required=True)
+    month = IntField(required=True)  # YYYYMM
+    diary_ids = ListField(ObjectIdField())
+    day_keys = ListField(IntField())
+    moods = ListField(IntField())  # Parallel to day_keys, for the calendar
+    media_ids = ListField(ObjectIdField())  # Uploads referenced by the entries, for the account purge
+    codec = StringField(default="zstd")
+    payload = BinaryField(required=True)
+    raw_size = IntField(default=0)
+    version = IntField(default=0)  # Incremented by every write, for optimistic concurrency
+    created_at = DateTimeField(default=datetime.utcnow)
+    updated_at = DateTimeField(default=datetime.utcnow)
+
+    meta = {
+        'collection': 'diary_archives',
+        'indexes': [
+            {'fields': ['user_id', '-month'], 'unique': True},
+            ('user_id', 'diary_ids'),
+            ('user_id', 'day_keys'),
+            {'fields': ['media_ids'], 'sparse': True}
+        ]
+    }
@@ -1,6 +1,7 @@
+from collections import Counter
 from datetime import datetime, date
 from typing import List, Optional, Dict
-from mongoengine import Document, EmbeddedDocument, EmbeddedDocumentField, StringField, ListField, BooleanField, DateTimeField, IntField, DictField, ReferenceField, ObjectIdField
+from mongoengine import Document, EmbeddedDocument, EmbeddedDocumentField, StringField, ListField, BooleanField, DateTimeField, IntField, DictField, LazyReferenceField, ObjectIdField
 from pydantic import BaseModel, Field
 from app.models.user import User
 from app.models.emotion import Emotion
@@ -11,7 +12,7 @@ class DiaryEntry(EmbeddedDocument):
     id = ObjectIdField(default=None, primary_key=True)
     title = StringField(default="")
     content = StringField(default="")
-    emotions = ListField(StringField())
+    emotions = ListField(IntField())
     medias = ListField(EmbeddedDocumentField(EmbeddedMedia))
     created_at = DateTimeField(default=datetime.utcnow)
     updated_at = DateTimeField(default=datetime.utcnow)
@@ -20,18 +21,41 @@ class DiaryEntry(EmbeddedDocument):
     imported_data = DictField()
 
 class Diary(Document):
-    """代表一天的日記"""
-    user_id = ReferenceField(User, required=True)
+    """代表一天的日記，每個用戶每個本地日期（day_key）只有一份"""
+    user_id = LazyReferenceField(User, required=True)
     date = DateTimeField(default=datetime.utcnow)
+    day_key = IntField()  # User-local calendar day as YYYYMMDD
     entries = ListField(EmbeddedDocumentField(DiaryEntry))
+    mood = IntField(default=0)  # Dominant emotion code of the day, 0 if none
     is_public = BooleanField(default=False)
     created_at = DateTimeField(default=datetime.utcnow)
     updated_at = DateTimeField(default=datetime.utcnow)
 
     meta = {
-        'collection': 'diaries'
+        'collection': 'diaries',
+        'indexes': [
+            {
+                'fields': ['user_id', 'day_key'],
+                'unique': True,
+                'partialFilterExpression': {'day_key': {'$exists': True}}
+            },
+            ('user_id', 'entries.emotions'),
+            # Covers the calendar query, which reads only day_key and mood
+            ('user_id', 'day_key', 'mood'),
+            # Feed reads of high-follower accounts
+            {'fields': ['user_id', '-updated_at'], 'partialFilterExpression': {'is_public': True}},
+            # Shared upload check of the account purge
+            {'fields': ['entries.medias.media_id'], 'sparse': True},
+            # Change polling when change streams are unavailable
+            'updated_at'
+        ]
     }
 
+    def compute_mood(self) -> int:
+        """計算當日出現次數最多的情緒代碼，次數相同時取最先出現者"""
+        counts = Counter(code for entry in self.entries for code in entry.emotions)
+        return counts.most_common(1)[0][0] if counts else 0
+
 class DiaryEntryCreate(BaseModel):
     """日記條目的創建模型"""
     title: str = ""
@@ -63,8 +87,10 @@ class DiaryEntryResponse(BaseModel):
         }
 
 class DiaryCreate(BaseModel):
-    """日記的創建模型"""
-    user_id: str
+    """
+    日記的創建模型，所屬用戶由 access token 決定。
+    `date` 帶時區時會換算成用戶時區的日期；不帶時區時直接視為用戶的本地日期。
+    """
     date: Optional[datetime] = None
     entries: List[DiaryEntryCreate] = []
     is_public: bool = False
@@ -72,7 +98,6 @@ class DiaryCreate(BaseModel):
     class Config:
         json_schema_extra = {
             "example": {
-                "user_id": "user_object_id",
                 "date": "2024-03-21T00:00:00Z",
                 "entries": [
                     {
@@ -89,11 +114,22 @@ class DiaryCreate(BaseModel):
             }
         }
 
+class DiaryCalendarResponse(BaseModel):
+    """
+    年度日曆的精簡響應。
+    `days` 為 base64 編碼的位圖，第 n 位（每個字節由低位起）代表該年第 n 天（從 0 起）是否有日記；
+    `moods` 按日期順序列出每個有日記的日子的主導情緒代碼，0 表示沒有情緒。
+    """
+    year: int
+    days: str
+    moods: List[int] = []
+
 class DiaryResponse(BaseModel):
     """日記的 API 響應模型"""
     id: str = Field(alias="_id")
     user_id: str
     date: datetime
+    day_key: Optional[int] = None
     entries: List[DiaryEntryResponse] = []
     is_public: bool = False
     created_at: datetime
@@ -1,22 +1,35 @@
-from mongoengine import Document, StringField
+from mongoengine import Document, StringField, IntField
 from pydantic import BaseModel, Field
 
 class Emotion(Document):
-    name = StringField(required=True)
+    """情緒目錄，筆記與日記條目以 `code` 儲存情緒"""
+    name = StringField(required=True, unique=True)
+    code = IntField(unique=True, sparse=True)
 
     meta = {
         'collection': 'emotions'
     }
 
+class EmotionCreate(BaseModel):
+    name: str = Field(..., min_length=1, max_length=32)
+
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "name": "nostalgic"
+            }
+        }
+
 class EmotionResponse(BaseModel):
-    id: str = Field(alias="_id")
+    code: int
     name: str
 
     class Config:
         from_attributes = True
         populate_by_name = True
-        schema_extra = {
+        json_schema_extra = {
             "example": {
+                "code": 1,
                 "name": "happy"
             }
-        } 
\ No newline at end of file
+        }
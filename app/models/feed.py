@@ -0,0 +1,58 @@
+from datetime import datetime
+from typing import List, Optional
+from mongoengine import Document, ObjectIdField, DateTimeField
+from pydantic import BaseModel, Field
+from app.models.diary import DiaryResponse
+
+class Follow(Document):
+    """關注關係：follower 關注 followee"""
+    follower_id = ObjectIdField(required=True)
+    followee_id = ObjectIdField(required=True)
+    created_at = DateTimeField(default=datetime.utcnow)
+
+    meta = {
+        'collection': 'follows',
+        'indexes': [
+            {'fields': ['follower_id', 'followee_id'], 'unique': True},
+            # Fan-out to the followers of an author
+            ('followee_id', 'follower_id')
+        ]
+    }
+
+class TimelineItem(Document):
+    """
+    推送到某個用戶動態時間線中的一篇公開日記。
+    每個用戶的時間線只保留最新的 FEED_TIMELINE_SIZE 條左右。
+    """
+    owner_id = ObjectIdField(required=True)
+    diary_id = ObjectIdField(required=True)
+    author_id = ObjectIdField(required=True)
+    published_at = DateTimeField(required=True)
+
+    meta = {
+        'collection': 'timelines',
+        'indexes': [
+            {'fields': ['owner_id', 'diary_id'], 'unique': True},
+            # Feed reads are one range scan of this index
+            ('owner_id', '-published_at', '-diary_id'),
+            # Removing an unpublished or deleted diary from every timeline
+            'diary_id'
+        ]
+    }
+
+class FeedAuthor(BaseModel):
+    id: str = Field(alias="_id")
+    name: str
+    picture: Optional[str] = None
+
+    class Config:
+        populate_by_name = True
+
+class FeedItem(BaseModel):
+    author: FeedAuthor
+    diary: DiaryResponse
+    published_at: datetime
+
+class FeedResponse(BaseModel):
+    items: List[FeedItem] = []
+    next_cursor: Optional[str] = None
@@ -1,41 +1,80 @@
-from typing import Optional
-from mongoengine import Document, EmbeddedDocument, StringField, ObjectIdField
+from datetime import datetime
+from typing import Dict, Optional
+from mongoengine import Document, EmbeddedDocument, StringField, ObjectIdField, IntField, DictField, DateTimeField, ReferenceField
 from pydantic import BaseModel, Field
+from app.models.user import User
 
 class Media(Document):
+    """
+    用戶上傳並處理過的媒體。每個上傳者各有一筆記錄，
+    內容相同（sha256 相同）的記錄共用同一份儲存檔案。
+    """
     type = StringField(required=True)
     url = StringField(required=True)
     description = StringField(default="")
 
+    # Upload pipeline information
+    # Unset while the account purge deletes the files, so uploads no longer reuse them
+    sha256 = StringField()
+    content_type = StringField()
+    size = IntField(default=0)
+    storage_key = StringField()
+    width = IntField()
+    height = IntField()
+    variants = DictField()
+    uploaded_by = ReferenceField(User)
+    created_at = DateTimeField(default=datetime.utcnow)
+
     meta = {
-        'collection': 'medias'
+        'collection': 'medias',
+        'indexes': [
+            # Deduplication, and one record per uploader and content
+            {
+                'fields': ['sha256', 'uploaded_by'],
+                'unique': True,
+                'partialFilterExpression': {'sha256': {'$exists': True}}
+            },
+            # Account purge
+            {'fields': ['uploaded_by'], 'sparse': True},
+            # Files still used by another record
+            'storage_key'
+        ]
     }
 
 class EmbeddedMedia(EmbeddedDocument):
     id = ObjectIdField(default=None, primary_key=True)
+    media_id = ObjectIdField()
     type = StringField(required=True)
     url = StringField(required=True)
     description = StringField(default="")
+    variants = DictField()
 
 class MediaCreate(BaseModel):
-    type: str
-    url: str
+    """
+    附加到筆記或日記條目的媒體。
+    提供 `media_id` 引用已上傳的媒體，或提供 `type` 與 `url` 引用外部資源。
+    """
+    media_id: Optional[str] = None
+    type: Optional[str] = None
+    url: Optional[str] = None
     description: str = ""
 
     class Config:
         json_schema_extra = {
             "example": {
-                "type": "image",
-                "url": "https://example.com/image.jpg",
+                "media_id": "uploaded_media_object_id",
                 "description": "The beautiful sunset I saw today"
             }
         }
 
 class MediaResponse(BaseModel):
-    id: str = Field(alias="_id")
+    id: Optional[str] = Field(default=None, alias="_id")
+    media_id: Optional[str] = None
     type: str
     url: str
     description: str = ""
+    thumbnail_url: Optional[str] = None
+    variants: Dict[str, str] = {}
 
     class Config:
         from_attributes = True
@@ -43,7 +82,12 @@ class MediaResponse(BaseModel):
         json_schema_extra = {
             "example": {
                 "type": "image",
-                "url": "https://example.com/image.jpg",
-                "description": "The beautiful sunset I saw today"
+                "url": "https://example.com/media/ab/ab12....jpg",
+                "description": "The beautiful sunset I saw today",
+                "thumbnail_url": "https://example.com/media/ab/ab12..._thumbnail.jpg",
+                "variants": {
+                    "thumbnail": "https://example.com/media/ab/ab12..._thumbnail.jpg",
+                    "medium": "https://example.com/media/ab/ab12..._medium.jpg"
+                }
             }
-        } 
\ No newline at end of file
+        }
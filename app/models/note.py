@@ -1,41 +1,58 @@
 from datetime import datetime
 from typing import List, Optional
-from mongoengine import Document, ReferenceField, StringField, ListField, DateTimeField, EmbeddedDocumentField
+from mongoengine import Document, LazyReferenceField, StringField, ListField, DateTimeField, EmbeddedDocumentField, IntField, PointField
 from pydantic import BaseModel, Field
 from app.models.user import User
 from app.models.emotion import Emotion
 from app.models.media import Media, MediaResponse, MediaCreate, EmbeddedMedia
 
 class Note(Document):
-    user_id = ReferenceField(User, required=True)
+    user_id = LazyReferenceField(User, required=True)
     content = StringField(required=True)
     content_type = StringField(required=True)
-    emotions = ListField(StringField())
+    emotions = ListField(IntField())
     medias = ListField(EmbeddedDocumentField(EmbeddedMedia))
     created_at = DateTimeField(default=datetime.utcnow)
-    location = StringField()
+    updated_at = DateTimeField(default=datetime.utcnow)
+    location = StringField()  # Place name shown to the user
+    position = PointField(auto_index=False)  # GeoJSON point of the map view
 
     meta = {
-        'collection': 'notes'
+        'collection': 'notes',
+        'indexes': [
+            ('user_id', 'emotions'),
+            # Map queries; 2dsphere indexes skip notes without a position
+            ('user_id', '(position'),
+            # Shared upload check of the account purge
+            {'fields': ['medias.media_id'], 'sparse': True},
+            # Change polling when change streams are unavailable
+            'updated_at'
+        ]
     }
 
+class GeoPoint(BaseModel):
+    """WGS84 座標"""
+    latitude: float = Field(..., ge=-90, le=90)
+    longitude: float = Field(..., ge=-180, le=180)
+
 class NoteCreate(BaseModel):
-    user_id: str
+    """筆記的創建模型，所屬用戶由 access token 決定"""
     content: str
     content_type: str
     emotions: List[str] = []
     medias: List[MediaCreate] = []
     location: Optional[str] = None
+    position: Optional[GeoPoint] = None
 
     class Config:
         json_schema_extra = {
             "example": {
-                "user_id": "user_object_id",
                 "content": "I met an interesting customer today at the coffee shop...",
                 "content_type": "text",
                 "emotions": ["curious", "happy"],
                 "medias": [{"type": "image", "url": "https://example.com/coffee.jpg"}],
-                "location": "Starbucks, Main Street"
+                "location": "Starbucks, Main Street",
+                "position": {"latitude": 25.0330, "longitude": 121.5654}
             }
         }
 
@@ -47,11 +64,25 @@ class NoteResponse(BaseModel):
     emotions: List[str] = []
     medias: List[MediaResponse] = []
     created_at: datetime
+    updated_at: Optional[datetime] = None
     location: Optional[str] = None
+    position: Optional[GeoPoint] = None
+    distance_m: Optional[float] = None  # Only in nearby queries
 
     class Config:
         from_attributes = True
         populate_by_name = True
         json_encoders = {
             datetime: lambda v: v.isoformat() if v else None
-        } 
\ No newline at end of file
+        }
+
+class NoteCluster(BaseModel):
+    """地圖上一個密集區域的筆記，座標為其中筆記的中心點"""
+    latitude: float
+    longitude: float
+    count: int
+
+class NotePageResponse(BaseModel):
+    notes: List[NoteResponse] = []
+    clusters: List[NoteCluster] = []
+    next_cursor: Optional[str] = None
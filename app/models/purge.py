@@ -0,0 +1,45 @@
+from datetime import datetime
+from typing import Dict, Optional
+from mongoengine import Document, ObjectIdField, EmailField, StringField, DictField, DateTimeField
+from pydantic import BaseModel
+
+class AccountPurge(Document):
+    """
+    帳號刪除任務，同時記錄進度以便中斷後續跑。
+    `stage` 之前的階段都已完成，`counts` 為各階段已刪除的數量。
+    """
+    user_id = ObjectIdField(required=True, unique=True)
+    email = EmailField(required=True)
+    status = StringField(default="pending", choices=("pending", "running", "done"))
+    stage = StringField()
+    counts = DictField()
+    error = StringField()
+    lease_until = DateTimeField()  # A worker owns the task until then
+    requested_at = DateTimeField(default=datetime.utcnow)
+    started_at = DateTimeField()
+    updated_at = DateTimeField(default=datetime.utcnow)
+    finished_at = DateTimeField()
+
+    meta = {
+        'collection': 'account_purges',
+        'indexes': [
+            'email',
+            ('status', 'lease_until')
+        ]
+    }
+
+class AccountPurgeResponse(BaseModel):
+    status: str
+    stage: Optional[str] = None
+    counts: Dict[str, int] = {}
+    requested_at: datetime
+
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "status": "pending",
+                "stage": None,
+                "counts": {},
+                "requested_at": "2026-10-19T08:00:00"
+            }
+        }
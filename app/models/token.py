@@ -0,0 +1,26 @@
+from datetime import datetime
+from mongoengine import Document, StringField, DateTimeField
+
+class RefreshToken(Document):
+    """
+    已簽發的 refresh token。
+    同一次登入產生的 token 屬於同一個 family，每次刷新都會輪換成新的 token；
+    撤銷時會撤銷整個 family。過期的記錄由 TTL 索引自動刪除。
+    """
+    jti = StringField(required=True, unique=True)
+    family_id = StringField(required=True)
+    subject = StringField(required=True)
+    exp = DateTimeField(required=True)
+    created_at = DateTimeField(default=datetime.utcnow)
+    used_at = DateTimeField()
+    revoked_at = DateTimeField()
+
+    meta = {
+        'collection': 'refresh_tokens',
+        'indexes': [
+            {'fields': ['exp'], 'expireAfterSeconds': 0},
+            'family_id',
+            'subject',
+            {'fields': ['revoked_at'], 'sparse': True}
+        ]
+    }
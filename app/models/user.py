@@ -23,6 +23,7 @@ class User(Document):
     
     # Preferences
     language = StringField(default="en")
+    timezone = StringField(default="UTC")
     notification_enabled = BooleanField(default=True)
     theme = StringField(default="light")
     
@@ -35,7 +36,11 @@ class User(Document):
     country = StringField()
 
     meta = {
-        'collection': 'users'
+        'collection': 'users',
+        'indexes': [
+            # Accounts at or above FEED_FANOUT_LIMIT, read at feed time
+            'followers_count'
+        ]
     }
 
 class UserResponse(BaseModel):
@@ -51,6 +56,7 @@ class UserResponse(BaseModel):
     followers_count: int = 0
     following_count: int = 0
     language: str = "en"
+    timezone: str = "UTC"
     notification_enabled: bool = True
     theme: str = "light"
     created_at: datetime
@@ -65,6 +71,9 @@ class UserResponse(BaseModel):
             datetime: lambda v: v.isoformat() if v else None
         }
 
+class UserTimezoneUpdate(BaseModel):
+    timezone: str = Field(..., description="IANA timezone name, e.g. Asia/Taipei")
+
 class Token(BaseModel):
     access_token: str
     token_type: str 
\ No newline at end of file
@@ -1,18 +1,25 @@
 # app/routes/auth.py
-from fastapi import APIRouter, Depends, HTTPException, status, Request
+from fastapi import APIRouter, Depends, HTTPException, Response, status
 from fastapi.security import OAuth2PasswordBearer
-from google.oauth2 import id_token
-from google.auth.transport import requests
+from fastapi.concurrency import run_in_threadpool
 from datetime import datetime, timedelta
 import logging
 from app.utils.config import get_settings
-from app.models.user import Token, User, UserResponse
-from app.utils.auth import create_access_token, create_refresh_token, verify_token
+from app.models.purge import AccountPurgeResponse
+from app.models.user import Token, User, UserResponse, UserTimezoneUpdate
+from app.utils.auth import (
+    Principal, create_access_token, decode_token, issue_refresh_token,
+    refresh_tokens, revoke_token_family
+)
+from bson import ObjectId
+from app.utils.cache import cached_json_response, response_cache, user_cache_key
+from app.utils.dates import validate_timezone
+from app.utils.purge import purge_in_progress, request_account_purge
+from app.utils.repositories import get_storage
+from app.utils.revocation import revocation_cache
 from pydantic import BaseModel, Field
-from typing import Dict, Any
+from typing import Any, Dict, Optional
 
-# 設置日誌
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class GoogleSignInRequest(BaseModel):
@@ -28,70 +35,58 @@ class TokenResponse(BaseModel):
     expires_in: int
 
 router = APIRouter(tags=["authentication"])
-settings = get_settings()
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+def verify_google_id_token(token: str) -> Dict[str, Any]:
+    """
+    驗證 Google ID Token。
+    Google 驗證相關模組（及其依賴的 requests）只在登入時才載入，以加快冷啟動。
+    """
+    from google.oauth2 import id_token
+    from google.auth.transport import requests
+
+    return id_token.verify_oauth2_token(
+        token,
+        requests.Request(),
+        get_settings().GOOGLE_CLIENT_ID,
+        clock_skew_in_seconds=10
+    )
+
 @router.post("/google/signin", response_model=TokenResponse, responses={
     401: {"model": ErrorResponse, "description": "Authentication failed"},
     400: {"model": ErrorResponse, "description": "Invalid request"}
 })
-async def google_signin(request: GoogleSignInRequest, raw_request: Request):
+async def google_signin(request: GoogleSignInRequest):
+    settings = get_settings()
     try:
-        # 記錄請求內容
-        body = await raw_request.json()
-        logger.info(f"Received sign-in request with body: {body}")
-        
         if not request.id_token:
             raise ValueError("ID token is required")
             
         # Verify the ID token with clock skew tolerance
-        logger.info("Verifying Google ID token...")
-        idinfo = id_token.verify_oauth2_token(
-            request.id_token,
-            requests.Request(),
-            settings.GOOGLE_CLIENT_ID,
-            clock_skew_in_seconds=10
-        )
-        
-        # 記錄驗證結果
-        logger.info(f"Token verified successfully. Email: {idinfo.get('email')}")
+        idinfo = await run_in_threadpool(verify_google_id_token, request.id_token)
         
         # Get user info from verified token
         email = idinfo['email']
         name = idinfo.get('name', email.split('@')[0])
         picture = idinfo.get('picture')
         
-        # Create or update user in database
-        user = User.objects(email=email).first()
-        if not user:
-            logger.info(f"Creating new user for email: {email}")
-            user = User(
-                email=email,
-                name=name,
-                picture=picture,
-                created_at=datetime.utcnow()
-            )
-            user.save()
-        else:
-            logger.info(f"User found: {email}")
-        
-        # Update last login and active time
-        user.last_login = datetime.utcnow()
-        user.last_active = datetime.utcnow()
-        user.save()
+        # 帳號刪除完成前不允許以同一 email 重新登入
+        if await run_in_threadpool(purge_in_progress, email):
+            raise ValueError("Account deletion in progress")
+
+        # Create the user on first sign-in and update last login and active time
+        user = await run_in_threadpool(get_storage().users.sign_in, email, name, picture)
+        response_cache.invalidate(user_cache_key(user.id))
         
-        # Create tokens
+        # Create tokens; every sign-in starts a new refresh token family
+        refresh_token, family_id = await run_in_threadpool(issue_refresh_token, user.email, str(user.id))
         access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
         access_token = create_access_token(
-            data={"sub": user.email},
+            data={"sub": user.email, "uid": str(user.id), "fid": family_id, "tz": user.timezone or "UTC"},
             expires_delta=access_token_expires
         )
         
-        refresh_token = create_refresh_token(
-            data={"sub": user.email}
-        )
-        
-        logger.info(f"Login successful for user: {email}")
+        logger.info("Login successful", extra={"user_id": str(user.id)})
         return TokenResponse(
             access_token=access_token,
             refresh_token=refresh_token,
@@ -100,62 +95,56 @@ async def google_signin(request: GoogleSignInRequest, raw_request: Request):
         )
         
     except ValueError as e:
-        logger.error(f"Authentication error: {str(e)}")
+        logger.warning("Authentication error: %s", e)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail=f"Authentication failed: {str(e)}"
         )
     except Exception as e:
-        logger.error(f"Unexpected error during sign-in: {str(e)}")
+        logger.exception("Unexpected error during sign-in")
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"Sign-in failed: {str(e)}"
         )
 
-@router.post("/refresh", response_model=TokenResponse)
+@router.post("/refresh", response_model=TokenResponse, responses={
+    401: {"model": ErrorResponse, "description": "Invalid, used or revoked refresh token"}
+})
 async def refresh_token(refresh_token: str = Depends(oauth2_scheme)):
-    try:
-        # 驗證 refresh token
-        email, expiration_time = verify_token(refresh_token, token_type="refresh")
-        
-        # 創建新的 tokens
-        access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
-        access_token = create_access_token(
-            data={"sub": email},
-            expires_delta=access_token_expires
-        )
-        
-        # 檢查是否需要更新 refresh token
-        current_time = datetime.utcnow()
-        time_until_expiry = expiration_time - current_time
-        total_validity = timedelta(minutes=settings.REFRESH_TOKEN_EXPIRE_MINUTES)
-        
-        # 如果剩餘有效期小於一半，創建新的 refresh token
-        if time_until_expiry < (total_validity / 2):
-            logger.info("Creating new refresh token due to approaching expiration")
-            new_refresh_token = create_refresh_token(data={"sub": email})
-        else:
-            new_refresh_token = refresh_token
-        
-        return TokenResponse(
-            access_token=access_token,
-            refresh_token=new_refresh_token,
-            token_type="bearer",
-            expires_in=settings.ACCESS_TOKEN_EXPIRE_MINUTES * 60
-        )
-        
-    except Exception as e:
-        logger.error(f"Error refreshing tokens: {str(e)}")
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail=str(e)
-        )
+    # 每次刷新都會返回新的 refresh token，舊的立即失效
+    tokens = await run_in_threadpool(refresh_tokens, refresh_token)
+    return TokenResponse(**tokens)
+
+@router.post("/logout", status_code=status.HTTP_204_NO_CONTENT, responses={
+    401: {"model": ErrorResponse, "description": "Invalid refresh token"}
+})
+async def logout(refresh_token: str = Depends(oauth2_scheme)):
+    """撤銷 refresh token 所屬的整個 family，該次登入的所有 token 都會失效"""
+    payload = decode_token(refresh_token, token_type="refresh")
+    if payload.get("fid"):
+        await run_in_threadpool(revoke_token_family, payload["fid"])
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+async def is_family_revoked(family_id: Optional[str]) -> bool:
+    """
+    檢查 access token 所屬的登入 family 是否已被撤銷。
+    布隆過濾器判定未撤銷時直接返回；可能命中時才在執行緒池中查詢資料庫，不阻塞事件循環。
+    """
+    if not family_id or not revocation_cache.might_be_revoked([family_id]):
+        return False
+    return await run_in_threadpool(revocation_cache.is_revoked, family_id=family_id)
 
 async def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
     try:
-        # 驗證 access token
-        email, _ = verify_token(token, token_type="access")
-        user = User.objects(email=email).first()
+        # 驗證 access token，並在記憶體中檢查其登入 family 是否已被撤銷
+        payload = decode_token(token, token_type="access")
+        if await is_family_revoked(payload.get("fid")):
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Token has been revoked"
+            )
+        email = payload["sub"]
+        user = await run_in_threadpool(get_storage().users.get_by_email, email)
         if not user:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -163,23 +152,108 @@ async def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
             )
         return user
     except Exception as e:
-        logger.error(f"Error getting current user: {str(e)}")
+        logger.warning("Error getting current user: %s", e)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail=str(e)
         )
 
+async def get_current_principal(token: str = Depends(oauth2_scheme)) -> Principal:
+    """
+    從 access token 解析當前用戶，不查詢資料庫。
+    日記、筆記等路由以此取得操作者，不再接受客戶端傳入的 user_id。
+    """
+    payload = decode_token(token, token_type="access")
+    if await is_family_revoked(payload.get("fid")):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Token has been revoked"
+        )
+
+    user_id = payload.get("uid")
+    if not user_id:
+        # 舊版 access token 沒有用戶 ID
+        user = await run_in_threadpool(get_storage().users.get_by_email, payload["sub"])
+        if not user:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="User not found"
+            )
+        user_id = user.id
+
+    return Principal(
+        user_id=ObjectId(user_id),
+        email=payload["sub"],
+        family_id=payload.get("fid"),
+        timezone=payload.get("tz", "UTC")
+    )
+
+async def get_current_admin(principal: Principal = Depends(get_current_principal)) -> Principal:
+    """只允許 `ADMIN_EMAILS` 中的用戶，用於維護所有用戶共用的資料"""
+    if principal.email not in get_settings().ADMIN_EMAILS:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Administrator access required"
+        )
+    return principal
+
 @router.get("/me", response_model=UserResponse, responses={
     401: {"model": ErrorResponse, "description": "Authentication failed"},
     404: {"model": ErrorResponse, "description": "User not found"}
 })
-async def read_users_me(current_user: User = Depends(get_current_user)):
-    # Update last active time
-    current_user.last_active = datetime.utcnow()
-    current_user.save()
-    
-    # Convert to dict and update _id
-    user_dict = current_user.to_mongo().to_dict()
-    user_dict['_id'] = str(user_dict['_id'])  # Convert ObjectId to string
-    
-    return UserResponse(**user_dict) 
\ No newline at end of file
+async def read_users_me(principal: Principal = Depends(get_current_principal)):
+    def build() -> UserResponse:
+        users = get_storage().users
+        user = users.get(principal.user_id)
+        if not user:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="User not found"
+            )
+
+        # Update last active time; cache hits skip this, so it is written at most once per TTL
+        user.last_active = datetime.utcnow()
+        users.update(user.id, last_active=user.last_active)
+
+        # Convert to dict and update _id
+        user_dict = user.to_mongo().to_dict()
+        user_dict['_id'] = str(user_dict['_id'])  # Convert ObjectId to string
+        return UserResponse(**user_dict)
+
+    return await run_in_threadpool(cached_json_response, user_cache_key(principal.user_id), build)
+
+@router.put("/me/timezone", response_model=UserResponse, responses={
+    400: {"model": ErrorResponse, "description": "Unknown timezone"},
+    401: {"model": ErrorResponse, "description": "Authentication failed"}
+})
+async def update_timezone(update: UserTimezoneUpdate, principal: Principal = Depends(get_current_principal)):
+    """
+    更新用戶時區，日記的日期（day_key）以此時區計算。
+    新的時區在下一次刷新 token 後生效。
+    """
+    try:
+        timezone = validate_timezone(update.timezone)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    await run_in_threadpool(lambda: get_storage().users.update(principal.user_id, timezone=timezone))
+    response_cache.invalidate(user_cache_key(principal.user_id))
+    return await read_users_me(principal)
+
+@router.delete("/me", response_model=AccountPurgeResponse, status_code=status.HTTP_202_ACCEPTED, responses={
+    401: {"model": ErrorResponse, "description": "Authentication failed"}
+})
+async def delete_account(principal: Principal = Depends(get_current_principal)):
+    """
+    刪除帳號及其所有日記、筆記、歸檔與上傳的媒體。
+    所有登入會立即失效；資料由背景任務分批刪除（`python -m app.utils.purge`），完成前不能以同一 email 重新登入。
+    """
+    purge = await run_in_threadpool(request_account_purge, principal.user_id, principal.email)
+    response_cache.invalidate(user_cache_key(principal.user_id))
+    logger.info("Account deletion requested", extra={"user_id": str(principal.user_id)})
+    return AccountPurgeResponse(
+        status=purge.status,
+        stage=purge.stage,
+        counts=dict(purge.counts or {}),
+        requested_at=purge.requested_at
+    )
@@ -1,15 +1,25 @@
-from fastapi import APIRouter, Body, HTTPException, status, Depends, Query
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, BackgroundTasks, Body, HTTPException, status, Depends, Query, Response
 from fastapi.encoders import jsonable_encoder
 from typing import List, Dict, Any
 from app.models.diary import (
     Diary, DiaryEntry, DiaryResponse, DiaryEntryResponse,
-    DiaryCreate, DiaryEntryCreate
+    DiaryCreate, DiaryEntryCreate, DiaryCalendarResponse
 )
-from app.models.user import User
-from app.models.media import EmbeddedMedia, MediaResponse
+from app.models.analytics import DiaryStatsResponse
+from app.routes.auth import get_current_principal
+from app.utils.analytics import build_history, summarize_history
+from app.utils.auth import Principal
+from app.utils.dates import day_start, from_day_key, local_day, to_day_key
+from app.utils.cache import (
+    cached_json_response, diary_cache_key, diary_day_cache_key, response_cache
+)
+from app.utils.emotion_catalog import emotion_catalog
+from app.utils.feed import publish_diary, unpublish_diary
+from app.utils.media import build_embedded_medias, create_media_response
+from app.utils.repositories import get_storage
 from datetime import datetime, date
 from bson import ObjectId
+import base64
 import logging
 
 router = APIRouter(
@@ -17,56 +27,49 @@ router = APIRouter(
 )
 
 @router.post("/", response_description="Add new diary entry", status_code=status.HTTP_201_CREATED, response_model=DiaryResponse)
-def create_or_update_diary(diary_data: DiaryCreate):
+def create_or_update_diary(
+    diary_data: DiaryCreate,
+    background_tasks: BackgroundTasks,
+    principal: Principal = Depends(get_current_principal)
+):
     """
     創建或更新日記條目。
     如果該日期的日記不存在，會自動創建；如果已存在，則添加新條目或更新現有條目。
+    公開的日記會在響應後推送到關注者的動態。
     """
     try:
-        # 驗證用戶存在
-        user = User.objects(id=diary_data.user_id).first()
-        if not user:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="User not found"
-            )
-        
-        entry_date = diary_data.date or datetime.utcnow()
-        
-        # 查找或創建該日的日記
-        diary = Diary.objects(user_id=user, date=entry_date).first()
-        if not diary:
-            diary = Diary(user_id=user, date=entry_date)
+        # 以用戶時區計算該日記所屬的本地日期
+        day = local_day(diary_data.date, principal.timezone)
         
         # 處理每個條目
+        entries = []
         for entry_data in diary_data.entries:
             # 創建媒體對象
-            media_objects = []
-            for media_data in entry_data.medias:
-                media = EmbeddedMedia(
-                    id=ObjectId(),
-                    type=media_data.type,
-                    url=media_data.url,
-                    description=media_data.description
-                )
-                media_objects.append(media)
+            media_objects = build_embedded_medias(entry_data.medias, principal.user_id)
             
             # 創建日記條目
-            entry = DiaryEntry(
+            entries.append(DiaryEntry(
                 id=ObjectId(),
                 title=entry_data.title,
                 content=entry_data.content,
-                emotions=entry_data.emotions,
+                emotions=emotion_catalog.encode(entry_data.emotions),
                 medias=media_objects,
                 tags=entry_data.tags,
                 writing_time_seconds=entry_data.writing_time_seconds,
                 imported_data=entry_data.imported_data
-            )
-            diary.entries.append(entry)
+            ))
         
-        diary.is_public = diary_data.is_public
-        diary.updated_at = datetime.utcnow()
-        diary.save()
+        # 以 (user_id, day_key) 唯一索引原子地查找或創建當日日記並追加條目
+        now = datetime.utcnow()
+        diary = get_storage().diaries.append_entries(
+            principal.user_id, to_day_key(day), entries, diary_data.is_public, day_start(day), now
+        )
+        update_diary_mood(diary, now)
+        invalidate_diary_cache(diary)
+        if diary.is_public:
+            background_tasks.add_task(publish_diary, diary.id, principal.user_id, diary.updated_at)
+        else:
+            background_tasks.add_task(unpublish_diary, diary.id)
         
         return create_diary_response(diary)
             
@@ -83,29 +86,23 @@ def list_diaries(
     limit: int = 100,
     start_date: date = Query(None, description="Start date for diary list"),
     end_date: date = Query(None, description="End date for diary list"),
-    user_id: str = Query(..., description="Filter diaries by user ID")
+    emotion: str = Query(None, description="Only diaries with an entry tagged with this emotion"),
+    principal: Principal = Depends(get_current_principal)
 ):
-    """獲取日記列表，支持日期範圍篩選"""
+    """獲取當前用戶的日記列表，支持日期範圍篩選"""
     try:
-        # 驗證用戶存在
-        user = User.objects(id=user_id).first()
-        if not user:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="User not found"
-            )
-        
-        query = {"user_id": user}
-        if start_date and end_date:
-            query["date__gte"] = start_date
-            query["date__lte"] = end_date
-        elif start_date:
-            query["date__gte"] = start_date
-        elif end_date:
-            query["date__lte"] = end_date
-        
-        diaries = Diary.objects(**query).order_by("-date").skip(skip).limit(limit)
+        diaries = get_storage().diaries.list(
+            principal.user_id,
+            start_key=to_day_key(start_date) if start_date else None,
+            end_key=to_day_key(end_date) if end_date else None,
+            emotion_code=emotion_catalog.code_for(emotion) if emotion else None,
+            skip=skip,
+            limit=limit
+        )
         return [create_diary_response(diary) for diary in diaries]
+    except ValueError as e:
+        # 未知的情緒
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
     except Exception as e:
         logging.error(f"Error listing diaries: {str(e)}")
         raise HTTPException(
@@ -113,17 +110,78 @@ def list_diaries(
             detail=str(e)
         )
 
+@router.get("/calendar", response_description="Get the diary calendar of a year", response_model=DiaryCalendarResponse)
+def get_diary_calendar(
+    year: int = Query(..., ge=1, le=9999, description="Calendar year"),
+    principal: Principal = Depends(get_current_principal)
+):
+    """
+    獲取當前用戶一整年的日曆：哪些日子有日記，以及每天的主導情緒代碼。
+    只讀取 (user_id, day_key, mood) 索引，不會載入日記內容。
+    """
+    try:
+        day_moods = get_storage().diaries.day_moods(principal.user_id, year * 10000 + 101, year * 10000 + 1231)
+        return build_calendar_response(year, day_moods)
+    except Exception as e:
+        logging.error(f"Error getting diary calendar: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(e)
+        )
+
+def build_calendar_response(year: int, day_moods: Dict[int, int]) -> DiaryCalendarResponse:
+    """將 {day_key: 情緒代碼} 打包為位圖與按日期排序的情緒代碼列表"""
+    first_day = date(year, 1, 1).toordinal()
+    bits = bytearray(46)  # 366 天
+    moods = []
+    for day_key in sorted(day_moods):
+        index = from_day_key(day_key).toordinal() - first_day
+        bits[index >> 3] |= 1 << (index & 7)
+        moods.append(day_moods[day_key])
+    return DiaryCalendarResponse(year=year, days=base64.b64encode(bytes(bits)).decode(), moods=moods)
+
+@router.get("/stats", response_description="Get diary statistics", response_model=DiaryStatsResponse)
+def get_diary_stats(
+    principal: Principal = Depends(get_current_principal),
+    start_date: date = Query(None, description="Start date for stats"),
+    end_date: date = Query(None, description="End date for stats"),
+    window: int = Query(7, ge=1, le=365, description="Rolling window in days for emotion trends")
+):
+    """
+    獲取日記統計信息，包括情感分佈、滾動情緒頻率、連續天數、寫作時間趨勢，
+    以及 imported_data 指標與情緒的相關性
+    """
+    try:
+        history = build_history(get_storage().diaries.history(
+            principal.user_id,
+            to_day_key(start_date) if start_date else None,
+            to_day_key(end_date) if end_date else None
+        ))
+        stats = summarize_history(history, window, local_day(None, principal.timezone), emotion_catalog.all())
+        return DiaryStatsResponse(start_date=start_date, end_date=end_date, **stats)
+    except Exception as e:
+        logging.error(f"Error getting diary stats: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(e)
+        )
+
 @router.get("/{id}", response_description="Get a single diary", response_model=DiaryResponse)
-def get_diary(id: str):
+def get_diary(id: str, principal: Principal = Depends(get_current_principal)):
     """獲取單個日記的詳細信息"""
-    try:
-        diary = Diary.objects(id=id).first()
+    def build() -> DiaryResponse:
+        diary = get_storage().diaries.get(principal.user_id, id)
         if not diary:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail=f"Diary {id} not found"
             )
         return create_diary_response(diary)
+
+    try:
+        return cached_json_response(diary_cache_key(principal.user_id, id), build)
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Error getting diary: {str(e)}")
         raise HTTPException(
@@ -134,24 +192,22 @@ def get_diary(id: str):
 @router.get("/by-date/{date}", response_description="Get diary for a specific date", response_model=DiaryResponse)
 def get_diary_by_date(
     date: date,
-    user_id: str = Query(..., description="Filter diary by user ID")
+    principal: Principal = Depends(get_current_principal)
 ):
-    """獲取指定日期的日記"""
-    try:
-        user = User.objects(id=user_id).first()
-        if not user:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="User not found"
-            )
-        
-        diary = Diary.objects(user_id=user, date=date).first()
+    """獲取當前用戶指定日期的日記"""
+    def build() -> DiaryResponse:
+        diary = get_storage().diaries.get_by_day(principal.user_id, to_day_key(date))
         if not diary:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail=f"Diary for date {date} not found"
             )
         return create_diary_response(diary)
+
+    try:
+        return cached_json_response(diary_day_cache_key(principal.user_id, date), build)
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Error getting diary by date: {str(e)}")
         raise HTTPException(
@@ -159,26 +215,38 @@ def get_diary_by_date(
             detail=str(e)
         )
 
+def update_diary_mood(diary: Diary, updated_at: datetime) -> None:
+    """
+    重新計算日記的主導情緒。
+    只在日記沒有被之後的請求再次修改時寫入，較新的請求會自行更新。
+    """
+    mood = diary.compute_mood()
+    if mood != diary.mood:
+        get_storage().diaries.set_mood(diary.id, mood, updated_at)
+        diary.mood = mood
+
+def invalidate_diary_cache(diary: Diary) -> None:
+    """清除日記在快取中的所有響應（按 ID 與按日期）"""
+    day = from_day_key(diary.day_key) if diary.day_key else diary.date.date()
+    response_cache.invalidate(
+        diary_cache_key(diary.user_id.id, diary.id),
+        diary_day_cache_key(diary.user_id.id, day)
+    )
+
 def create_diary_response(diary: Diary) -> DiaryResponse:
     """創建日記響應對象"""
     return DiaryResponse(
         _id=str(diary.id),
         user_id=str(diary.user_id.id),
         date=diary.date,
+        day_key=diary.day_key,
         entries=[
             DiaryEntryResponse(
                 _id=str(entry.id),
                 title=entry.title,
                 content=entry.content,
-                emotions=entry.emotions,
-                medias=[
-                    MediaResponse(
-                        _id=str(m.id),
-                        type=m.type,
-                        url=m.url,
-                        description=m.description
-                    ) for m in entry.medias
-                ],
+                emotions=emotion_catalog.decode(entry.emotions),
+                medias=[create_media_response(m) for m in entry.medias],
                 created_at=entry.created_at,
                 updated_at=entry.updated_at,
                 tags=entry.tags,
@@ -192,29 +260,33 @@ def create_diary_response(diary: Diary) -> DiaryResponse:
     )
 
 @router.delete("/{id}", response_description="Delete a diary")
-def delete_diary(id: str):
+def delete_diary(id: str, principal: Principal = Depends(get_current_principal)):
     """刪除指定的日記"""
-    delete_result = Diary.objects(id=id).delete()
-    if delete_result == 1:
-        return JSONResponse(status_code=status.HTTP_204_NO_CONTENT)
+    deleted = get_storage().diaries.delete(principal.user_id, id)
+    if deleted:
+        invalidate_diary_cache(deleted)
+        unpublish_diary(deleted.id)
+        return Response(status_code=status.HTTP_204_NO_CONTENT)
     raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Diary {id} not found")
 
 @router.delete("/{diary_id}/entries/{entry_id}", response_description="Delete a diary entry")
-def delete_diary_entry(diary_id: str, entry_id: str):
+def delete_diary_entry(diary_id: str, entry_id: str, principal: Principal = Depends(get_current_principal)):
     """刪除日記中的特定條目"""
-    diary = Diary.objects(id=diary_id).first()
+    diary = get_storage().diaries.get_for_update(principal.user_id, diary_id)
     if not diary:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Diary {diary_id} not found")
     
     # 移除指定的條目
     diary.entries = [entry for entry in diary.entries if str(entry.id) != entry_id]
+    diary.mood = diary.compute_mood()
     diary.updated_at = datetime.utcnow()
-    diary.save()
+    get_storage().diaries.save(diary)
+    invalidate_diary_cache(diary)
     
-    return JSONResponse(status_code=status.HTTP_204_NO_CONTENT)
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 @router.post("/{id}/analyze", response_description="Analyze a diary")
-def analyze_diary(id: str):
+def analyze_diary(id: str, principal: Principal = Depends(get_current_principal)):
     """
     對日記進行AI分析
     分析結果將保存在單獨的集合中，不會修改原始日記
@@ -222,13 +294,3 @@ def analyze_diary(id: str):
     # TODO: Call AI service to analyze the diary
     # Save the analysis result to a separate collection
     pass
-
-@router.get("/stats", response_description="Get diary statistics")
-def get_diary_stats(
-    user_id: str = Query(..., description="Get stats for specific user"),
-    start_date: date = Query(None, description="Start date for stats"),
-    end_date: date = Query(None, description="End date for stats")
-):
-    """獲取日記統計信息，包括情感分佈、月度報告等"""
-    # TODO: Calculate and return diary statistics
-    pass 
\ No newline at end of file
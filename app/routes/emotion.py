@@ -0,0 +1,32 @@
+from fastapi import APIRouter, Depends, HTTPException, status
+from typing import List
+import logging
+from app.models.emotion import EmotionCreate, EmotionResponse
+from app.routes.auth import get_current_admin
+from app.utils.auth import Principal
+from app.utils.emotion_catalog import emotion_catalog
+
+router = APIRouter(
+    tags=["emotions"],
+)
+
+@router.get("/", response_description="List the emotion catalog", response_model=List[EmotionResponse])
+def list_emotions():
+    """獲取情緒目錄，直接由記憶體中的快取返回"""
+    return [
+        EmotionResponse(code=code, name=name)
+        for code, name in sorted(emotion_catalog.all().items())
+    ]
+
+@router.post("/", response_description="Add an emotion to the catalog", status_code=status.HTTP_201_CREATED, response_model=EmotionResponse)
+def create_emotion(emotion_data: EmotionCreate, admin: Principal = Depends(get_current_admin)):
+    """新增情緒到所有用戶共用的目錄中，只有管理員可以新增"""
+    try:
+        emotion = emotion_catalog.create(emotion_data.name)
+        return EmotionResponse(code=emotion.code, name=emotion.name)
+    except ValueError as e:
+        logging.error(f"Error creating emotion: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=str(e)
+        )
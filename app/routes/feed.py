@@ -0,0 +1,92 @@
+from fastapi import APIRouter, HTTPException, status, Depends, Query, Response
+from typing import Optional
+from app.models.feed import FeedAuthor, FeedItem, FeedResponse
+from app.routes.auth import get_current_principal
+from app.routes.diary import create_diary_response
+from app.utils.auth import Principal
+from app.utils.feed import decode_cursor, encode_cursor, feeds_enabled, follow, read_feed, unfollow
+from app.utils.repositories import get_storage
+from bson import ObjectId
+from bson.errors import InvalidId
+import logging
+
+def require_feeds():
+    """動態只支援 MongoDB 存儲後端，其他後端返回 503"""
+    if not feeds_enabled():
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Feeds are not available with this storage backend"
+        )
+
+router = APIRouter(
+    tags=["feed"],
+    dependencies=[Depends(require_feeds)],
+)
+
+MAX_FEED_PAGE_SIZE = 50
+
+@router.get("/", response_description="Get the feed of followed users", response_model=FeedResponse)
+def get_feed(
+    limit: int = Query(20, ge=1, le=MAX_FEED_PAGE_SIZE),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page"),
+    principal: Principal = Depends(get_current_principal)
+):
+    """
+    獲取關注用戶的公開日記動態，由新到舊排列，以 next_cursor 取得下一頁。
+    動態只保留每個用戶最近的 FEED_TIMELINE_SIZE 條左右。
+    """
+    try:
+        before = decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    try:
+        items = read_feed(principal.user_id, before, limit)
+        storage = get_storage()
+        # 已歸檔的日記按歸檔批量讀取；已刪除或改為私密、但尚未從時間線移除的日記不會返回
+        diaries = {
+            diary.id: diary
+            for diary in storage.diaries.get_public([(author_id, diary_id) for _, diary_id, author_id in items])
+        }
+        authors = {user.id: user for user in storage.users.get_many(list({author_id for _, _, author_id in items}))}
+
+        feed = []
+        for published_at, diary_id, author_id in items:
+            diary, author = diaries.get(diary_id), authors.get(author_id)
+            if diary is None or author is None:
+                continue
+            feed.append(FeedItem(
+                author=FeedAuthor(_id=str(author.id), name=author.name, picture=author.picture),
+                diary=create_diary_response(diary),
+                published_at=published_at
+            ))
+        next_cursor = encode_cursor(items[-1][:2]) if len(items) == limit else None
+        return FeedResponse(items=feed, next_cursor=next_cursor)
+    except Exception as e:
+        logging.error(f"Error getting feed: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(e)
+        )
+
+@router.put("/following/{user_id}", response_description="Follow a user")
+def follow_user(user_id: str, principal: Principal = Depends(get_current_principal)):
+    """關注用戶，其最近的公開日記會立即出現在動態中"""
+    if user_id == str(principal.user_id):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Cannot follow yourself")
+    try:
+        follow(principal.user_id, ObjectId(user_id))
+    except (InvalidId, ValueError) as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+@router.delete("/following/{user_id}", response_description="Unfollow a user")
+def unfollow_user(user_id: str, principal: Principal = Depends(get_current_principal)):
+    """取消關注用戶，並從動態中移除其日記"""
+    try:
+        unfollowed = unfollow(principal.user_id, ObjectId(user_id))
+    except InvalidId as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+    if not unfollowed:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Not following user {user_id}")
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
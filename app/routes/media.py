@@ -0,0 +1,94 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from fastapi.concurrency import run_in_threadpool
+from bson import ObjectId
+from mongoengine import NotUniqueError
+import logging
+from app.models.media import Media, MediaResponse
+from app.models.user import User
+from app.routes.auth import get_current_principal, get_current_user
+from app.utils.auth import Principal
+from app.utils.config import get_settings
+from app.utils.media import (
+    IMAGE_VARIANT_SIZES, MediaTooLargeError, create_media_response, delete_media_files, get_media_storage,
+    new_storage_key, process_image, resolve_media_type, reuse_media
+)
+
+router = APIRouter(
+    tags=["media"],
+)
+
+@router.post("/", response_description="Upload a media file", status_code=status.HTTP_201_CREATED, response_model=MediaResponse)
+async def upload_media(
+    request: Request,
+    description: str = Query("", description="Default description of the media"),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    以串流方式上傳媒體檔案，請求體為檔案的原始位元組，並以 Content-Type 標示類型。
+    相同內容的檔案只會儲存一次；圖片會在背景進程中產生縮圖與縮小版本。
+    """
+    settings = get_settings()
+    storage = get_media_storage()
+
+    try:
+        media_type, extension = resolve_media_type(request.headers.get("content-type", ""))
+        temp_path, digest, size = await storage.write_stream(
+            request.stream(), settings.MEDIA_MAX_UPLOAD_BYTES
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, detail=str(e))
+    except MediaTooLargeError as e:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+
+    if size == 0:
+        storage.discard(temp_path)
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Empty upload")
+
+    # 相同內容已存在則共用已儲存的檔案，不再處理
+    existing = await run_in_threadpool(reuse_media, digest, current_user, description)
+    if existing:
+        storage.discard(temp_path)
+        return create_media_response(existing)
+
+    key = new_storage_key(digest, extension)
+    media = Media(
+        type=media_type,
+        url=storage.url_for(key),
+        description=description,
+        sha256=digest,
+        content_type=request.headers.get("content-type", "").split(";")[0].strip().lower(),
+        size=size,
+        storage_key=key,
+        uploaded_by=current_user
+    )
+    try:
+        storage.commit(temp_path, key)
+        if media_type == "image":
+            processed = await process_image(storage, key)
+            media.width = processed["width"]
+            media.height = processed["height"]
+            media.variants = processed["variants"]
+
+        await run_in_threadpool(media.save)
+        return create_media_response(media)
+    except NotUniqueError:
+        # 同一用戶同時上傳了相同內容
+        delete_media_files(storage, key, IMAGE_VARIANT_SIZES)
+        media = await run_in_threadpool(lambda: Media.objects(sha256=digest, uploaded_by=current_user).first())
+        return create_media_response(media)
+    except Exception as e:
+        storage.discard(temp_path)
+        delete_media_files(storage, key, IMAGE_VARIANT_SIZES)
+        logging.error(f"Error processing media upload: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid media: {str(e)}"
+        )
+
+@router.get("/{id}", response_description="Get media metadata", response_model=MediaResponse)
+def get_media(id: str, principal: Principal = Depends(get_current_principal)):
+    """獲取當前用戶上傳的媒體的資訊"""
+    media = Media.objects(id=id, uploaded_by=principal.user_id).first() if ObjectId.is_valid(id) else None
+    if not media:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Media {id} not found")
+    return create_media_response(media)
@@ -0,0 +1,17 @@
+from fastapi import APIRouter
+from app.utils.cache import response_cache
+from app.utils.sync import change_hub
+
+router = APIRouter(
+    tags=["metrics"],
+)
+
+@router.get("/cache", response_description="Response cache statistics")
+def get_cache_stats():
+    """獲取本 worker 進程的響應快取命中率等統計"""
+    return response_cache.stats()
+
+@router.get("/sync", response_description="Change notification statistics")
+async def get_sync_stats():
+    """獲取本 worker 進程的變更通知模式與訂閱數"""
+    return change_hub.stats()
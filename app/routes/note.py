@@ -1,9 +1,13 @@
-from fastapi import APIRouter, Body, HTTPException, status
+from fastapi import APIRouter, Body, HTTPException, status, Query, Depends
 from fastapi.responses import JSONResponse
-from typing import List
-from app.models.note import Note, NoteCreate, NoteResponse
-from app.models.user import User
-from app.models.media import EmbeddedMedia, MediaResponse
+from typing import List, Optional
+from app.models.note import GeoPoint, Note, NoteCluster, NoteCreate, NotePageResponse, NoteResponse
+from app.routes.auth import get_current_principal
+from app.utils.auth import Principal
+from app.utils.emotion_catalog import emotion_catalog
+from app.utils.geo import Box, decode_cursor, encode_cursor, point
+from app.utils.media import build_embedded_medias, create_media_response
+from app.utils.repositories import get_storage
 from bson import ObjectId
 import logging
 
@@ -12,37 +16,22 @@ router = APIRouter(
 )
 
 @router.post("/", response_description="Add new note", status_code=status.HTTP_201_CREATED, response_model=NoteResponse)
-def create_note(note_data: NoteCreate):
+def create_note(note_data: NoteCreate, principal: Principal = Depends(get_current_principal)):
     try:
-        # 驗證用戶存在
-        user = User.objects(id=note_data.user_id).first()
-        if not user:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="User not found"
-            )
-        
         # 創建媒體對象
-        media_objects = []
-        for media_data in note_data.medias:
-            media = EmbeddedMedia(
-                id=ObjectId(),
-                type=media_data.type,
-                url=media_data.url,
-                description=media_data.description
-            )
-            media_objects.append(media)
+        media_objects = build_embedded_medias(note_data.medias, principal.user_id)
         
         # 創建筆記
         note = Note(
-            user_id=user,
+            user_id=principal.user_id,
             content=note_data.content,
             content_type=note_data.content_type,
-            emotions=note_data.emotions,
+            emotions=emotion_catalog.encode(note_data.emotions),
             medias=media_objects,
-            location=note_data.location
+            location=note_data.location,
+            position=point(note_data.position.longitude, note_data.position.latitude) if note_data.position else None
         )
-        note.save()
+        get_storage().notes.create(note)
         
         return create_note_response(note)
     except Exception as e:
@@ -53,10 +42,24 @@ def create_note(note_data: NoteCreate):
         )
 
 @router.get("/", response_description="List all notes", response_model=List[NoteResponse])
-def list_notes(skip: int = 0, limit: int = 100):
+def list_notes(
+    skip: int = 0,
+    limit: int = 100,
+    emotion: str = Query(None, description="Only notes tagged with this emotion"),
+    principal: Principal = Depends(get_current_principal)
+):
+    """獲取當前用戶的隨手記列表"""
     try:
-        notes = Note.objects().skip(skip).limit(limit)
+        notes = get_storage().notes.list(
+            principal.user_id,
+            emotion_code=emotion_catalog.code_for(emotion) if emotion else None,
+            skip=skip,
+            limit=limit
+        )
         return [create_note_response(note) for note in notes]
+    except ValueError as e:
+        # 未知的情緒
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
     except Exception as e:
         logging.error(f"Error listing notes: {str(e)}")
         raise HTTPException(
@@ -64,22 +67,118 @@ def list_notes(skip: int = 0, limit: int = 100):
             detail=str(e)
         )
 
-def create_note_response(note: Note) -> NoteResponse:
+# 地圖查詢的上限
+MAX_NEARBY_RADIUS_M = 50_000
+MAX_MAP_PAGE_SIZE = 200
+MAX_CLUSTER_GRID = 32
+
+@router.get("/nearby", response_description="List notes near a point", response_model=NotePageResponse)
+def list_nearby_notes(
+    latitude: float = Query(..., ge=-90, le=90),
+    longitude: float = Query(..., ge=-180, le=180),
+    radius: float = Query(1000, gt=0, le=MAX_NEARBY_RADIUS_M, description="Radius in meters"),
+    limit: int = Query(50, ge=1, le=MAX_MAP_PAGE_SIZE),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page"),
+    principal: Principal = Depends(get_current_principal)
+):
+    """按距離由近到遠列出當前用戶在半徑內的筆記，以 next_cursor 取得下一頁"""
+    try:
+        after = None
+        if cursor:
+            last_id, distance = decode_cursor(cursor)
+            if distance is None:
+                raise ValueError("Invalid cursor")
+            after = (distance, last_id)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    try:
+        found = get_storage().notes.nearby(principal.user_id, longitude, latitude, radius, after, limit)
+        next_cursor = None
+        if len(found) == limit:
+            last_note, last_distance = found[-1]
+            next_cursor = encode_cursor(last_note.id, last_distance)
+        return NotePageResponse(
+            notes=[create_note_response(note, distance) for note, distance in found],
+            next_cursor=next_cursor
+        )
+    except Exception as e:
+        logging.error(f"Error listing nearby notes: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(e)
+        )
+
+@router.get("/map", response_description="List notes inside a map region", response_model=NotePageResponse)
+def list_map_notes(
+    west: float = Query(..., ge=-180, le=180, description="West edge longitude; greater than east across the antimeridian"),
+    south: float = Query(..., ge=-90, le=90),
+    east: float = Query(..., ge=-180, le=180),
+    north: float = Query(..., ge=-90, le=90),
+    cluster: bool = Query(True, description="Group dense areas into clusters"),
+    grid: int = Query(8, ge=1, le=MAX_CLUSTER_GRID, description="Clustering grid cells per side"),
+    min_cluster: int = Query(5, ge=2, le=100, description="Fewest notes in a cell shown as a cluster"),
+    limit: int = Query(100, ge=1, le=MAX_MAP_PAGE_SIZE, description="Page size of the notes"),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page"),
+    principal: Principal = Depends(get_current_principal)
+):
+    """
+    獲取地圖可見區域內的筆記。
+    cluster=true 時將區域分成 grid × grid 個格子，筆記數達 min_cluster 的格子以聚合點返回，其餘格子的筆記按建立順序分頁返回；
+    cluster=false 時按建立順序分頁返回區域內所有筆記。
+    """
+    try:
+        box = Box(west=west, south=south, east=east, north=north)
+        after_id = decode_cursor(cursor)[0] if cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    try:
+        notes = get_storage().notes
+        if not cluster:
+            page = notes.in_box(principal.user_id, box, after_id, limit)
+            return NotePageResponse(
+                notes=[create_note_response(note) for note in page],
+                next_cursor=encode_cursor(page[-1].id) if len(page) == limit else None
+            )
+
+        clusters, sparse_ids = [], []
+        for cell in notes.box_cells(principal.user_id, box, grid, grid, min_cluster):
+            if cell["count"] >= min_cluster:
+                clusters.append(NoteCluster(longitude=cell["longitude"], latitude=cell["latitude"], count=cell["count"]))
+            else:
+                sparse_ids.extend(cell["ids"])
+        # 未聚合的筆記按建立順序分頁，聚合點只在第一頁返回
+        sparse_ids = sorted(note_id for note_id in sparse_ids if after_id is None or note_id > after_id)
+        page_ids = sparse_ids[:limit]
+        return NotePageResponse(
+            notes=[create_note_response(note) for note in notes.get_many(principal.user_id, page_ids)],
+            clusters=clusters if after_id is None else [],
+            next_cursor=encode_cursor(page_ids[-1]) if len(sparse_ids) > limit else None
+        )
+    except Exception as e:
+        logging.error(f"Error listing map notes: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(e)
+        )
+
+def create_note_response(note: Note, distance_m: Optional[float] = None) -> NoteResponse:
     """創建筆記響應對象"""
+    position = None
+    if note.position:
+        longitude, latitude = note.position["coordinates"] if isinstance(note.position, dict) else note.position
+        position = GeoPoint(latitude=latitude, longitude=longitude)
     return NoteResponse(
         _id=str(note.id),
         user_id=str(note.user_id.id),
         content=note.content,
         content_type=note.content_type,
-        emotions=note.emotions,
-        medias=[
-            MediaResponse(
-                _id=str(m.id) if hasattr(m, 'id') else None,
-                type=m.type,
-                url=m.url,
-                description=m.description
-            ) for m in note.medias
-        ],
+        emotions=emotion_catalog.decode(note.emotions),
+        medias=[create_media_response(m) for m in note.medias],
         created_at=note.created_at,
-        location=note.location
+        updated_at=note.updated_at,
+        location=note.location,
+        position=position,
+        distance_m=round(distance_m, 1) if distance_m is not None else None
     ) 
\ No newline at end of file
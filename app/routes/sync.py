@@ -0,0 +1,52 @@
+import asyncio
+import json
+from typing import Optional
+from fastapi import APIRouter, Depends, Header, Request
+from fastapi.responses import StreamingResponse
+from app.routes.auth import get_current_principal
+from app.utils.auth import Principal
+from app.utils.config import get_settings
+from app.utils.sync import change_hub
+
+router = APIRouter(
+    tags=["sync"],
+)
+
+@router.get("/events", response_description="Stream of diary and note changes")
+async def stream_changes(
+    request: Request,
+    last_event_id: Optional[str] = Header(None, description="ID of the last received event, sent by EventSource on reconnect"),
+    principal: Principal = Depends(get_current_principal)
+):
+    """
+    以 Server-Sent Events 推送當前用戶的日記與筆記變更，取代客戶端輪詢列表。
+    重新連線時帶上 `Last-Event-ID` 可補發期間錯過的事件；無法補發時會收到 `resync` 事件。
+    """
+    subscriber = change_hub.subscribe(str(principal.user_id), last_event_id)
+    heartbeat = get_settings().SYNC_HEARTBEAT_SECONDS
+
+    async def events():
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    event_id, payload = await asyncio.wait_for(subscriber.queue.get(), heartbeat)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    # 保持連線，避免被代理伺服器中斷
+                    yield ": keep-alive\n\n"
+                    continue
+
+                lines = [f"id: {event_id}"] if event_id else []
+                lines.append(f"event: {'resync' if payload['type'] == 'resync' else 'change'}")
+                lines.append(f"data: {json.dumps(payload)}")
+                yield "\n".join(lines) + "\n\n"
+        finally:
+            change_hub.unsubscribe(subscriber)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
@@ -0,0 +1,200 @@
+# app/utils/analytics.py
+"""
+Mood-trend analytics over a user's diary history.
+
+The history is read with one projected query (see `DiaryRepository.history`)
+and turned into per-day columns once; every statistic is then computed
+with NumPy array operations instead of Python loops over documents.
+"""
+import math
+from dataclasses import dataclass
+from datetime import date
+from typing import Any, Dict, Iterable
+
+from app.utils.dates import from_day_key
+
+# Fewest days with a metric before its correlations are reported
+MIN_CORRELATION_DAYS = 10
+MAX_CORRELATIONS = 20
+# Longest rolling series returned; longer ranges are downsampled
+MAX_TREND_POINTS = 366
+
+@dataclass
+class History:
+    """Per-day columns of a user's diaries, ordered by day."""
+    day_keys: Any  # int64 YYYYMMDD
+    days: Any  # int64 date ordinals
+    emotions: Any  # (days, codes) number of entries tagged with each code
+    entries: Any  # int64 entries per day
+    writing_seconds: Any  # float64 writing time per day
+    metrics: Dict[str, Any]  # float64 per-day sums of numeric imported_data, NaN when absent
+
+
+def build_history(docs: Iterable[dict]) -> History:
+    """Turns raw diary documents into columnar arrays."""
+    import numpy as np
+
+    docs = list(docs)
+
+    # The only pass over documents: flatten them into coordinate lists
+    count = len(docs)
+    day_keys = np.empty(count, dtype=np.int64)
+    entries = np.zeros(count, dtype=np.int64)
+    writing = np.zeros(count, dtype=np.float64)
+    emotion_rows, emotion_codes = [], []
+    metric_rows, metric_names, metric_values = [], [], []
+    for row, doc in enumerate(docs):
+        day_keys[row] = doc["day_key"]
+        entries[row] = len(doc.get("entries", []))
+        for entry in doc.get("entries", []):
+            writing[row] += entry.get("writing_time_seconds") or 0
+            for code in entry.get("emotions", []):
+                if isinstance(code, int):
+                    emotion_rows.append(row)
+                    emotion_codes.append(code)
+            for name, value in (entry.get("imported_data") or {}).items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value):
+                    metric_rows.append(row)
+                    metric_names.append(name)
+                    metric_values.append(value)
+
+    emotions = np.zeros((count, max(emotion_codes, default=0) + 1), dtype=np.int64)
+    np.add.at(emotions, (np.asarray(emotion_rows, dtype=np.intp), np.asarray(emotion_codes, dtype=np.intp)), 1)
+
+    metrics = {}
+    if metric_rows:
+        names, name_index = np.unique(np.asarray(metric_names), return_inverse=True)
+        rows = np.asarray(metric_rows, dtype=np.intp)
+        sums = np.zeros((len(names), count))
+        present = np.zeros((len(names), count), dtype=bool)
+        np.add.at(sums, (name_index, rows), metric_values)
+        present[name_index, rows] = True
+        metrics = {str(name): np.where(present[i], sums[i], np.nan) for i, name in enumerate(names)}
+
+    order = np.argsort(day_keys, kind="stable")
+    days = np.fromiter((from_day_key(int(key)).toordinal() for key in day_keys[order]), dtype=np.int64, count=count)
+    return History(
+        day_keys=day_keys[order],
+        days=days,
+        emotions=emotions[order],
+        entries=entries[order],
+        writing_seconds=writing[order],
+        metrics={name: values[order] for name, values in metrics.items()},
+    )
+
+
+def emotion_trend(history: History, window: int, names: Dict[int, str]) -> Dict:
+    """Share of each emotion among all emotion tags in a rolling window of days."""
+    import numpy as np
+
+    if not len(history.days):
+        return {"start_date": None, "window": window, "step_days": 1, "series": {}}
+
+    first = history.days[0]
+    span = int(history.days[-1] - first + 1)
+    window = min(window, span)
+    dense = np.zeros((span, history.emotions.shape[1]))
+    np.add.at(dense, history.days - first, history.emotions)
+
+    cumulative = np.vstack([np.zeros((1, dense.shape[1])), np.cumsum(dense, axis=0)])
+    rolling = cumulative[window:] - cumulative[:-window]
+    totals = rolling.sum(axis=1, keepdims=True)
+    shares = np.divide(rolling, totals, out=np.zeros_like(rolling), where=totals > 0)
+
+    step = max(1, math.ceil(len(shares) / MAX_TREND_POINTS))
+    # Sample backwards from the last day so the latest value is always included
+    shares = shares[::-1][::step][::-1]
+    start = first + window - 1 + (len(rolling) - 1) % step
+    codes = np.flatnonzero(history.emotions.sum(axis=0))
+    return {
+        "start_date": date.fromordinal(int(start)),
+        "window": window,
+        "step_days": step,
+        "series": {
+            names.get(int(code), str(code)): np.round(shares[:, code], 4).tolist() for code in codes
+        },
+    }
+
+
+def streaks(history: History, today: date) -> Dict[str, int]:
+    """Current and longest runs of consecutive days with a diary."""
+    import numpy as np
+
+    days = np.unique(history.days)
+    if not len(days):
+        return {"current": 0, "longest": 0}
+    breaks = np.flatnonzero(np.diff(days) != 1)
+    run_lengths = np.diff(np.concatenate(([-1], breaks, [len(days) - 1])))
+    # A streak is still current if the last diary was written today or yesterday
+    current = int(run_lengths[-1]) if days[-1] >= today.toordinal() - 1 else 0
+    return {"current": current, "longest": int(run_lengths.max())}
+
+
+def writing_time_trend(history: History) -> Dict:
+    """Writing time totals, monthly averages and the linear trend per day."""
+    import numpy as np
+
+    if not len(history.days):
+        return {}
+    months, month_index = np.unique(history.day_keys // 100, return_inverse=True)
+    monthly = np.bincount(month_index, weights=history.writing_seconds) / np.bincount(month_index)
+
+    slope = 0.0
+    if history.days[-1] > history.days[0]:
+        slope = float(np.polyfit(history.days - history.days[0], history.writing_seconds, 1)[0])
+    return {
+        "total_seconds": int(history.writing_seconds.sum()),
+        "average_seconds_per_day": round(float(history.writing_seconds.mean()), 2),
+        "monthly_average_seconds": {
+            f"{month // 100:04d}-{month % 100:02d}": round(float(value), 2)
+            for month, value in zip(months.tolist(), monthly)
+        },
+        "slope_seconds_per_day": round(slope, 4),
+    }
+
+
+def metric_correlations(history: History, names: Dict[int, str]):
+    """
+    Pearson correlation between each imported_data metric and whether an
+    emotion was recorded that day, over the days the metric was present.
+    """
+    import numpy as np
+
+    codes = np.flatnonzero(history.emotions.sum(axis=0))
+    presence = (history.emotions[:, codes] > 0).astype(np.float64)
+    correlations = []
+    for metric, values in history.metrics.items():
+        mask = ~np.isnan(values)
+        days = int(mask.sum())
+        if days < MIN_CORRELATION_DAYS or not len(codes):
+            continue
+        x = values[mask] - values[mask].mean()
+        y = presence[mask] - presence[mask].mean(axis=0)
+        denominator = np.sqrt((x ** 2).sum() * (y ** 2).sum(axis=0))
+        r = np.divide(x @ y, denominator, out=np.full(len(codes), np.nan), where=denominator > 0)
+        for code, value in zip(codes, r):
+            if np.isfinite(value):
+                correlations.append({
+                    "metric": metric,
+                    "emotion": names.get(int(code), str(code)),
+                    "r": round(float(value), 4),
+                    "days": days,
+                })
+
+    correlations.sort(key=lambda c: abs(c["r"]), reverse=True)
+    return correlations[:MAX_CORRELATIONS]
+
+
+def summarize_history(history: History, window: int, today: date, names: Dict[int, str]) -> Dict:
+    totals = history.emotions.sum(axis=0)
+    return {
+        "days": int(len(history.days)),
+        "entries": int(history.entries.sum()),
+        "emotion_distribution": {
+            names.get(code, str(code)): int(totals[code]) for code in totals.nonzero()[0].tolist()
+        },
+        "emotion_trend": emotion_trend(history, window, names),
+        "streaks": streaks(history, today),
+        "writing_time": writing_time_trend(history),
+        "correlations": metric_correlations(history, names),
+    }
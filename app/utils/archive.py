@@ -0,0 +1,333 @@
+# app/utils/archive.py
+"""
+Cold-storage tiering of old diaries.
+
+Diaries older than `ARCHIVE_AFTER_DAYS` are packed into one zstd-compressed
+`DiaryArchive` document per user and month and removed from the hot
+`diaries` collection. Reads fall back to the archives and decompress only
+the months they need; writes to an archived day restore that diary first.
+
+Run the job with `python -m app.utils.archive`.
+"""
+import logging
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, TypeVar
+
+import bson
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+
+from app.models.archive import DiaryArchive
+from app.models.diary import Diary
+from app.utils.config import get_settings
+from app.utils.dates import to_day_key
+
+logger = logging.getLogger(__name__)
+
+MAX_ARCHIVE_WRITE_ATTEMPTS = 10
+
+T = TypeVar("T")
+
+
+def archive_cutoff_key() -> int:
+    """Diaries with a smaller day_key belong in cold storage."""
+    days = get_settings().ARCHIVE_AFTER_DAYS
+    return to_day_key((datetime.utcnow() - timedelta(days=days)).date())
+
+
+def compress_diaries(docs: List[dict]) -> Tuple[bytes, int]:
+    import zstandard
+
+    raw = bson.encode({"diaries": docs})
+    level = get_settings().ARCHIVE_COMPRESSION_LEVEL
+    return zstandard.ZstdCompressor(level=level).compress(raw), len(raw)
+
+
+def decompress_diaries(payload: bytes) -> List[dict]:
+    import zstandard
+
+    return bson.decode(zstandard.ZstdDecompressor().decompress(payload))["diaries"]
+
+
+def referenced_media_ids(docs: List[dict]) -> List[ObjectId]:
+    """Uploaded media the diaries' entries reference."""
+    return sorted({
+        media["media_id"]
+        for doc in docs
+        for entry in doc.get("entries", [])
+        for media in entry.get("medias", [])
+        if media.get("media_id")
+    })
+
+
+def _save_archive(user_id: ObjectId, month: int, docs: List[dict], version: Optional[int]) -> bool:
+    """
+    Writes a month's archive read at `version` (None if it did not exist).
+    Returns False if another writer saved it in between.
+    """
+    collection = DiaryArchive._get_collection()
+    # Archives written before versioning have no version field
+    query = {"user_id": user_id, "month": month, "version": version or {"$in": [0, None]}}
+    if not docs:
+        return version is None or collection.delete_one(query).deleted_count == 1
+
+    docs.sort(key=lambda doc: doc.get("day_key", 0))
+    payload, raw_size = compress_diaries(docs)
+    now = datetime.utcnow()
+    fields = {
+        "diary_ids": [doc["_id"] for doc in docs],
+        "day_keys": [doc["day_key"] for doc in docs],
+        "moods": [doc.get("mood", 0) for doc in docs],
+        "media_ids": referenced_media_ids(docs),
+        "codec": "zstd",
+        "payload": bson.Binary(payload),
+        "raw_size": raw_size,
+        "updated_at": now,
+    }
+    if version is None:
+        try:
+            collection.insert_one({
+                "user_id": user_id, "month": month, "version": 1, "created_at": now, **fields
+            })
+            return True
+        except DuplicateKeyError:
+            return False
+    return collection.update_one(query, {"$set": {**fields, "version": version + 1}}).matched_count == 1
+
+
+def _update_archive(user_id: ObjectId, month: int, change: Callable[[Dict[ObjectId, dict]], T]) -> T:
+    """
+    Applies `change` to a month's archived diaries, keyed by `_id`, and saves
+    them. Archives are versioned: if another writer saved the archive in
+    between, it is read again and `change` reapplied, so concurrent archive
+    runs and restores never overwrite each other's diaries.
+    """
+    collection = DiaryArchive._get_collection()
+    for _ in range(MAX_ARCHIVE_WRITE_ATTEMPTS):
+        existing = collection.find_one({"user_id": user_id, "month": month}, {"payload": 1, "version": 1})
+        docs = {doc["_id"]: doc for doc in decompress_diaries(existing["payload"])} if existing else {}
+        result = change(docs)
+        if _save_archive(user_id, month, list(docs.values()), existing.get("version", 0) if existing else None):
+            return result
+    raise RuntimeError(f"Archive {month} of user {user_id} is changing too often to be written")
+
+
+def _archive_month(user_id: ObjectId, month: int, docs: List[dict]) -> int:
+    """
+    Packs a month of diaries into its archive, then removes them from the
+    hot collection. Safe to re-run after a crash: archived copies are
+    replaced by `_id`, and deletion only happens after the archive is written.
+    A diary modified or deleted while it was being archived stays hot and
+    is taken out of the archive again.
+    """
+    _update_archive(user_id, month, lambda archived: archived.update({doc["_id"]: doc for doc in docs}))
+
+    diaries = Diary._get_collection()
+    changed = []
+    for doc in docs:
+        unchanged = {"_id": doc["_id"], "updated_at": doc.get("updated_at")}
+        # Marked first so change notifications can tell archiving from deletion
+        diaries.update_one(unchanged, {"$set": {"archived_at": datetime.utcnow()}})
+        if not diaries.delete_one(unchanged).deleted_count:
+            changed.append(doc["_id"])
+
+    if changed:
+        diaries.update_many({"_id": {"$in": changed}}, {"$unset": {"archived_at": ""}})
+
+        def drop_changed(archived: Dict[ObjectId, dict]) -> None:
+            for diary_id in changed:
+                archived.pop(diary_id, None)
+
+        _update_archive(user_id, month, drop_changed)
+    return len(docs) - len(changed)
+
+
+def archive_old_diaries() -> Dict[str, int]:
+    """
+    Moves every diary older than the cutoff into monthly archives.
+
+    Returns:
+        Dict[str, int]: Number of archived diaries and touched archives.
+    """
+    cutoff = archive_cutoff_key()
+    diaries = Diary._get_collection()
+    archived, months = 0, 0
+
+    for user_id in diaries.distinct("user_id", {"day_key": {"$lt": cutoff}}):
+        cursor = diaries.find({"user_id": user_id, "day_key": {"$lt": cutoff}}).sort("day_key", 1)
+        month, batch = None, []
+        for doc in cursor:
+            doc_month = doc["day_key"] // 100
+            if batch and doc_month != month:
+                archived += _archive_month(user_id, month, batch)
+                months += 1
+                batch = []
+            month = doc_month
+            batch.append(doc)
+        if batch:
+            archived += _archive_month(user_id, month, batch)
+            months += 1
+
+    return {"archived": archived, "archives": months}
+
+
+def _load(doc: dict) -> Diary:
+    return Diary._from_son(doc)
+
+
+def find_archived_diary(
+    user_id: ObjectId, diary_id: Optional[str] = None, day_key: Optional[int] = None
+) -> Optional[Diary]:
+    """Finds one archived diary by ID or day, decompressing a single archive."""
+    query = {"user_id": user_id}
+    if diary_id is not None:
+        query["diary_ids"] = ObjectId(diary_id)
+    else:
+        query["day_keys"] = day_key
+
+    archive = DiaryArchive._get_collection().find_one(query, {"payload": 1})
+    if not archive:
+        return None
+    for doc in decompress_diaries(archive["payload"]):
+        if (diary_id is not None and doc["_id"] == ObjectId(diary_id)) or doc.get("day_key") == day_key:
+            return _load(doc)
+    return None
+
+
+def find_archived_diaries(diary_ids_by_user: Dict[ObjectId, List[ObjectId]]) -> List[Diary]:
+    """
+    Finds archived diaries of several users in one query, decompressing
+    each archive that holds any of them once.
+    """
+    if not diary_ids_by_user:
+        return []
+    wanted = {diary_id for diary_ids in diary_ids_by_user.values() for diary_id in diary_ids}
+    archives = DiaryArchive._get_collection().find(
+        {"$or": [
+            {"user_id": user_id, "diary_ids": {"$in": list(diary_ids)}}
+            for user_id, diary_ids in diary_ids_by_user.items()
+        ]},
+        {"payload": 1}
+    )
+    return [
+        _load(doc)
+        for archive in archives
+        for doc in decompress_diaries(archive["payload"])
+        if doc["_id"] in wanted
+    ]
+
+
+def iter_archived_documents(
+    user_id: ObjectId,
+    start_key: Optional[int] = None,
+    end_key: Optional[int] = None,
+    newest_first: bool = True
+) -> Iterator[dict]:
+    """
+    Yields raw archived diary documents in day order, decompressing one
+    month at a time so callers that stop early never touch other archives.
+    """
+    query = {"user_id": user_id}
+    month_range = {}
+    if start_key:
+        month_range["$gte"] = start_key // 100
+    if end_key:
+        month_range["$lte"] = end_key // 100
+    if month_range:
+        query["month"] = month_range
+
+    archives = DiaryArchive._get_collection().find(query, {"payload": 1}).sort("month", -1 if newest_first else 1)
+    for archive in archives:
+        docs = decompress_diaries(archive["payload"])
+        for doc in reversed(docs) if newest_first else docs:
+            day_key = doc.get("day_key", 0)
+            if start_key and day_key < start_key or end_key and day_key > end_key:
+                continue
+            yield doc
+
+
+def iter_archived_diaries(
+    user_id: ObjectId,
+    start_key: Optional[int] = None,
+    end_key: Optional[int] = None,
+    emotion_code: Optional[int] = None
+) -> Iterator[Diary]:
+    """Yields archived diaries newest first."""
+    for doc in iter_archived_documents(user_id, start_key, end_key):
+        if emotion_code is not None and not any(
+            emotion_code in entry.get("emotions", []) for entry in doc.get("entries", [])
+        ):
+            continue
+        yield _load(doc)
+
+
+def archived_day_moods(user_id: ObjectId, start_key: int, end_key: int) -> Dict[int, int]:
+    """Maps archived day_keys in range to their mood without decompressing payloads."""
+    archives = DiaryArchive._get_collection().find(
+        {"user_id": user_id, "month": {"$gte": start_key // 100, "$lte": end_key // 100}},
+        {"_id": 0, "day_keys": 1, "moods": 1}
+    )
+    day_moods = {}
+    for archive in archives:
+        moods = archive.get("moods") or [0] * len(archive["day_keys"])
+        for day_key, mood in zip(archive["day_keys"], moods):
+            if start_key <= day_key <= end_key:
+                day_moods[day_key] = mood
+    return day_moods
+
+
+def restore_archived_diary(
+    user_id: ObjectId, diary_id: Optional[str] = None, day_key: Optional[int] = None
+) -> Optional[Diary]:
+    """
+    Moves an archived diary back into the hot collection so it can be
+    modified. The next archive run packs it again once it is old enough.
+
+    Returns:
+        Optional[Diary]: The restored diary; if the day already had a hot
+        diary, that diary with the archived entries merged in.
+    """
+    query = {"user_id": user_id}
+    if diary_id is not None:
+        query["diary_ids"] = ObjectId(diary_id)
+    else:
+        query["day_keys"] = day_key
+
+    archive = DiaryArchive._get_collection().find_one(query, {"month": 1, "payload": 1})
+    if not archive:
+        return None
+
+    docs = decompress_diaries(archive["payload"])
+    restored = next(
+        (doc for doc in docs
+         if (diary_id is not None and doc["_id"] == ObjectId(diary_id)) or doc.get("day_key") == day_key),
+        None
+    )
+    if restored is None:
+        return None
+
+    diaries = Diary._get_collection()
+    try:
+        diaries.insert_one(restored)
+    except DuplicateKeyError:
+        # Already restored by a concurrent request, or a hot diary now owns the day
+        diaries.update_one(
+            {"user_id": user_id, "day_key": restored["day_key"], "_id": {"$ne": restored["_id"]}},
+            {"$push": {"entries": {"$each": restored.get("entries", [])}}}
+        )
+    _update_archive(user_id, archive["month"], lambda archived: archived.pop(restored["_id"], None))
+
+    # The restored diary, or the hot diary of the day it was merged into
+    return Diary.objects(user_id=user_id, day_key=restored["day_key"]).first()
+
+
+def main() -> None:
+    from app.utils.database import init_db
+
+    logging.basicConfig(level=logging.INFO)
+    init_db()
+    logger.info(f"Archive finished: {archive_old_diaries()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,34 @@
 # app/utils/auth.py
+from dataclasses import dataclass
 from datetime import datetime, timedelta
 from typing import Optional, Dict, Tuple
+from bson import ObjectId
 from jose import JWTError, jwt
+from mongoengine import NotUniqueError
 from fastapi import HTTPException, status
+from app.models.token import RefreshToken
 from app.utils.config import get_settings
+from app.utils.repositories import get_storage
+from app.utils.revocation import revocation_cache
 import uuid
 import logging
 
 # 設置日誌
 logger = logging.getLogger(__name__)
 
-settings = get_settings()
+@dataclass(frozen=True)
+class Principal:
+    """由 access token 解析出的已認證用戶，無需查詢資料庫"""
+    user_id: ObjectId
+    email: str
+    family_id: Optional[str] = None
+    timezone: str = "UTC"
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     """
     創建 access token
     """
+    settings = get_settings()
     to_encode = data.copy()
     if expires_delta:
         expire = datetime.utcnow() + expires_delta
@@ -41,6 +54,7 @@ def create_refresh_token(data: dict) -> str:
     """
     創建 refresh token
     """
+    settings = get_settings()
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(minutes=settings.REFRESH_TOKEN_EXPIRE_MINUTES)
     
@@ -52,7 +66,7 @@ def create_refresh_token(data: dict) -> str:
         "type": "refresh"
     })
     
-    logger.info(f"Creating refresh token with expiration: {expire}")
+    logger.debug("Creating refresh token with expiration: %s", expire)
     
     encoded_jwt = jwt.encode(
         to_encode,
@@ -65,6 +79,15 @@ def verify_token(token: str, token_type: str = "access") -> Tuple[str, Optional[
     """
     驗證 token，返回 email 和過期時間（如果是 refresh token）
     """
+    payload = decode_token(token, token_type)
+    expiration_time = datetime.utcfromtimestamp(payload["exp"])
+    return payload["sub"], expiration_time if token_type == "refresh" else None
+
+def decode_token(token: str, token_type: str = "access") -> Dict:
+    """
+    驗證 token 並返回完整的 payload
+    """
+    settings = get_settings()
     try:
         # 解碼並驗證 token
         payload = jwt.decode(
@@ -92,7 +115,7 @@ def verify_token(token: str, token_type: str = "access") -> Tuple[str, Optional[
             )
             
         current_time = datetime.utcnow()
-        expiration_time = datetime.fromtimestamp(exp)
+        expiration_time = datetime.utcfromtimestamp(exp)
         
         if current_time >= expiration_time:
             logger.error(f"Token expired. Current time: {current_time}, Expiration time: {expiration_time}")
@@ -110,9 +133,10 @@ def verify_token(token: str, token_type: str = "access") -> Tuple[str, Optional[
                 detail="Could not validate credentials: missing subject"
             )
             
-        # 如果是 refresh token，返回過期時間；如果是 access token，返回 None
-        return email, expiration_time if token_type == "refresh" else None
+        return payload
         
+    except HTTPException:
+        raise
     except JWTError as e:
         logger.error(f"JWT verification error: {str(e)}")
         raise HTTPException(
@@ -126,38 +150,116 @@ def verify_token(token: str, token_type: str = "access") -> Tuple[str, Optional[
             detail=f"Could not validate credentials: {str(e)}"
         )
 
+def issue_refresh_token(subject: str, user_id: str, family_id: Optional[str] = None) -> Tuple[str, str]:
+    """
+    簽發並記錄 refresh token，返回 token 與所屬的 family ID。
+    未指定 family 時開始新的 family（即新的登入）。
+    """
+    family_id = family_id or uuid.uuid4().hex
+    token = create_refresh_token({"sub": subject, "uid": user_id, "fid": family_id})
+    claims = jwt.get_unverified_claims(token)
+    RefreshToken(
+        jti=claims["jti"],
+        family_id=family_id,
+        subject=subject,
+        exp=datetime.utcfromtimestamp(claims["exp"])
+    ).save()
+    return token, family_id
+
+def revoke_token_family(family_id: str) -> None:
+    """撤銷整個 refresh token family，並立即更新本進程的撤銷快取"""
+    RefreshToken.objects(family_id=family_id, revoked_at=None).update(set__revoked_at=datetime.utcnow())
+    revocation_cache.add(family_id)
+
+def record_legacy_token_use(jti: str, family_id: str, subject: str, exp: int, used_at: datetime) -> bool:
+    """
+    記錄一個沒有記錄的舊版 refresh token 已被使用，歸入新的 family。
+    同一 token 已被記錄（重放或並發使用）時返回 False。
+    """
+    try:
+        RefreshToken(
+            jti=jti,
+            family_id=family_id,
+            subject=subject,
+            exp=datetime.utcfromtimestamp(exp),
+            used_at=used_at
+        ).save(force_insert=True)
+        return True
+    except NotUniqueError:
+        return False
+
 def refresh_tokens(refresh_token: str) -> Dict[str, str]:
     """
     使用 refresh token 刷新 access token 和 refresh token
-    實現滾動更新機制：如果 refresh token 還有超過一半的有效期，則保持不變；
-    否則生成新的 refresh token
+    每次刷新都會輪換 refresh token，舊的 token 立即失效。
+    已輪換的 token 再次被使用時視為外洩，整個 family 會被撤銷。
     """
+    settings = get_settings()
     try:
-        email, expiration_time = verify_token(refresh_token, "refresh")
-        
-        # 計算 refresh token 剩餘有效期
-        current_time = datetime.utcnow()
-        time_until_expiry = expiration_time - current_time
-        total_validity = timedelta(minutes=settings.REFRESH_TOKEN_EXPIRE_MINUTES)
-        
-        # 創建新的 access token
-        access_token = create_access_token({"sub": email})
-        
-        # 如果 refresh token 剩餘有效期小於一半，創建新的 refresh token
-        if time_until_expiry < (total_validity / 2):
-            logger.info("Creating new refresh token due to approaching expiration")
-            refresh_token = create_refresh_token({"sub": email})
+        payload = decode_token(refresh_token, "refresh")
+        email = payload["sub"]
+        user_id = payload.get("uid")
+        jti = payload.get("jti")
+        family_id = payload.get("fid")
+
+        # 撤銷檢查通常只查記憶體，可能命中時才查詢資料庫
+        if revocation_cache.is_revoked(jti=jti, family_id=family_id):
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Refresh token has been revoked"
+            )
+
+        # 原子地將 token 標記為已使用，確保每個 token 只能輪換一次
+        now = datetime.utcnow()
+        rotated = RefreshToken.objects(jti=jti, used_at=None, revoked_at=None).update_one(set__used_at=now)
+        if not rotated:
+            record = RefreshToken.objects(jti=jti).only("family_id", "used_at").first()
+            if record is not None:
+                grace = timedelta(seconds=settings.REFRESH_TOKEN_REUSE_GRACE_SECONDS)
+                if record.used_at and now - record.used_at > grace:
+                    logger.warning("Refresh token reuse detected, revoking family %s", record.family_id)
+                    revoke_token_family(record.family_id)
+                raise HTTPException(
+                    status_code=status.HTTP_401_UNAUTHORIZED,
+                    detail="Refresh token has already been used"
+                )
+            # 輪換機制上線前簽發的 token 沒有記錄：第一次使用時記錄為已使用並開始新的 family，
+            # 之後的重放與輪換過的 token 一樣被拒絕
+            family_id = uuid.uuid4().hex
+            if not jti or not record_legacy_token_use(jti, family_id, email, payload["exp"], now):
+                raise HTTPException(
+                    status_code=status.HTTP_401_UNAUTHORIZED,
+                    detail="Refresh token has already been used"
+                )
+
+        # 讀取用戶的最新時區放入 access token；舊版 token 沒有用戶 ID 時以 email 查詢
+        users = get_storage().users
+        user = users.get(ObjectId(user_id)) if user_id else users.get_by_email(email)
+        if not user:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="User not found"
+            )
+        user_id = str(user.id)
+
+        new_refresh_token, family_id = issue_refresh_token(email, user_id, family_id)
+        access_token = create_access_token(
+            {"sub": email, "uid": user_id, "fid": family_id, "tz": user.timezone or "UTC"},
+            expires_delta=timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
+        )
         
         return {
             "access_token": access_token,
-            "refresh_token": refresh_token,
+            "refresh_token": new_refresh_token,
             "token_type": "bearer",
             "expires_in": settings.ACCESS_TOKEN_EXPIRE_MINUTES * 60
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error refreshing tokens: {str(e)}")
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail=str(e)
-        ) 
\ No newline at end of file
+        )
@@ -0,0 +1,270 @@
+# app/utils/cache.py
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+from fastapi import Response
+from pydantic import BaseModel
+
+from app.utils.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+
+class CacheBackend:
+    """
+    Interface of a byte-value cache backend.
+
+    Every key has a generation that invalidation bumps. A value built from
+    data read before an invalidation carries the older generation and is
+    not stored, so a slow read cannot re-cache data a concurrent write just
+    replaced.
+    """
+
+    name = ""
+
+    def lookup(self, key: str) -> Tuple[Optional[bytes], int]:
+        """Returns the cached value, or None, and the key's current generation."""
+        raise NotImplementedError
+
+    def set(self, key: str, value: bytes, ttl: int, generation: int) -> bool:
+        """Stores a value unless the key was invalidated since `generation`."""
+        raise NotImplementedError
+
+    def invalidate(self, keys: Iterable[str]) -> None:
+        raise NotImplementedError
+
+
+class LRUCacheBackend(CacheBackend):
+    """
+    In-process LRU cache with per-entry expiry.
+
+    Each worker process has its own copy, so invalidations only reach the
+    worker that performed the write; the TTL bounds staleness elsewhere.
+    A single process-wide generation is enough for the same reason.
+    """
+
+    name = "memory"
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+        self._generation = 0
+
+    def lookup(self, key: str) -> Tuple[Optional[bytes], int]:
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None, self._generation
+            expires_at, value = item
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None, self._generation
+            self._entries.move_to_end(key)
+            return value, self._generation
+
+    def set(self, key: str, value: bytes, ttl: int, generation: int) -> bool:
+        with self._lock:
+            if generation != self._generation:
+                return False
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            return True
+
+    def invalidate(self, keys: Iterable[str]) -> None:
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                self._entries.pop(key, None)
+
+
+class DisabledCacheBackend(CacheBackend):
+    """
+    Stores nothing. Used instead of the per-process LRU cache when several
+    workers run, where a write invalidates only its own worker's copy.
+    """
+
+    name = "disabled"
+
+    def lookup(self, key: str) -> Tuple[Optional[bytes], int]:
+        return None, 0
+
+    def set(self, key: str, value: bytes, ttl: int, generation: int) -> bool:
+        return False
+
+    def invalidate(self, keys: Iterable[str]) -> None:
+        pass
+
+
+class RedisCacheBackend(CacheBackend):
+    """
+    Shared cache backend, so invalidations are visible to every worker.
+
+    Generations live in Redis next to the values, and a value is stored by
+    a script that compares the generation first, so a worker can never
+    write back a value another worker has invalidated.
+    """
+
+    name = "redis"
+
+    # Longer than any response build; afterwards the generation restarts at 0
+    GENERATION_TTL_SECONDS = 24 * 60 * 60
+
+    SET_IF_GENERATION = """
+        if (redis.call('GET', KEYS[2]) or '0') ~= ARGV[2] then
+            return 0
+        end
+        redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[3])
+        return 1
+    """
+
+    def __init__(self, url: str, prefix: str = "migo:cache:", client=None):
+        if client is None:
+            try:
+                import redis
+            except ImportError as e:
+                raise RuntimeError("CACHE_BACKEND=redis requires the redis package") from e
+            client = redis.Redis.from_url(url, socket_timeout=0.5)
+        self.prefix = prefix
+        self._client = client
+        self._set_if_generation = client.register_script(self.SET_IF_GENERATION)
+
+    def _generation_key(self, key: str) -> str:
+        return f"{self.prefix}gen:{key}"
+
+    def lookup(self, key: str) -> Tuple[Optional[bytes], int]:
+        value, generation = self._client.mget(self.prefix + key, self._generation_key(key))
+        return value, int(generation or 0)
+
+    def set(self, key: str, value: bytes, ttl: int, generation: int) -> bool:
+        stored = self._set_if_generation(
+            keys=[self.prefix + key, self._generation_key(key)],
+            args=[value, str(generation), ttl]
+        )
+        return bool(stored)
+
+    def invalidate(self, keys: Iterable[str]) -> None:
+        keys = list(keys)
+        if not keys:
+            return
+        pipeline = self._client.pipeline(transaction=False)
+        for key in keys:
+            pipeline.incr(self._generation_key(key))
+            pipeline.expire(self._generation_key(key), self.GENERATION_TTL_SECONDS)
+        pipeline.delete(*[self.prefix + key for key in keys])
+        pipeline.execute()
+
+
+class ResponseCache:
+    """
+    Read-through cache of serialized JSON responses.
+
+    Backend failures are logged and treated as misses so the cache can never
+    take a route down. Values built while their key was invalidated are not
+    stored, see `CacheBackend`.
+    """
+
+    def __init__(self):
+        self._backend: Optional[CacheBackend] = None
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.errors = 0
+
+    @property
+    def backend(self) -> CacheBackend:
+        if self._backend is None:
+            settings = get_settings()
+            if settings.CACHE_BACKEND == "redis":
+                self._backend = RedisCacheBackend(settings.CACHE_REDIS_URL)
+            elif settings.server_workers > 1:
+                # Another worker would keep serving a response this worker invalidated
+                logger.warning(
+                    f"Response cache disabled: CACHE_BACKEND={settings.CACHE_BACKEND} with "
+                    f"{settings.server_workers} workers cannot invalidate across workers; use redis"
+                )
+                self._backend = DisabledCacheBackend()
+            else:
+                self._backend = LRUCacheBackend(settings.CACHE_MAX_ENTRIES)
+        return self._backend
+
+    def configure(self, backend: CacheBackend) -> None:
+        """Replaces the backend, e.g. with a stand-in for tests and benchmarks."""
+        self._backend = backend
+
+    def get_or_build(self, key: str, build: Callable[[], bytes], ttl: Optional[int] = None) -> bytes:
+        try:
+            value, generation = self.backend.lookup(key)
+        except Exception:
+            self.errors += 1
+            logger.exception("Cache get failed")
+            value, generation = None, None
+
+        if value is not None:
+            self.hits += 1
+            return value
+
+        self.misses += 1
+        value = build()
+        if generation is not None:
+            try:
+                self.backend.set(key, value, ttl or get_settings().CACHE_TTL_SECONDS, generation)
+            except Exception:
+                self.errors += 1
+                logger.exception("Cache set failed")
+        return value
+
+    def invalidate(self, *keys: str) -> None:
+        self.invalidations += len(keys)
+        try:
+            self.backend.invalidate(keys)
+        except Exception:
+            self.errors += 1
+            logger.exception("Cache invalidation failed")
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "backend": self.backend.name,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "invalidations": self.invalidations,
+            "errors": self.errors,
+        }
+
+
+def diary_cache_key(user_id, diary_id) -> str:
+    return f"diary:{user_id}:{diary_id}"
+
+
+def diary_day_cache_key(user_id, day: date) -> str:
+    return f"diary-day:{user_id}:{day.isoformat()}"
+
+
+def user_cache_key(user_id) -> str:
+    return f"me:{user_id}"
+
+
+def cached_json_response(key: str, build: Callable[[], BaseModel], ttl: Optional[int] = None) -> Response:
+    """
+    Returns the cached JSON for `key`, building and caching it on a miss.
+
+    `build` returns the response model; it is serialized with field aliases
+    exactly like FastAPI would serialize it.
+    """
+    payload = response_cache.get_or_build(
+        key,
+        lambda: build().model_dump_json(by_alias=True).encode(),
+        ttl
+    )
+    return Response(content=payload, media_type="application/json")
+
+
+response_cache = ResponseCache()
@@ -1,6 +1,8 @@
 # app/utils/config.py
+import os
 from pydantic_settings import BaseSettings
 from functools import lru_cache
+from typing import Dict, List
 from pydantic import validator
 
 class Settings(BaseSettings):
@@ -22,11 +24,85 @@ class Settings(BaseSettings):
     JWT_ALGORITHM: str
     ACCESS_TOKEN_EXPIRE_MINUTES: int
     REFRESH_TOKEN_EXPIRE_MINUTES: int
+    REFRESH_TOKEN_REUSE_GRACE_SECONDS: int = 10
+
+    # Token revocation cache settings
+    REVOCATION_SYNC_SECONDS: int = 5
+    REVOCATION_REBUILD_SECONDS: int = 6 * 60 * 60
+    REVOCATION_BLOOM_CAPACITY: int = 100_000
+    REVOCATION_BLOOM_ERROR_RATE: float = 0.001
     
     # Server settings
     SERVER_HOST: str
     SERVER_PORT: int
     DEBUG_MODE: bool
+    SERVER_WORKERS: int = 0  # 0 uses one worker per CPU core
+    SERVER_LOOP: str = "auto"  # auto, asyncio or uvloop
+    SERVER_HTTP: str = "auto"  # auto, h11 or httptools
+    THREADPOOL_SIZE: int = 40
+    GRACEFUL_SHUTDOWN_SECONDS: int = 30
+
+    # Logging settings
+    LOG_LEVEL: str = "INFO"
+    LOG_SUCCESS_SAMPLE_RATE: float = 0.1
+    LOG_SLOW_REQUEST_MS: int = 1000
+
+    # Profiling settings
+    PROFILING_TOKEN: str = ""  # Value of the X-Profile header; empty disables it
+    PROFILING_SAMPLE_RATE: float = 0.0
+    PROFILING_INTERVAL_MS: int = 5
+    PROFILING_DIR: str = "profiles"
+    MONGO_SLOW_QUERY_MS: int = 100  # 0 disables the slow query log
+    MONGO_SLOW_QUERY_OVERRIDES: Dict[str, int] = {}  # Per-collection thresholds
+
+    # Storage settings
+    STORAGE_BACKEND: str = "mongo"  # mongo or memory; memory is for tests and benchmarks
+
+    # Response cache settings
+    CACHE_BACKEND: str = "memory"  # memory or redis
+    CACHE_REDIS_URL: str = "redis://localhost:6379/0"
+    CACHE_TTL_SECONDS: int = 30
+    CACHE_MAX_ENTRIES: int = 10000
+
+    # Sync notification settings
+    SYNC_PRE_IMAGES: bool = False  # Requires changeStreamPreAndPostImages, see migrations
+    SYNC_POLL_SECONDS: int = 2
+    SYNC_BUFFER_SIZE: int = 5000
+    SYNC_QUEUE_SIZE: int = 100
+    SYNC_HEARTBEAT_SECONDS: int = 15
+
+    # Diary archive settings
+    ARCHIVE_AFTER_DAYS: int = 365
+    ARCHIVE_COMPRESSION_LEVEL: int = 10
+
+    # Account purge settings
+    PURGE_BATCH_SIZE: int = 500
+    PURGE_MAX_DUTY_CYCLE: float = 0.25  # Share of time the purge job may spend in database calls
+
+    # Feed settings
+    FEED_TIMELINE_SIZE: int = 500
+    FEED_FANOUT_LIMIT: int = 10_000  # Authors with more followers are merged at read time
+    FEED_FANOUT_BATCH: int = 1000
+
+    # Media settings
+    MEDIA_STORAGE_DIR: str = "media"
+    MEDIA_TEMP_DIR: str = "media_tmp"  # Unfinished uploads; outside MEDIA_STORAGE_DIR, same filesystem
+    MEDIA_BASE_URL: str = "/static/media"
+    MEDIA_MAX_UPLOAD_BYTES: int = 50 * 1024 * 1024
+    MEDIA_PROCESS_WORKERS: int = 2
+
+    # Emotion catalog settings
+    EMOTION_CATALOG_REFRESH_SECONDS: int = 300
+
+    # Administrators, e.g. of the shared emotion catalog (JSON list of emails)
+    ADMIN_EMAILS: List[str] = []
+
+    @validator('THREADPOOL_SIZE')
+    def validate_threadpool_size(cls, v):
+        """Validate sync route threadpool size"""
+        if v <= 0:
+            raise ValueError('THREADPOOL_SIZE must be positive')
+        return v
 
     @validator('REFRESH_TOKEN_EXPIRE_MINUTES')
     def validate_refresh_token_expire_minutes(cls, v):
@@ -37,6 +113,13 @@ class Settings(BaseSettings):
             raise ValueError('REFRESH_TOKEN_EXPIRE_MINUTES should be greater than 1 minute')
         return v
 
+    @property
+    def server_workers(self) -> int:
+        """Worker processes run.py starts: one in debug mode, else SERVER_WORKERS or one per core"""
+        if self.DEBUG_MODE:
+            return 1
+        return self.SERVER_WORKERS or os.cpu_count() or 1
+
     class Config:
         """Pydantic configuration class"""
         env_file = ".env"
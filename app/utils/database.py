@@ -3,10 +3,9 @@ import os
 from mongoengine import connect, disconnect
 from dotenv import load_dotenv
 from app.utils.config import get_settings
+from app.utils.slow_query import SlowQueryListener
 import certifi
 
-settings = get_settings()
-
 def init_db():
     """Initialize database connection"""
     load_dotenv()
@@ -18,15 +17,17 @@ def init_db():
     disconnect()
     
     # Connect to MongoDB
-    connect(host=MONGODB_URI, tlsCAFile=certifi.where())
+    connect(host=MONGODB_URI, tlsCAFile=certifi.where(), event_listeners=[SlowQueryListener()])
 
 def close_db():
     """Close database connection"""
     disconnect()
 
 def init_db_with_settings():
+    settings = get_settings()
     connect(
         db=settings.DATABASE_NAME,
         host=settings.MONGODB_URL,
-        tlsCAFile=certifi.where()
+        tlsCAFile=certifi.where(),
+        event_listeners=[SlowQueryListener()]
     ) 
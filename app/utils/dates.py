@@ -0,0 +1,59 @@
+# app/utils/dates.py
+from datetime import date, datetime, timezone
+from typing import Optional
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+DEFAULT_TIMEZONE = "UTC"
+
+
+def validate_timezone(name: str) -> str:
+    """
+    Validates an IANA timezone name such as "Asia/Taipei".
+
+    Raises:
+        ValueError: If the timezone is unknown.
+    """
+    try:
+        ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValueError(f"Unknown timezone: {name}")
+    return name
+
+
+def get_zone(name: Optional[str]) -> ZoneInfo:
+    try:
+        return ZoneInfo(name or DEFAULT_TIMEZONE)
+    except (ZoneInfoNotFoundError, ValueError):
+        return ZoneInfo(DEFAULT_TIMEZONE)
+
+
+def local_day(value: Optional[datetime], tz_name: Optional[str]) -> date:
+    """
+    Returns the user-local calendar day of a timestamp.
+
+    Aware datetimes are converted to the user's timezone. Naive datetimes
+    are taken as already expressing the user's local day. `None` means now.
+    """
+    if value is None:
+        return datetime.now(get_zone(tz_name)).date()
+    if value.tzinfo is not None:
+        return value.astimezone(get_zone(tz_name)).date()
+    return value.date()
+
+
+def utc_local_day(value: datetime, tz_name: Optional[str]) -> date:
+    """Returns the user-local day of a naive UTC timestamp, as stored by Mongo."""
+    return value.replace(tzinfo=timezone.utc).astimezone(get_zone(tz_name)).date()
+
+
+def to_day_key(day: date) -> int:
+    """Encodes a calendar day as an int YYYYMMDD."""
+    return day.year * 10000 + day.month * 100 + day.day
+
+
+def from_day_key(day_key: int) -> date:
+    return date(day_key // 10000, day_key // 100 % 100, day_key % 100)
+
+
+def day_start(day: date) -> datetime:
+    return datetime(day.year, day.month, day.day)
@@ -0,0 +1,163 @@
+# app/utils/emotion_catalog.py
+import logging
+import math
+import threading
+import time
+from typing import Dict, Iterable, List, Union
+
+from mongoengine import NotUniqueError
+
+from app.models.emotion import Emotion
+from app.utils.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EMOTIONS = [
+    "happy", "sad", "excited", "peaceful", "focused", "curious",
+    "grateful", "relaxed", "tired", "anxious", "angry", "lonely",
+]
+
+# Minimum seconds between reloads triggered by unknown emotion names
+MISS_RELOAD_INTERVAL_SECONDS = 5
+
+
+def normalize_emotion_name(name: str) -> str:
+    return " ".join(name.strip().lower().split())
+
+
+class EmotionCatalog:
+    """
+    In-process cache of the emotion catalog.
+
+    Notes and diary entries store emotions as compact integer codes. The
+    catalog translates names to codes on write and codes back to names on
+    read without touching the database. It is reloaded periodically and
+    whenever an unknown name is seen, so emotions added by another worker
+    become visible quickly.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._codes: Dict[str, int] = {}
+        self._names: Dict[int, str] = {}
+        self._loaded_at = 0.0
+
+    def load(self) -> None:
+        """Loads the catalog from the database, seeding defaults if empty."""
+        with self._lock:
+            if not Emotion.objects(code__ne=None).count():
+                self._seed_defaults()
+
+            codes = {}
+            for emotion in Emotion.objects(code__ne=None).only("name", "code"):
+                codes[normalize_emotion_name(emotion.name)] = emotion.code
+
+            # Swap whole mappings so readers never see a partial catalog
+            self._codes = codes
+            self._names = {code: name for name, code in codes.items()}
+            self._loaded_at = time.monotonic()
+        logger.info(f"Emotion catalog loaded with {len(codes)} emotions")
+
+    def load_defaults(self) -> None:
+        """Uses the default emotions without a database, for the memory storage backend."""
+        with self._lock:
+            self._codes = {name: code for code, name in enumerate(DEFAULT_EMOTIONS, start=1)}
+            self._names = {code: name for name, code in self._codes.items()}
+            # Never stale, so nothing reloads from the database
+            self._loaded_at = math.inf
+
+    def refresh_if_stale(self) -> None:
+        max_age = get_settings().EMOTION_CATALOG_REFRESH_SECONDS
+        if time.monotonic() - self._loaded_at >= max_age:
+            self.load()
+
+    def all(self) -> Dict[int, str]:
+        self.refresh_if_stale()
+        return dict(self._names)
+
+    def encode(self, names: Iterable[str]) -> List[int]:
+        """
+        Converts emotion names to catalog codes, keeping order and dropping
+        duplicates.
+
+        Raises:
+            ValueError: If a name is not in the catalog.
+        """
+        self.refresh_if_stale()
+        normalized = [normalize_emotion_name(name) for name in names]
+        missing = [name for name in normalized if name not in self._codes]
+        if missing and time.monotonic() - self._loaded_at >= MISS_RELOAD_INTERVAL_SECONDS:
+            self.load()
+            missing = [name for name in normalized if name not in self._codes]
+        if missing:
+            raise ValueError(f"Unknown emotions: {', '.join(sorted(set(missing)))}")
+
+        codes = []
+        for name in normalized:
+            code = self._codes[name]
+            if code not in codes:
+                codes.append(code)
+        return codes
+
+    def decode(self, values: Iterable[Union[int, str]]) -> List[str]:
+        """Converts stored emotion codes to names. Legacy string values pass through."""
+        names = []
+        for value in values or []:
+            if isinstance(value, str):
+                names.append(value)
+                continue
+            name = self._names.get(value)
+            if name is None:
+                self.refresh_if_stale()
+                name = self._names.get(value, str(value))
+            names.append(name)
+        return names
+
+    def code_for(self, name: str) -> int:
+        return self.encode([name])[0]
+
+    def create(self, name: str) -> Emotion:
+        """
+        Adds an emotion to the catalog with the next free code.
+
+        Raises:
+            ValueError: If the emotion already exists.
+        """
+        name = normalize_emotion_name(name)
+        if not name:
+            raise ValueError("Emotion name is required")
+
+        for _ in range(5):
+            last = Emotion.objects(code__ne=None).order_by("-code").only("code").first()
+            code = (last.code + 1) if last else 1
+            try:
+                # Legacy emotions without a code are adopted instead of duplicated
+                Emotion.objects(name=name, code=None).update_one(set__code=code, upsert=True)
+                break
+            except NotUniqueError:
+                if Emotion.objects(name=name, code__ne=None).first():
+                    raise ValueError(f"Emotion {name} already exists")
+                # Another worker took the same code; retry with the next one
+        else:
+            raise ValueError(f"Could not allocate a code for emotion {name}")
+
+        self.load()
+        return Emotion.objects(name=name).first()
+
+    def ensure(self, names: Iterable[str]) -> List[int]:
+        """Like `encode`, but adds unknown names to the catalog. Used by migrations."""
+        names = list(names)
+        for name in {normalize_emotion_name(n) for n in names}:
+            if name and name not in self._codes:
+                try:
+                    self.create(name)
+                except ValueError:
+                    self.load()
+        return self.encode(names)
+
+    def _seed_defaults(self) -> None:
+        for code, name in enumerate(DEFAULT_EMOTIONS, start=1):
+            Emotion.objects(name=name).update_one(set__code=code, upsert=True)
+
+
+emotion_catalog = EmotionCatalog()
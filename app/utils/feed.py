@@ -0,0 +1,256 @@
+# app/utils/feed.py
+"""
+Feeds of public diaries from followed users.
+
+Publishing a public diary writes one `TimelineItem` into the timeline of
+every follower (fan-out on write), so reading a feed is a single range scan
+of the reader's timeline however many people they follow. Timelines are
+capped at about `FEED_TIMELINE_SIZE` items: each fan-out trims a sample of
+the touched timelines, which keeps the trimming cost per write constant.
+
+Authors with at least `FEED_FANOUT_LIMIT` followers are not fanned out;
+their public diaries are read from the `diaries` collection when a feed is
+read (fan-out on read) and merged with the timeline. Only the few followed
+accounts above the limit are queried, through a partial index on public
+diaries.
+"""
+import base64
+import random
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+
+from bson import ObjectId
+from pymongo import DESCENDING, UpdateOne
+
+from app.models.diary import Diary
+from app.models.feed import Follow, TimelineItem
+from app.models.purge import AccountPurge
+from app.models.user import User
+from app.utils.cache import response_cache, user_cache_key
+from app.utils.config import get_settings
+
+# Share of the timelines touched by a fan-out that are trimmed to size
+TRIM_SAMPLE_RATE = 0.05
+# Public diaries of a newly followed user copied into the follower's timeline
+FOLLOW_BACKFILL = 20
+HIGH_FOLLOWER_REFRESH_SECONDS = 60
+
+# (published_at, diary_id)
+Position = Tuple[datetime, ObjectId]
+
+
+def encode_cursor(position: Position) -> str:
+    published_at, diary_id = position
+    raw = f"{published_at.isoformat()}|{diary_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Position:
+    """
+    Raises:
+        ValueError: If the cursor is malformed.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        published_at, diary_id = raw.split("|")
+        return datetime.fromisoformat(published_at), ObjectId(diary_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+def _before(position: Optional[Position], time_field: str, id_field: str) -> Dict:
+    if position is None:
+        return {}
+    published_at, diary_id = position
+    return {"$or": [
+        {time_field: {"$lt": published_at}},
+        {time_field: published_at, id_field: {"$lt": diary_id}},
+    ]}
+
+
+class _HighFollowerAccounts:
+    """Process-local, periodically refreshed set of accounts read at feed time."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids: Set[ObjectId] = set()
+        self._loaded_at = float("-inf")
+
+    def get(self) -> Set[ObjectId]:
+        with self._lock:
+            if time.monotonic() - self._loaded_at >= HIGH_FOLLOWER_REFRESH_SECONDS:
+                limit = get_settings().FEED_FANOUT_LIMIT
+                self._ids = set(User._get_collection().distinct("_id", {"followers_count": {"$gte": limit}}))
+                self._loaded_at = time.monotonic()
+            return self._ids
+
+
+high_follower_accounts = _HighFollowerAccounts()
+
+
+def _is_fanned_out(author_id: ObjectId) -> bool:
+    user = User._get_collection().find_one({"_id": author_id}, {"followers_count": 1})
+    return (user or {}).get("followers_count", 0) < get_settings().FEED_FANOUT_LIMIT
+
+
+def _trim(owner_id: ObjectId) -> None:
+    """Drops the items past the timeline size."""
+    timelines = TimelineItem._get_collection()
+    oldest_kept = timelines.find_one(
+        {"owner_id": owner_id},
+        {"published_at": 1},
+        sort=[("published_at", DESCENDING), ("diary_id", DESCENDING)],
+        skip=get_settings().FEED_TIMELINE_SIZE - 1
+    )
+    if oldest_kept:
+        timelines.delete_many({"owner_id": owner_id, "published_at": {"$lt": oldest_kept["published_at"]}})
+
+
+def _push(owner_ids: List[ObjectId], diary_id: ObjectId, author_id: ObjectId, published_at: datetime) -> None:
+    if not owner_ids:
+        return
+    TimelineItem._get_collection().bulk_write([
+        UpdateOne(
+            {"owner_id": owner_id, "diary_id": diary_id},
+            {"$set": {"author_id": author_id, "published_at": published_at}},
+            upsert=True
+        )
+        for owner_id in owner_ids
+    ], ordered=False)
+    for owner_id in owner_ids:
+        if random.random() < TRIM_SAMPLE_RATE:
+            _trim(owner_id)
+
+
+def feeds_enabled() -> bool:
+    """Feeds live in MongoDB only, see `STORAGE_BACKEND`."""
+    return get_settings().STORAGE_BACKEND == "mongo"
+
+
+def publish_diary(diary_id: ObjectId, author_id: ObjectId, published_at: datetime) -> None:
+    """
+    Pushes a public diary to the timelines of the author's followers.
+    Runs after the response; republishing moves the diary to the top.
+    """
+    if not feeds_enabled() or not _is_fanned_out(author_id):
+        return
+    batch_size = get_settings().FEED_FANOUT_BATCH
+    followers = Follow._get_collection().find({"followee_id": author_id}, {"_id": 0, "follower_id": 1})
+    batch = []
+    for follow in followers:
+        batch.append(follow["follower_id"])
+        if len(batch) >= batch_size:
+            _push(batch, diary_id, author_id, published_at)
+            batch = []
+    _push(batch, diary_id, author_id, published_at)
+
+
+def unpublish_diary(diary_id: ObjectId) -> None:
+    """Removes a diary that was deleted or made private from every timeline."""
+    if not feeds_enabled():
+        return
+    TimelineItem._get_collection().delete_many({"diary_id": diary_id})
+
+
+def _change_counts(follower_id: ObjectId, followee_id: ObjectId, step: int) -> None:
+    users = User._get_collection()
+    users.update_one({"_id": follower_id}, {"$inc": {"following_count": step}})
+    users.update_one({"_id": followee_id}, {"$inc": {"followers_count": step}})
+    response_cache.invalidate(user_cache_key(follower_id), user_cache_key(followee_id))
+
+
+def _purge_requested(user_id: ObjectId) -> bool:
+    return AccountPurge.objects(user_id=user_id, status__ne="done").only("id").first() is not None
+
+
+def follow(follower_id: ObjectId, followee_id: ObjectId) -> bool:
+    """
+    Follows a user and copies their recent public diaries into the
+    follower's timeline. Returns False if already following.
+
+    Raises:
+        ValueError: If the user does not exist, is being deleted or is the follower.
+    """
+    if follower_id == followee_id:
+        raise ValueError("Cannot follow yourself")
+    if not User._get_collection().find_one({"_id": followee_id}, {"_id": 1}):
+        raise ValueError(f"User {followee_id} not found")
+
+    result = Follow._get_collection().update_one(
+        {"follower_id": follower_id, "followee_id": followee_id},
+        {"$setOnInsert": {"created_at": datetime.utcnow()}},
+        upsert=True
+    )
+    if result.upserted_id is None:
+        return False
+    _change_counts(follower_id, followee_id, 1)
+    # Checked after the insert: a purge requested earlier is seen here, and
+    # one requested later removes this relation in its follows stage
+    if _purge_requested(followee_id):
+        unfollow(follower_id, followee_id)
+        raise ValueError(f"User {followee_id} not found")
+
+    if _is_fanned_out(followee_id):
+        recent = Diary._get_collection().find(
+            {"user_id": followee_id, "is_public": True},
+            {"updated_at": 1}
+        ).sort("updated_at", DESCENDING).limit(FOLLOW_BACKFILL)
+        operations = [
+            UpdateOne(
+                {"owner_id": follower_id, "diary_id": doc["_id"]},
+                {"$set": {"author_id": followee_id, "published_at": doc["updated_at"]}},
+                upsert=True
+            )
+            for doc in recent
+        ]
+        if operations:
+            TimelineItem._get_collection().bulk_write(operations, ordered=False)
+            _trim(follower_id)
+    return True
+
+
+def unfollow(follower_id: ObjectId, followee_id: ObjectId) -> bool:
+    """Stops following a user and removes their diaries from the timeline. Returns False if not following."""
+    result = Follow._get_collection().delete_one({"follower_id": follower_id, "followee_id": followee_id})
+    if not result.deleted_count:
+        return False
+    _change_counts(follower_id, followee_id, -1)
+    # The timeline is capped, so this scans at most FEED_TIMELINE_SIZE items
+    TimelineItem._get_collection().delete_many({"owner_id": follower_id, "author_id": followee_id})
+    return True
+
+
+def read_feed(
+    owner_id: ObjectId, before: Optional[Position] = None, limit: int = 20
+) -> List[Tuple[datetime, ObjectId, ObjectId]]:
+    """
+    The newest feed items before a position, as (published_at, diary_id,
+    author_id), merging the pushed timeline with the public diaries of
+    followed high-follower accounts.
+    """
+    items: Dict[ObjectId, Tuple[datetime, ObjectId, ObjectId]] = {}
+    pushed = TimelineItem._get_collection().find(
+        {"owner_id": owner_id, **_before(before, "published_at", "diary_id")},
+        {"_id": 0, "published_at": 1, "diary_id": 1, "author_id": 1}
+    ).sort([("published_at", DESCENDING), ("diary_id", DESCENDING)]).limit(limit)
+    for doc in pushed:
+        items[doc["diary_id"]] = (doc["published_at"], doc["diary_id"], doc["author_id"])
+
+    high_followers = high_follower_accounts.get()
+    if high_followers:
+        followed = Follow._get_collection().distinct(
+            "followee_id", {"follower_id": owner_id, "followee_id": {"$in": list(high_followers)}}
+        )
+        if followed:
+            # Served by the partial index on public diaries
+            pulled = Diary._get_collection().find(
+                {"user_id": {"$in": followed}, "is_public": True, **_before(before, "updated_at", "_id")},
+                {"updated_at": 1, "user_id": 1}
+            ).sort([("updated_at", DESCENDING), ("_id", DESCENDING)]).limit(limit)
+            for doc in pulled:
+                # Diaries pushed before the author crossed the limit are also in the timeline
+                items.setdefault(doc["_id"], (doc["updated_at"], doc["_id"], doc["user_id"]))
+
+    return sorted(items.values(), key=lambda item: item[:2], reverse=True)[:limit]
@@ -0,0 +1,115 @@
+# app/utils/geo.py
+"""
+Geometry helpers for note locations.
+
+Positions are stored as GeoJSON points (`[longitude, latitude]`) under a
+`2dsphere` index. Map queries use a bounding box; a box whose west edge is
+east of its east edge crosses the antimeridian and is split in two.
+"""
+import base64
+import math
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+from bson import ObjectId
+
+EARTH_RADIUS_M = 6_371_008.8
+EDGE_STEP_DEGREES = 5
+POLE_LATITUDE = 89.9999
+
+
+@dataclass(frozen=True)
+class Box:
+    west: float
+    south: float
+    east: float
+    north: float
+
+    def __post_init__(self):
+        for longitude in (self.west, self.east):
+            if not -180 <= longitude <= 180:
+                raise ValueError(f"Longitude {longitude} out of range")
+        for latitude in (self.south, self.north):
+            if not -90 <= latitude <= 90:
+                raise ValueError(f"Latitude {latitude} out of range")
+        if self.south >= self.north:
+            raise ValueError("South edge must be south of the north edge")
+        if self.west == self.east:
+            raise ValueError("West and east edges must differ")
+
+    @property
+    def width(self) -> float:
+        """Longitude span in degrees, across the antimeridian if needed."""
+        return (self.east - self.west) % 360 or 360
+
+    @property
+    def height(self) -> float:
+        return self.north - self.south
+
+    def contains(self, longitude: float, latitude: float) -> bool:
+        if not self.south <= latitude <= self.north:
+            return False
+        if self.west <= self.east:
+            return self.west <= longitude <= self.east
+        return longitude >= self.west or longitude <= self.east
+
+    def polygons(self) -> List[dict]:
+        """
+        GeoJSON polygons covering the box. Each is at most 90 degrees wide,
+        so MongoDB never takes the complement of the intended area, and its
+        east-west edges have a vertex every few degrees to follow the parallel.
+        """
+        parts = [(self.west, self.east)] if self.west <= self.east else [(self.west, 180.0), (-180.0, self.east)]
+        # Identical vertices at a pole would make the ring degenerate
+        south, north = max(self.south, -POLE_LATITUDE), min(self.north, POLE_LATITUDE)
+        polygons = []
+        for part_west, part_east in parts:
+            chunks = max(1, math.ceil((part_east - part_west) / 90))
+            for chunk in range(chunks):
+                west = part_west + (part_east - part_west) * chunk / chunks
+                east = part_west + (part_east - part_west) * (chunk + 1) / chunks
+                steps = max(1, math.ceil((east - west) / EDGE_STEP_DEGREES))
+                edges = [west + (east - west) * i / steps for i in range(steps + 1)]
+                ring = (
+                    [[lng, south] for lng in edges]
+                    + [[lng, north] for lng in reversed(edges)]
+                    + [[west, south]]
+                )
+                polygons.append({"type": "Polygon", "coordinates": [ring]})
+        return polygons
+
+    def cell_of(self, longitude: float, latitude: float, columns: int, rows: int) -> Tuple[int, int]:
+        """Grid cell of a point inside the box, for clustering."""
+        x = (longitude - self.west) % 360 / (self.width or 1)
+        y = (latitude - self.south) / (self.height or 1)
+        return min(int(x * columns), columns - 1), min(int(y * rows), rows - 1)
+
+
+def distance_m(a: Tuple[float, float], b: Tuple[float, float]) -> float:
+    """Haversine distance in meters between two (longitude, latitude) points."""
+    lng1, lat1, lng2, lat2 = map(math.radians, (*a, *b))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(h)))
+
+
+def point(longitude: float, latitude: float) -> dict:
+    return {"type": "Point", "coordinates": [longitude, latitude]}
+
+
+def encode_cursor(last_id: ObjectId, distance: Optional[float] = None) -> str:
+    """Opaque cursor after a note, optionally at a distance from the query point."""
+    raw = str(last_id) if distance is None else f"{distance!r}:{last_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[ObjectId, Optional[float]]:
+    """
+    Raises:
+        ValueError: If the cursor is malformed.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        distance, _, last_id = raw.rpartition(":")
+        return ObjectId(last_id), float(distance) if distance else None
+    except Exception:
+        raise ValueError("Invalid cursor")
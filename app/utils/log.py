@@ -0,0 +1,181 @@
+# app/utils/log.py
+import json
+import logging
+import queue
+import random
+import re
+import time
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Optional
+
+from app.utils.config import get_settings
+
+request_id_var: ContextVar[str] = ContextVar("request_id", default="-")
+
+REDACTED = "[REDACTED]"
+SENSITIVE_KEYS = ("token", "authorization", "password", "secret", "body", "cookie")
+JWT_PATTERN = re.compile(r"eyJ[\w-]+\.[\w-]+\.[\w-]*")
+
+# Attributes every LogRecord has; anything else was passed through `extra`
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+_listener: Optional[QueueListener] = None
+
+
+def redact(value: Any, key: str = "") -> Any:
+    """Masks sensitive keys and JWT-looking strings in a log value."""
+    if key and any(word in key.lower() for word in SENSITIVE_KEYS):
+        return REDACTED
+    if isinstance(value, dict):
+        return {k: redact(v, str(k)) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [redact(v) for v in value]
+    if isinstance(value, str):
+        return JWT_PATTERN.sub(REDACTED, value)
+    return value
+
+
+class RequestContextFilter(logging.Filter):
+    """Stamps records with the current request ID on the emitting thread."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as single-line JSON. Runs on the listener thread."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "msg": redact(record.getMessage()),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and key not in entry:
+                entry[key] = redact(value, key)
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc_info"] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class _PreformattedQueueHandler(QueueHandler):
+    """
+    Queue handler that defers formatting to the listener thread.
+
+    The default `prepare` fully formats the record on the caller's thread;
+    here only the %-arguments are merged, so later mutation of the arguments
+    cannot change the message, and JSON encoding happens on the listener.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def setup_logging() -> None:
+    """
+    Routes all logging through a queue so request handlers never block on
+    log I/O. A background listener formats records as JSON and writes them.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    settings = get_settings()
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(JsonFormatter())
+
+    queue_handler = _PreformattedQueueHandler(log_queue)
+    queue_handler.addFilter(RequestContextFilter())
+
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(settings.LOG_LEVEL)
+
+    _listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+
+
+def stop_logging() -> None:
+    """Flushes queued records and stops the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+class RequestLoggingMiddleware:
+    """
+    Assigns a request ID, measures timing and writes one access log per request.
+
+    Successful fast requests are sampled with `LOG_SUCCESS_SAMPLE_RATE`;
+    errors and slow requests are always logged.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.logger = logging.getLogger("app.access")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope.get("headers", []):
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")[:64]
+                break
+        request_id = request_id or uuid.uuid4().hex
+        token = request_id_var.set(request_id)
+
+        status_code = 500
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [
+                    (b"x-request-id", request_id.encode("latin-1"))
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration_ms = (time.perf_counter() - start) * 1000
+            self._log(scope, status_code, duration_ms)
+            request_id_var.reset(token)
+
+    def _log(self, scope, status_code: int, duration_ms: float) -> None:
+        settings = get_settings()
+        if (
+            status_code < 400
+            and duration_ms < settings.LOG_SLOW_REQUEST_MS
+            and random.random() >= settings.LOG_SUCCESS_SAMPLE_RATE
+        ):
+            return
+        level = logging.ERROR if status_code >= 500 else logging.WARNING if status_code >= 400 else logging.INFO
+        self.logger.log(level, "request completed", extra={
+            "method": scope.get("method"),
+            "path": scope.get("path"),
+            "status": status_code,
+            "duration_ms": round(duration_ms, 2),
+        })
@@ -0,0 +1,315 @@
+# app/utils/media.py
+import asyncio
+import hashlib
+import logging
+import mimetypes
+import os
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+import anyio
+from bson import ObjectId
+from mongoengine import NotUniqueError
+
+from app.models.media import EmbeddedMedia, Media, MediaCreate, MediaResponse
+from app.models.user import User
+from app.utils.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+# Longest side in pixels of each generated image variant
+IMAGE_VARIANT_SIZES: Dict[str, int] = {
+    "thumbnail": 320,
+    "medium": 1280,
+}
+
+ALLOWED_MEDIA_TYPES = ("image", "video", "audio")
+# Image formats the variant generation can open; HEIC/HEIF needs a plugin
+# Pillow does not ship, so clients upload iPhone photos as JPEG
+ALLOWED_IMAGE_TYPES = ("image/jpeg", "image/png", "image/gif", "image/webp")
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+
+
+class MediaTooLargeError(Exception):
+    """Raised when an upload stream exceeds the configured size limit."""
+
+
+class LocalMediaStorage:
+    """
+    Media storage on the local filesystem.
+
+    Files are stored under `root/<first two hex digits of sha256>/<stem><ext>`
+    and served from `base_url`; generated variants sit next to them as
+    `<stem>_<variant>.jpg`. Uploads are written to `temp_dir` first, which
+    must be outside the served `root` and on the same filesystem. An
+    object-storage backend only needs to provide the same methods.
+    """
+
+    def __init__(self, root: str, base_url: str, temp_dir: str):
+        self.root = root
+        self.base_url = base_url.rstrip("/")
+        self.temp_dir = temp_dir
+
+    def path_for(self, key: str) -> str:
+        return os.path.join(self.root, *key.split("/"))
+
+    def url_for(self, key: str) -> str:
+        return f"{self.base_url}/{key}"
+
+    async def write_stream(
+        self, chunks: AsyncIterator[bytes], max_bytes: int
+    ) -> Tuple[str, str, int]:
+        """
+        Writes an upload stream to a temporary file while hashing it.
+
+        Args:
+            chunks: The request body chunks.
+            max_bytes: Maximum accepted upload size.
+
+        Returns:
+            Tuple[str, str, int]: Temporary file path, sha256 hex digest and size.
+
+        Raises:
+            MediaTooLargeError: If the stream is larger than `max_bytes`.
+        """
+        os.makedirs(self.temp_dir, exist_ok=True)
+        temp_path = os.path.join(self.temp_dir, uuid.uuid4().hex)
+
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            async with await anyio.open_file(temp_path, "wb") as file:
+                async for chunk in chunks:
+                    if not chunk:
+                        continue
+                    size += len(chunk)
+                    if size > max_bytes:
+                        raise MediaTooLargeError(f"Upload exceeds {max_bytes} bytes")
+                    digest.update(chunk)
+                    await file.write(chunk)
+        except BaseException:
+            self.discard(temp_path)
+            raise
+        return temp_path, digest.hexdigest(), size
+
+    def commit(self, temp_path: str, key: str) -> None:
+        """Moves a finished temporary upload to its storage key."""
+        target = self.path_for(key)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(temp_path, target)
+
+    def discard(self, temp_path: str) -> None:
+        try:
+            os.remove(temp_path)
+        except FileNotFoundError:
+            pass
+
+    def delete(self, key: str) -> None:
+        self.discard(self.path_for(key))
+
+
+def new_storage_key(digest: str, extension: str) -> str:
+    """
+    A fresh storage key for newly written content. Keys are unique per
+    write rather than per content, so deleting the files of one write never
+    removes files another upload of the same content has just written.
+    """
+    return f"{digest[:2]}/{digest}-{uuid.uuid4().hex[:12]}{extension}"
+
+
+def storage_keys(key: str, variant_names) -> List[str]:
+    """Storage keys of an uploaded file and its generated variants."""
+    prefix, file_name = key.rsplit("/", 1)
+    stem = os.path.splitext(file_name)[0]
+    return [key] + [f"{prefix}/{stem}_{name}.jpg" for name in variant_names]
+
+
+def delete_media_files(storage: LocalMediaStorage, key: str, variant_names) -> None:
+    """Deletes a stored file and its generated variants; missing files are skipped."""
+    for file_key in storage_keys(key, variant_names):
+        storage.delete(file_key)
+
+
+def get_media_storage() -> LocalMediaStorage:
+    settings = get_settings()
+    return LocalMediaStorage(settings.MEDIA_STORAGE_DIR, settings.MEDIA_BASE_URL, settings.MEDIA_TEMP_DIR)
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """Returns the process pool used for CPU-heavy media processing."""
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(max_workers=get_settings().MEDIA_PROCESS_WORKERS)
+    return _process_pool
+
+
+def shutdown_process_pool() -> None:
+    global _process_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=True, cancel_futures=True)
+        _process_pool = None
+
+
+def resolve_media_type(content_type: str) -> Tuple[str, str]:
+    """
+    Maps a request Content-Type to a media type and file extension.
+
+    Raises:
+        ValueError: If the content type is not an accepted media type.
+    """
+    content_type = content_type.split(";")[0].strip().lower()
+    media_type = content_type.split("/")[0]
+    if media_type not in ALLOWED_MEDIA_TYPES or (media_type == "image" and content_type not in ALLOWED_IMAGE_TYPES):
+        raise ValueError(f"Unsupported content type: {content_type or 'missing'}")
+    extension = mimetypes.guess_extension(content_type) or ""
+    return media_type, extension
+
+
+def generate_image_variants(
+    source_path: str, target_dir: str, stem: str, sizes: Dict[str, int]
+) -> Dict:
+    """
+    Generates downscaled JPEG variants of an image. Runs in a worker process.
+
+    Returns:
+        Dict: The original `width`/`height` and a `variants` mapping of
+        variant name to file name inside `target_dir`.
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(source_path) as original:
+        image = ImageOps.exif_transpose(original)
+        width, height = image.size
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+
+        variants = {}
+        for name, max_side in sizes.items():
+            variant = image.copy()
+            variant.thumbnail((max_side, max_side))
+            file_name = f"{stem}_{name}.jpg"
+            variant.save(os.path.join(target_dir, file_name), "JPEG", quality=82, optimize=True)
+            variants[name] = file_name
+
+    return {"width": width, "height": height, "variants": variants}
+
+
+async def process_image(storage: LocalMediaStorage, key: str) -> Dict:
+    """Runs variant generation for a stored image in the process pool."""
+    source_path = storage.path_for(key)
+    stem = os.path.splitext(os.path.basename(source_path))[0]
+    loop = asyncio.get_running_loop()
+    result = await loop.run_in_executor(
+        get_process_pool(),
+        generate_image_variants,
+        source_path,
+        os.path.dirname(source_path),
+        stem,
+        IMAGE_VARIANT_SIZES,
+    )
+    prefix = key.rsplit("/", 1)[0]
+    result["variants"] = {
+        name: storage.url_for(f"{prefix}/{file_name}")
+        for name, file_name in result["variants"].items()
+    }
+    return result
+
+
+def reuse_media(digest: str, uploader: User, description: str) -> Optional[Media]:
+    """
+    Returns the uploader's record of already stored content, creating one
+    that shares another uploader's files if needed.
+
+    Returns:
+        Optional[Media]: None if the content is not stored, or its files are
+        being deleted by an account purge.
+    """
+    own = Media.objects(sha256=digest, uploaded_by=uploader).first()
+    if own:
+        return own
+    source = Media.objects(sha256=digest).first()
+    if not source:
+        return None
+
+    media = Media(
+        type=source.type,
+        url=source.url,
+        description=description,
+        sha256=digest,
+        content_type=source.content_type,
+        size=source.size,
+        storage_key=source.storage_key,
+        width=source.width,
+        height=source.height,
+        variants=dict(source.variants or {}),
+        uploaded_by=uploader
+    )
+    try:
+        media.save()
+    except NotUniqueError:
+        # A concurrent upload of the same content by the same user
+        return Media.objects(sha256=digest, uploaded_by=uploader).first()
+    # The purge unsets sha256 before it checks for other records of the
+    # files; if that already happened, this copy may not have been seen
+    if not Media.objects(id=source.id, sha256=digest).only("id").first():
+        media.delete()
+        return None
+    return media
+
+
+def build_embedded_medias(medias: List[MediaCreate], user_id: ObjectId) -> List[EmbeddedMedia]:
+    """
+    Builds embedded media records for a note or diary entry of a user.
+
+    Uploaded media referenced by `media_id` are resolved in a single query
+    and carry their generated variants along. Only the user's own uploads
+    can be referenced.
+
+    Raises:
+        ValueError: If a referenced media does not exist or was uploaded by
+            another user, or an item has neither `media_id` nor `type` and `url`.
+    """
+    media_ids = [ObjectId(m.media_id) for m in medias if m.media_id]
+    uploaded = {m.id: m for m in Media.objects(id__in=media_ids, uploaded_by=user_id)} if media_ids else {}
+
+    media_objects = []
+    for media_data in medias:
+        if media_data.media_id:
+            source = uploaded.get(ObjectId(media_data.media_id))
+            if not source:
+                raise ValueError(f"Media {media_data.media_id} not found")
+            media_objects.append(EmbeddedMedia(
+                id=ObjectId(),
+                media_id=source.id,
+                type=source.type,
+                url=source.url,
+                description=media_data.description or source.description,
+                variants=dict(source.variants or {})
+            ))
+        elif media_data.type and media_data.url:
+            media_objects.append(EmbeddedMedia(
+                id=ObjectId(),
+                type=media_data.type,
+                url=media_data.url,
+                description=media_data.description
+            ))
+        else:
+            raise ValueError("Each media requires either media_id or type and url")
+    return media_objects
+
+
+def create_media_response(media) -> MediaResponse:
+    """創建媒體響應對象，適用於 Media 與 EmbeddedMedia"""
+    variants = dict(getattr(media, "variants", None) or {})
+    media_id = media.id if isinstance(media, Media) else getattr(media, "media_id", None)
+    return MediaResponse(
+        _id=str(media.id) if getattr(media, "id", None) else None,
+        media_id=str(media_id) if media_id else None,
+        type=media.type,
+        url=media.url,
+        description=media.description,
+        thumbnail_url=variants.get("thumbnail"),
+        variants=variants
+    )
@@ -0,0 +1,225 @@
+# app/utils/migrations.py
+"""
+One-off data migrations.
+
+Run with `python -m app.utils.migrations <name>`, e.g.
+`python -m app.utils.migrations day-keys`.
+"""
+import argparse
+import logging
+from datetime import time
+from typing import Callable, Dict
+
+from pymongo import DeleteMany, UpdateOne
+
+from app.models.archive import DiaryArchive
+from app.models.diary import Diary, DiaryEntry
+from app.models.media import Media
+from app.models.note import Note
+from app.models.user import User
+from app.utils.archive import decompress_diaries, referenced_media_ids
+from app.utils.dates import to_day_key, utc_local_day
+from app.utils.database import init_db
+from app.utils.emotion_catalog import emotion_catalog
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+
+
+def _flush(collection, operations: list) -> int:
+    if not operations:
+        return 0
+    collection.bulk_write(operations, ordered=False)
+    count = len(operations)
+    operations.clear()
+    return count
+
+
+def migrate_emotion_codes() -> Dict[str, int]:
+    """
+    Converts free-form emotion strings on notes and diary entries to catalog
+    codes, adding unseen emotions to the catalog.
+
+    Returns:
+        Dict[str, int]: Number of updated notes and diaries.
+    """
+    emotion_catalog.load()
+    legacy = {"$type": "string"}
+
+    notes = Note._get_collection()
+    operations, updated_notes = [], 0
+    for doc in notes.find({"emotions": legacy}, {"emotions": 1}):
+        codes = emotion_catalog.ensure(e for e in doc["emotions"] if isinstance(e, str))
+        codes += [e for e in doc["emotions"] if isinstance(e, int) and e not in codes]
+        operations.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"emotions": codes}}))
+        if len(operations) >= BATCH_SIZE:
+            updated_notes += _flush(notes, operations)
+    updated_notes += _flush(notes, operations)
+
+    diaries = Diary._get_collection()
+    operations, updated_diaries = [], 0
+    for doc in diaries.find({"entries.emotions": legacy}, {"entries": 1}):
+        for entry in doc.get("entries", []):
+            emotions = entry.get("emotions", [])
+            codes = emotion_catalog.ensure(e for e in emotions if isinstance(e, str))
+            entry["emotions"] = codes + [e for e in emotions if isinstance(e, int) and e not in codes]
+        operations.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"entries": doc["entries"]}}))
+        if len(operations) >= BATCH_SIZE:
+            updated_diaries += _flush(diaries, operations)
+    updated_diaries += _flush(diaries, operations)
+
+    return {"notes": updated_notes, "diaries": updated_diaries}
+
+
+def migrate_day_keys() -> Dict[str, int]:
+    """
+    Backfills `Diary.day_key` from the stored UTC `date` and each user's
+    timezone. Diaries of the same user that fall on the same local day are
+    merged into the oldest one, so the unique (user_id, day_key) index can
+    be built.
+
+    Returns:
+        Dict[str, int]: Number of keyed and merged diaries.
+    """
+    diaries = Diary._get_collection()
+    keyed, merged = 0, 0
+
+    for user_id in diaries.distinct("user_id", {"day_key": {"$exists": False}}):
+        user = User.objects(id=user_id).only("timezone").first()
+        tz_name = user.timezone if user else None
+
+        # Diaries already keyed by the application win over legacy ones
+        targets = {
+            doc["day_key"]: doc["_id"]
+            for doc in diaries.find({"user_id": user_id, "day_key": {"$exists": True}}, {"day_key": 1})
+        }
+        operations, duplicates = [], []
+        legacy = diaries.find(
+            {"user_id": user_id, "day_key": {"$exists": False}},
+            {"date": 1, "entries": 1}
+        ).sort("created_at", 1)
+        for doc in legacy:
+            stored = doc["date"]
+            # Midnight values were sent by clients as plain calendar dates
+            day = stored.date() if stored.time() == time(0) else utc_local_day(stored, tz_name)
+            day_key = to_day_key(day)
+            target = targets.get(day_key)
+            if target is None:
+                targets[day_key] = doc["_id"]
+                operations.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"day_key": day_key}}))
+                keyed += 1
+            else:
+                operations.append(UpdateOne(
+                    {"_id": target},
+                    {"$push": {"entries": {"$each": doc.get("entries", [])}}}
+                ))
+                duplicates.append(doc["_id"])
+                merged += 1
+
+        # Merge into targets before deleting the duplicates
+        _flush(diaries, operations)
+        if duplicates:
+            diaries.bulk_write([DeleteMany({"_id": {"$in": duplicates}})])
+
+    Diary.ensure_indexes()
+    return {"keyed": keyed, "merged": merged}
+
+
+def migrate_diary_moods() -> Dict[str, int]:
+    """
+    Backfills `Diary.mood`, the dominant emotion code read by the calendar.
+
+    Returns:
+        Dict[str, int]: Number of updated diaries.
+    """
+    diaries = Diary._get_collection()
+    operations, updated = [], 0
+    for doc in diaries.find({"mood": {"$exists": False}}, {"entries.emotions": 1}):
+        mood = Diary(entries=[DiaryEntry(**entry) for entry in doc.get("entries", [])]).compute_mood()
+        operations.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"mood": mood}}))
+        if len(operations) >= BATCH_SIZE:
+            updated += _flush(diaries, operations)
+    updated += _flush(diaries, operations)
+
+    return {"diaries": updated}
+
+
+def enable_change_stream_pre_images() -> Dict[str, int]:
+    """
+    Stores pre-images for diaries and notes (MongoDB 6.0+), so change
+    notifications can name the owner of a deleted document. Set
+    `SYNC_PRE_IMAGES=true` afterwards.
+
+    Returns:
+        Dict[str, int]: Number of updated collections.
+    """
+    collections = [Diary._get_collection(), Note._get_collection()]
+    for collection in collections:
+        collection.database.command(
+            "collMod", collection.name, changeStreamPreAndPostImages={"enabled": True}
+        )
+    return {"collections": len(collections)}
+
+
+def migrate_media_owners() -> Dict[str, int]:
+    """
+    Drops the unique `sha256` index of `medias`: each uploader now has a
+    record of their own, and records of the same content share its files.
+
+    Returns:
+        Dict[str, int]: Number of dropped indexes.
+    """
+    medias = Media._get_collection()
+    dropped = 0
+    for name, spec in medias.index_information().items():
+        if spec["key"] == [("sha256", 1)] and spec.get("unique"):
+            medias.drop_index(name)
+            dropped += 1
+    Media.ensure_indexes()
+    return {"indexes": dropped}
+
+
+def migrate_archive_media_ids() -> Dict[str, int]:
+    """
+    Backfills `DiaryArchive.media_ids`, so the account purge can see uploads
+    referenced from archived diaries without decompressing them.
+
+    Returns:
+        Dict[str, int]: Number of updated archives.
+    """
+    archives = DiaryArchive._get_collection()
+    operations, updated = [], 0
+    for doc in archives.find({"media_ids": {"$exists": False}}, {"payload": 1}):
+        media_ids = referenced_media_ids(decompress_diaries(doc["payload"]))
+        operations.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"media_ids": media_ids}}))
+        if len(operations) >= BATCH_SIZE:
+            updated += _flush(archives, operations)
+    updated += _flush(archives, operations)
+
+    return {"archives": updated}
+
+
+MIGRATIONS: Dict[str, Callable[[], Dict[str, int]]] = {
+    "emotion-codes": migrate_emotion_codes,
+    "day-keys": migrate_day_keys,
+    "diary-moods": migrate_diary_moods,
+    "change-stream-pre-images": enable_change_stream_pre_images,
+    "media-owners": migrate_media_owners,
+    "archive-media-ids": migrate_archive_media_ids,
+}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run a data migration")
+    parser.add_argument("name", choices=sorted(MIGRATIONS))
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    init_db()
+    result = MIGRATIONS[args.name]()
+    logger.info(f"Migration {args.name} finished: {result}")
+
+
+if __name__ == "__main__":
+    main()
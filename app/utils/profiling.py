@@ -0,0 +1,154 @@
+# app/utils/profiling.py
+"""
+Opt-in per-request profiling.
+
+A request is profiled when it carries `X-Profile: <PROFILING_TOKEN>` or is
+picked by `PROFILING_SAMPLE_RATE`. While it runs, a sampler thread records
+the stacks of the worker's busy threads every `PROFILING_INTERVAL_MS`, so
+time spent in sync routes on the threadpool is captured too. The report is
+written to `PROFILING_DIR/<request_id>.folded` in the collapsed-stack format
+read by flamegraph.pl and speedscope, and the request's MongoDB command
+count and time are logged next to it.
+
+Only one request per worker is profiled at a time. Samples come from every
+busy thread of the worker, so reports are clearest on a quiet worker.
+"""
+import hmac
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from typing import Optional
+
+from anyio import to_thread
+
+from app.utils.config import get_settings
+from app.utils.log import request_id_var
+
+logger = logging.getLogger(__name__)
+
+# Frames a thread sits in while it has nothing to do
+_IDLE_FUNCTIONS = {"wait", "select", "poll", "run", "run_forever", "dequeue"}
+
+
+class RequestProfile:
+    """Stack samples and MongoDB timings collected for one request."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.mongo_commands = 0
+        self.mongo_ms = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def record_mongo(self, duration_ms: float) -> None:
+        self.mongo_commands += 1
+        self.mongo_ms += duration_ms
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                if not stack or stack[0].split(" ", 1)[0] in _IDLE_FUNCTIONS:
+                    continue
+                if thread_id not in names:
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def folded(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+current_profile: ContextVar[Optional[RequestProfile]] = ContextVar("current_profile", default=None)
+
+
+class ProfilingMiddleware:
+    """Profiles requests selected by the privileged header or the sample rate."""
+
+    def __init__(self, app):
+        self.app = app
+        self._lock = threading.Lock()
+
+    def _wants_profile(self, scope) -> bool:
+        settings = get_settings()
+        headers = dict(scope.get("headers", []))
+        if b"text/event-stream" in headers.get(b"accept", b""):
+            # Long-lived streams would hold the profiler for their whole lifetime
+            return False
+        if settings.PROFILING_TOKEN and b"x-profile" in headers:
+            return hmac.compare_digest(headers[b"x-profile"], settings.PROFILING_TOKEN.encode())
+        return random.random() < settings.PROFILING_SAMPLE_RATE
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._wants_profile(scope) or not self._lock.acquire(blocking=False):
+            await self.app(scope, receive, send)
+            return
+
+        request_id = request_id_var.get()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-profile-id", request_id.encode("latin-1"))
+                ]
+            await send(message)
+
+        profile = RequestProfile(get_settings().PROFILING_INTERVAL_MS / 1000)
+        token = current_profile.set(profile)
+        start = time.perf_counter()
+        profile.start()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            profile.stop()
+            duration_ms = (time.perf_counter() - start) * 1000
+            current_profile.reset(token)
+            self._lock.release()
+            await to_thread.run_sync(self._save, scope, request_id, profile, duration_ms)
+
+    @staticmethod
+    def _save(scope, request_id: str, profile: RequestProfile, duration_ms: float) -> None:
+        directory = get_settings().PROFILING_DIR
+        path = os.path.join(directory, f"{os.path.basename(request_id)}.folded")
+        try:
+            os.makedirs(directory, exist_ok=True)
+            with open(path, "w") as f:
+                f.write(profile.folded())
+        except OSError:
+            logger.exception("Failed to write profile report")
+            path = None
+
+        logger.info("request profiled", extra={
+            "method": scope.get("method"),
+            "path": scope.get("path"),
+            "duration_ms": round(duration_ms, 2),
+            "samples": profile.samples,
+            "mongo_commands": profile.mongo_commands,
+            "mongo_ms": round(profile.mongo_ms, 2),
+            "report": path,
+        })
@@ -0,0 +1,312 @@
+# app/utils/purge.py
+"""
+Background deletion of accounts.
+
+`DELETE /auth/me` only records an `AccountPurge` task and revokes the
+user's sessions. This job then removes the data collection by collection
+in batches of `PURGE_BATCH_SIZE` `_id`s, one `delete_many` per batch, and
+sleeps between batches so it uses at most `PURGE_MAX_DUTY_CYCLE` of the
+database time it would otherwise take. Every batch is recorded on the task,
+so a crashed run resumes at the stage it stopped in; each stage is
+idempotent.
+
+Run the job with `python -m app.utils.purge`, or `--loop SECONDS` to keep
+polling for new tasks.
+"""
+import argparse
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+
+from app.models.archive import DiaryArchive
+from app.models.diary import Diary
+from app.models.feed import Follow, TimelineItem
+from app.models.media import Media
+from app.models.note import Note
+from app.models.purge import AccountPurge
+from app.models.token import RefreshToken
+from app.models.user import User
+from app.utils.cache import response_cache, user_cache_key
+from app.utils.config import get_settings
+from app.utils.media import get_media_storage, storage_keys
+from app.utils.revocation import revocation_cache
+
+logger = logging.getLogger(__name__)
+
+# A worker that stops renewing its lease for this long is considered dead
+LEASE = timedelta(minutes=5)
+
+
+def request_account_purge(user_id: ObjectId, email: str) -> AccountPurge:
+    """
+    Schedules the deletion of an account and ends its sessions at once.
+    Requesting again returns the existing task.
+    """
+    now = datetime.utcnow()
+    AccountPurge._get_collection().update_one(
+        {"user_id": user_id},
+        {"$setOnInsert": {
+            "email": email, "status": "pending", "counts": {}, "requested_at": now, "updated_at": now
+        }},
+        upsert=True
+    )
+    _revoke_tokens(email)
+    return AccountPurge.objects(user_id=user_id).first()
+
+
+def purge_in_progress(email: str) -> bool:
+    """Whether an account with this email is being deleted; sign-in is refused until it is done."""
+    return AccountPurge.objects(email=email, status__ne="done").only("id").first() is not None
+
+
+def _revoke_tokens(email: str) -> int:
+    """
+    Revokes every refresh token of the user. The records are kept, so the
+    revocation cache keeps rejecting their access tokens, and are removed
+    by the TTL index when they expire.
+    """
+    tokens = RefreshToken._get_collection()
+    families = tokens.distinct("family_id", {"subject": email, "revoked_at": None})
+    if not families:
+        return 0
+    revoked = tokens.update_many(
+        {"subject": email, "revoked_at": None}, {"$set": {"revoked_at": datetime.utcnow()}}
+    ).modified_count
+    revocation_cache.add(*families)
+    return revoked
+
+
+def _pause(elapsed: float) -> None:
+    """Sleeps long enough that batches use at most the configured duty cycle."""
+    duty = get_settings().PURGE_MAX_DUTY_CYCLE
+    if 0 < duty < 1:
+        time.sleep(elapsed * (1 - duty) / duty)
+
+
+def _record(purge: AccountPurge, stage: str, count: int) -> None:
+    """Saves batch progress and renews the lease."""
+    now = datetime.utcnow()
+    purge.counts[stage] = purge.counts.get(stage, 0) + count
+    AccountPurge._get_collection().update_one(
+        {"_id": purge.id},
+        {"$inc": {f"counts.{stage}": count}, "$set": {"updated_at": now, "lease_until": now + LEASE}}
+    )
+
+
+def _delete_in_batches(purge: AccountPurge, stage: str, collection, query: Dict) -> None:
+    batch_size = get_settings().PURGE_BATCH_SIZE
+    while True:
+        started = time.monotonic()
+        ids = [doc["_id"] for doc in collection.find(query, {"_id": 1}).limit(batch_size)]
+        if not ids:
+            return
+        _record(purge, stage, collection.delete_many({"_id": {"$in": ids}}).deleted_count)
+        _pause(time.monotonic() - started)
+
+
+def _purge_tokens(purge: AccountPurge) -> None:
+    _record(purge, "tokens", _revoke_tokens(purge.email))
+
+
+def _purge_notes(purge: AccountPurge) -> None:
+    _delete_in_batches(purge, "notes", Note._get_collection(), {"user_id": purge.user_id})
+
+
+def _purge_diaries(purge: AccountPurge) -> None:
+    _delete_in_batches(purge, "diaries", Diary._get_collection(), {"user_id": purge.user_id})
+
+
+def _purge_archives(purge: AccountPurge) -> None:
+    _delete_in_batches(purge, "diary_archives", DiaryArchive._get_collection(), {"user_id": purge.user_id})
+
+
+def _purge_follows(purge: AccountPurge) -> None:
+    """
+    Removes the user's follow relations and updates the counts of the other
+    side. Each relation is taken with `find_one_and_delete`, so a concurrent
+    unfollow that removes it first is the only one to change the counts.
+    """
+    follows = Follow._get_collection()
+    users = User._get_collection()
+    batch_size = get_settings().PURGE_BATCH_SIZE
+    query = {"$or": [{"follower_id": purge.user_id}, {"followee_id": purge.user_id}]}
+
+    while True:
+        started = time.monotonic()
+        deleted = 0
+        for _ in range(batch_size):
+            doc = follows.find_one_and_delete(query)
+            if doc is None:
+                break
+            if doc["follower_id"] == purge.user_id:
+                users.update_one({"_id": doc["followee_id"]}, {"$inc": {"followers_count": -1}})
+            else:
+                users.update_one({"_id": doc["follower_id"]}, {"$inc": {"following_count": -1}})
+            deleted += 1
+        if not deleted:
+            return
+        _record(purge, "follows", deleted)
+        _pause(time.monotonic() - started)
+        if deleted < batch_size:
+            return
+
+
+def _purge_timeline(purge: AccountPurge) -> None:
+    # Items of the user's diaries in other timelines point to deleted diaries;
+    # feed reads skip them and timeline trimming drops them
+    _delete_in_batches(purge, "timeline", TimelineItem._get_collection(), {"owner_id": purge.user_id})
+
+
+def _media_keys(doc: Dict) -> List[str]:
+    """Storage keys of an uploaded file and its generated variants."""
+    key = doc.get("storage_key")
+    return storage_keys(key, doc.get("variants") or {}) if key else []
+
+
+def _purge_media(purge: AccountPurge) -> None:
+    """
+    Deletes the user's uploads. Files are shared by every uploader of the
+    same content and kept while another record uses them; a record another
+    user's note, diary or archived diary references is kept and only loses
+    its uploader.
+    """
+    medias = Media._get_collection()
+    storage = get_media_storage()
+    batch_size = get_settings().PURGE_BATCH_SIZE
+    query = {"uploaded_by": purge.user_id}
+
+    while True:
+        started = time.monotonic()
+        docs = list(medias.find(query, {"storage_key": 1, "variants": 1}).limit(batch_size))
+        if not docs:
+            return
+        ids = [doc["_id"] for doc in docs]
+        # Marks the records as being deleted: uploads of the same content no
+        # longer reuse them, and one that just did is seen below (see reuse_media)
+        medias.update_many({"_id": {"$in": ids}}, {"$unset": {"sha256": ""}})
+
+        # The user's own notes, diaries and archives are already gone
+        shared = set(Note._get_collection().distinct("medias.media_id", {"medias.media_id": {"$in": ids}}))
+        shared.update(Diary._get_collection().distinct(
+            "entries.medias.media_id", {"entries.medias.media_id": {"$in": ids}}
+        ))
+        shared.update(DiaryArchive._get_collection().distinct("media_ids", {"media_ids": {"$in": ids}}))
+        shared &= set(ids)
+
+        unused = [doc for doc in docs if doc["_id"] not in shared]
+        # Records of other uploaders share the files of the same content
+        kept_keys = set(medias.distinct("storage_key", {
+            "storage_key": {"$in": [doc["storage_key"] for doc in unused if doc.get("storage_key")]},
+            "uploaded_by": {"$ne": purge.user_id}
+        }))
+        # Files first, so a crash never leaves files without a record to find them by
+        for doc in unused:
+            if doc.get("storage_key") not in kept_keys:
+                for key in _media_keys(doc):
+                    storage.delete(key)
+        if shared:
+            medias.update_many({"_id": {"$in": list(shared)}}, {"$unset": {"uploaded_by": ""}})
+        deleted = medias.delete_many({"_id": {"$in": [doc["_id"] for doc in unused]}}).deleted_count
+        _record(purge, "media", deleted)
+        _pause(time.monotonic() - started)
+
+
+def _purge_user(purge: AccountPurge) -> None:
+    _record(purge, "user", User._get_collection().delete_one({"_id": purge.user_id}).deleted_count)
+    response_cache.invalidate(user_cache_key(purge.user_id))
+
+
+# Run in order; media goes after notes and diaries so only other users' references remain
+STAGES: List[Tuple[str, Callable[[AccountPurge], None]]] = [
+    ("tokens", _purge_tokens),
+    ("follows", _purge_follows),
+    ("timeline", _purge_timeline),
+    ("notes", _purge_notes),
+    ("diaries", _purge_diaries),
+    ("diary_archives", _purge_archives),
+    ("media", _purge_media),
+    ("user", _purge_user),
+]
+
+
+def _claim() -> Optional[AccountPurge]:
+    """Takes the oldest task no live worker owns."""
+    now = datetime.utcnow()
+    doc = AccountPurge._get_collection().find_one_and_update(
+        {
+            "status": {"$in": ["pending", "running"]},
+            "$or": [{"lease_until": None}, {"lease_until": {"$lt": now}}],
+        },
+        {"$set": {"status": "running", "lease_until": now + LEASE, "updated_at": now}},
+        sort=[("requested_at", 1)],
+        return_document=ReturnDocument.AFTER
+    )
+    return AccountPurge._from_son(doc) if doc else None
+
+
+def run_purge(purge: AccountPurge) -> None:
+    """Runs the remaining stages of a claimed task."""
+    collection = AccountPurge._get_collection()
+    names = [name for name, _ in STAGES]
+    start = names.index(purge.stage) if purge.stage in names else 0
+    if purge.started_at is None:
+        collection.update_one({"_id": purge.id}, {"$set": {"started_at": datetime.utcnow()}})
+
+    for name, stage in STAGES[start:]:
+        collection.update_one({"_id": purge.id}, {"$set": {"stage": name}})
+        stage(purge)
+        logger.info(f"Purge of user {purge.user_id}: {name} done, {purge.counts.get(name, 0)} removed")
+
+    now = datetime.utcnow()
+    collection.update_one(
+        {"_id": purge.id},
+        {"$set": {"status": "done", "finished_at": now, "updated_at": now, "lease_until": None},
+         "$unset": {"error": ""}}
+    )
+
+
+def purge_pending_accounts() -> Dict[str, int]:
+    """
+    Runs every claimable task. A failed task keeps its stage and its lease,
+    so it is retried from that stage once the lease expires.
+
+    Returns:
+        Dict[str, int]: Number of finished and failed tasks.
+    """
+    finished, failed = 0, 0
+    while True:
+        purge = _claim()
+        if purge is None:
+            break
+        try:
+            run_purge(purge)
+            finished += 1
+        except Exception as e:
+            logger.exception(f"Purge of user {purge.user_id} failed")
+            AccountPurge._get_collection().update_one({"_id": purge.id}, {"$set": {"error": str(e)}})
+            failed += 1
+    return {"finished": finished, "failed": failed}
+
+
+def main() -> None:
+    from app.utils.database import init_db
+
+    parser = argparse.ArgumentParser(description="Delete accounts scheduled for deletion")
+    parser.add_argument("--loop", type=float, metavar="SECONDS", help="Keep polling for new tasks")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    init_db()
+    while True:
+        logger.info(f"Purge finished: {purge_pending_accounts()}")
+        if not args.loop:
+            break
+        time.sleep(args.loop)
+
+
+if __name__ == "__main__":
+    main()
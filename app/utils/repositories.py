@@ -0,0 +1,721 @@
+# app/utils/repositories.py
+"""
+Storage backends for users, diaries and notes.
+
+Routes go through the repositories returned by `get_storage()` instead of
+calling `Document.objects` directly. `STORAGE_BACKEND=mongo` is the
+production implementation; `STORAGE_BACKEND=memory` keeps documents in
+indexed dicts with the same semantics (unique keys, ordering, validation,
+copies on read), so tests and benchmarks can measure application CPU cost
+without a database. Refresh tokens, media and cold-storage archives still
+live in MongoDB only.
+"""
+import bisect
+import copy
+import heapq
+import threading
+from collections import defaultdict
+from datetime import datetime
+from itertools import islice
+from typing import Dict, List, Optional, Tuple
+
+from bson import ObjectId
+from mongoengine import NotUniqueError, Q
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from app.models.diary import Diary, DiaryEntry
+from app.models.note import Note
+from app.models.user import User
+from app.utils.archive import (
+    archive_cutoff_key, archived_day_moods, find_archived_diaries, find_archived_diary, iter_archived_diaries,
+    iter_archived_documents, restore_archived_diary
+)
+from app.utils.config import get_settings
+from app.utils.geo import Box, distance_m, point
+
+# Fields read by the analytics history
+HISTORY_PROJECTION = {
+    "_id": 0,
+    "day_key": 1,
+    "entries.emotions": 1,
+    "entries.writing_time_seconds": 1,
+    "entries.imported_data": 1,
+}
+
+
+class UserRepository:
+    """Interface of user storage."""
+
+    def get(self, user_id: ObjectId) -> Optional[User]:
+        raise NotImplementedError
+
+    def get_many(self, user_ids: List[ObjectId]) -> List[User]:
+        """The users among `user_ids` that exist, in no particular order."""
+        raise NotImplementedError
+
+    def get_by_email(self, email: str) -> Optional[User]:
+        raise NotImplementedError
+
+    def sign_in(self, email: str, name: str, picture: Optional[str]) -> User:
+        """Creates the user on first sign-in and records the login time."""
+        raise NotImplementedError
+
+    def update(self, user_id: ObjectId, **fields) -> None:
+        raise NotImplementedError
+
+
+class DiaryRepository:
+    """Interface of diary storage. Diaries are unique per (user_id, day_key)."""
+
+    def get(self, user_id: ObjectId, diary_id: str) -> Optional[Diary]:
+        raise NotImplementedError
+
+    def get_public(self, refs: List[Tuple[ObjectId, ObjectId]]) -> List[Diary]:
+        """
+        The public diaries among (user_id, diary_id) pairs of any users, hot
+        or archived, in no particular order; e.g. the diaries of a feed page.
+        """
+        raise NotImplementedError
+
+    def get_by_day(self, user_id: ObjectId, day_key: int) -> Optional[Diary]:
+        raise NotImplementedError
+
+    def get_for_update(self, user_id: ObjectId, diary_id: str) -> Optional[Diary]:
+        """Loads a diary to modify and `save` it; archived diaries are restored first."""
+        raise NotImplementedError
+
+    def list(
+        self,
+        user_id: ObjectId,
+        start_key: Optional[int] = None,
+        end_key: Optional[int] = None,
+        emotion_code: Optional[int] = None,
+        skip: int = 0,
+        limit: int = 100
+    ) -> List[Diary]:
+        """Lists diaries newest day first."""
+        raise NotImplementedError
+
+    def append_entries(
+        self, user_id: ObjectId, day_key: int, entries: List[DiaryEntry],
+        is_public: bool, date: datetime, now: datetime
+    ) -> Diary:
+        """Appends entries to the day's diary, creating it if needed, in one atomic step."""
+        raise NotImplementedError
+
+    def set_mood(self, diary_id: ObjectId, mood: int, updated_at: datetime) -> None:
+        """Stores the mood unless the diary was modified after `updated_at`."""
+        raise NotImplementedError
+
+    def save(self, diary: Diary) -> Diary:
+        raise NotImplementedError
+
+    def delete(self, user_id: ObjectId, diary_id: str) -> Optional[Diary]:
+        """Removes a diary and returns it, or None if it does not exist."""
+        raise NotImplementedError
+
+    def day_moods(self, user_id: ObjectId, start_key: int, end_key: int) -> Dict[int, int]:
+        """Maps each day_key in range that has a diary to its mood."""
+        raise NotImplementedError
+
+    def history(self, user_id: ObjectId, start_key: Optional[int] = None, end_key: Optional[int] = None) -> List[dict]:
+        """Raw documents in range with the fields in HISTORY_PROJECTION."""
+        raise NotImplementedError
+
+    def restore(self, user_id: ObjectId, diary_id: Optional[str] = None, day_key: Optional[int] = None) -> Optional[Diary]:
+        """Brings an archived diary back so it can be modified."""
+        raise NotImplementedError
+
+
+class NoteRepository:
+    """Interface of note storage."""
+
+    def create(self, note: Note) -> Note:
+        raise NotImplementedError
+
+    def list(self, user_id: ObjectId, emotion_code: Optional[int] = None, skip: int = 0, limit: int = 100) -> List[Note]:
+        """Lists notes in insertion order."""
+        raise NotImplementedError
+
+    def get_many(self, user_id: ObjectId, note_ids: List[ObjectId]) -> List[Note]:
+        """The user's notes among `note_ids`, in `_id` order."""
+        raise NotImplementedError
+
+    def nearby(
+        self,
+        user_id: ObjectId,
+        longitude: float,
+        latitude: float,
+        radius_m: float,
+        after: Optional[Tuple[float, ObjectId]] = None,
+        limit: int = 50
+    ) -> List[Tuple[Note, float]]:
+        """Notes within `radius_m` with their distance, nearest first, after a (distance, _id) position."""
+        raise NotImplementedError
+
+    def in_box(self, user_id: ObjectId, box: Box, after_id: Optional[ObjectId] = None, limit: int = 100) -> List[Note]:
+        """Notes inside the box in `_id` order."""
+        raise NotImplementedError
+
+    def box_cells(self, user_id: ObjectId, box: Box, columns: int, rows: int, min_cluster: int) -> List[Dict]:
+        """
+        Groups the notes inside the box by grid cell. Each cell has `count`,
+        the mean `longitude` and `latitude`, and the note `ids` if it has
+        fewer than `min_cluster` notes; dense cells return no ids.
+        """
+        raise NotImplementedError
+
+
+class Storage:
+    """The repositories of one backend."""
+
+    def __init__(self, users: UserRepository, diaries: DiaryRepository, notes: NoteRepository):
+        self.users = users
+        self.diaries = diaries
+        self.notes = notes
+
+
+# MongoDB backend
+
+class MongoUserRepository(UserRepository):
+
+    def get(self, user_id: ObjectId) -> Optional[User]:
+        return User.objects(id=user_id).first()
+
+    def get_many(self, user_ids: List[ObjectId]) -> List[User]:
+        return list(User.objects(id__in=list(user_ids)))
+
+    def get_by_email(self, email: str) -> Optional[User]:
+        return User.objects(email=email).first()
+
+    def sign_in(self, email: str, name: str, picture: Optional[str]) -> User:
+        """
+        One atomic upsert: creates the user with all field defaults on first
+        sign-in and only touches the login times afterwards.
+        """
+        now = datetime.utcnow()
+        new_user = User(email=email, name=name, picture=picture, created_at=now)
+        new_user.validate()
+        on_insert = new_user.to_mongo().to_dict()
+        on_insert.pop("_id", None)
+        for field in ("last_login", "last_active"):
+            on_insert.pop(field, None)
+
+        collection = User._get_collection()
+        update = {"$setOnInsert": on_insert, "$set": {"last_login": now, "last_active": now}}
+        try:
+            doc = collection.find_one_and_update(
+                {"email": email}, update, upsert=True, return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            # Servers before 4.2 do not retry an upsert that lost the race on the unique email
+            doc = collection.find_one_and_update(
+                {"email": email}, update, upsert=True, return_document=ReturnDocument.AFTER
+            )
+        return User._from_son(doc)
+
+    def update(self, user_id: ObjectId, **fields) -> None:
+        User.objects(id=user_id).update_one(**{f"set__{name}": value for name, value in fields.items()})
+
+
+class MongoDiaryRepository(DiaryRepository):
+    """Hot diaries in the `diaries` collection, falling back to cold-storage archives."""
+
+    def get(self, user_id: ObjectId, diary_id: str) -> Optional[Diary]:
+        return (
+            Diary.objects(id=diary_id, user_id=user_id).first()
+            or find_archived_diary(user_id, diary_id=diary_id)
+        )
+
+    def get_public(self, refs: List[Tuple[ObjectId, ObjectId]]) -> List[Diary]:
+        owners = {diary_id: user_id for user_id, diary_id in refs}
+        # Diaries found hot are never looked up in the archives, even when private
+        hot = [diary for diary in Diary.objects(id__in=list(owners)) if diary.user_id.id == owners[diary.id]]
+        missing = defaultdict(list)
+        found = {diary.id for diary in hot}
+        for diary_id, user_id in owners.items():
+            if diary_id not in found:
+                missing[user_id].append(diary_id)
+        return [diary for diary in hot + find_archived_diaries(missing) if diary.is_public]
+
+    def get_by_day(self, user_id: ObjectId, day_key: int) -> Optional[Diary]:
+        diary = Diary.objects(user_id=user_id, day_key=day_key).first()
+        if not diary and day_key < archive_cutoff_key():
+            diary = find_archived_diary(user_id, day_key=day_key)
+        return diary
+
+    def get_for_update(self, user_id: ObjectId, diary_id: str) -> Optional[Diary]:
+        return (
+            Diary.objects(id=diary_id, user_id=user_id).first()
+            or restore_archived_diary(user_id, diary_id=diary_id)
+        )
+
+    def list(self, user_id, start_key=None, end_key=None, emotion_code=None, skip=0, limit=100) -> List[Diary]:
+        query = Q(user_id=user_id)
+        if end_key:
+            query &= Q(day_key__lte=end_key)
+        if emotion_code is not None:
+            query &= Q(entries__emotions=emotion_code)
+
+        # Days from the cutoff on are never archived, so the database pages them directly
+        cutoff = archive_cutoff_key()
+        recent = Diary.objects(query & Q(day_key__gte=max(start_key or cutoff, cutoff))).order_by("-day_key")
+        diaries = list(recent.skip(skip).limit(limit))
+        if limit and len(diaries) >= limit:
+            return diaries
+
+        # Older days are archived, except diaries restored since the last archive
+        # run (and legacy ones without a day_key): merge them with the archives by day
+        older_skip = 0 if diaries else max(0, skip - recent.count())
+        older_days = Q(day_key__gte=start_key, day_key__lt=cutoff) if start_key else Q(day_key__lt=cutoff) | Q(day_key=None)
+        older = heapq.merge(
+            Diary.objects(query & older_days).order_by("-day_key"),
+            iter_archived_diaries(user_id, start_key, end_key, emotion_code),
+            key=lambda diary: diary.day_key or 0,
+            reverse=True
+        )
+        diaries.extend(islice(older, older_skip, older_skip + limit - len(diaries) if limit else None))
+        return diaries
+
+    def append_entries(self, user_id, day_key, entries, is_public, date, now) -> Diary:
+        # Writes to an archived day restore that diary first
+        if day_key < archive_cutoff_key():
+            restore_archived_diary(user_id, day_key=day_key)
+
+        return Diary.objects(user_id=user_id, day_key=day_key).modify(
+            upsert=True,
+            new=True,
+            push_all__entries=entries,
+            set__is_public=is_public,
+            set__updated_at=now,
+            set_on_insert__date=date,
+            set_on_insert__created_at=now
+        )
+
+    def set_mood(self, diary_id: ObjectId, mood: int, updated_at: datetime) -> None:
+        Diary.objects(id=diary_id, updated_at=updated_at).update_one(set__mood=mood)
+
+    def save(self, diary: Diary) -> Diary:
+        return diary.save()
+
+    @staticmethod
+    def _remove(user_id: ObjectId, diary_id) -> Optional[Diary]:
+        # Marked first so the change stream can tell the owner about the delete
+        Diary._get_collection().update_one(
+            {"_id": ObjectId(diary_id), "user_id": user_id},
+            {"$set": {"deleted_at": datetime.utcnow(), "deleted_by": user_id}}
+        )
+        return Diary.objects(id=diary_id, user_id=user_id).only("id", "user_id", "date", "day_key").modify(remove=True)
+
+    def delete(self, user_id: ObjectId, diary_id: str) -> Optional[Diary]:
+        deleted = self._remove(user_id, diary_id)
+        if not deleted:
+            # An archived diary merged into the day's hot diary on restore is deleted with it
+            restored = restore_archived_diary(user_id, diary_id=diary_id)
+            if restored:
+                deleted = self._remove(user_id, restored.id)
+        return deleted
+
+    def day_moods(self, user_id: ObjectId, start_key: int, end_key: int) -> Dict[int, int]:
+        day_moods = {}
+        if start_key < archive_cutoff_key():
+            day_moods.update(archived_day_moods(user_id, start_key, end_key))
+
+        # Covered by the (user_id, day_key, mood) index
+        cursor = Diary._get_collection().find(
+            {"user_id": user_id, "day_key": {"$gte": start_key, "$lte": end_key}},
+            {"_id": 0, "day_key": 1, "mood": 1}
+        ).hint([("user_id", 1), ("day_key", 1), ("mood", 1)])
+        for doc in cursor:
+            day_moods[doc["day_key"]] = doc.get("mood") or 0
+        return day_moods
+
+    def history(self, user_id, start_key=None, end_key=None) -> List[dict]:
+        # Diaries not yet keyed by the day-keys migration have no day to count under
+        key_range = {"$exists": True}
+        if start_key:
+            key_range["$gte"] = start_key
+        if end_key:
+            key_range["$lte"] = end_key
+        query = {"user_id": user_id, "day_key": key_range}
+
+        docs = []
+        if not start_key or start_key < archive_cutoff_key():
+            docs.extend(iter_archived_documents(user_id, start_key, end_key, newest_first=False))
+        docs.extend(Diary._get_collection().find(query, HISTORY_PROJECTION))
+        return docs
+
+    def restore(self, user_id, diary_id=None, day_key=None) -> Optional[Diary]:
+        return restore_archived_diary(user_id, diary_id=diary_id, day_key=day_key)
+
+
+class MongoNoteRepository(NoteRepository):
+
+    def create(self, note: Note) -> Note:
+        return note.save()
+
+    def list(self, user_id, emotion_code=None, skip=0, limit=100) -> List[Note]:
+        query = {"user_id": user_id}
+        if emotion_code is not None:
+            query["emotions"] = emotion_code
+        return list(Note.objects(**query).skip(skip).limit(limit))
+
+    def get_many(self, user_id, note_ids) -> List[Note]:
+        return list(Note.objects(id__in=note_ids, user_id=user_id).order_by("id"))
+
+    @staticmethod
+    def _box_query(user_id: ObjectId, box: Box) -> Dict:
+        clauses = [{"position": {"$geoWithin": {"$geometry": polygon}}} for polygon in box.polygons()]
+        query = {"user_id": user_id}
+        if len(clauses) == 1:
+            query.update(clauses[0])
+        else:
+            query["$or"] = clauses
+        return query
+
+    def nearby(self, user_id, longitude, latitude, radius_m, after=None, limit=50) -> List[Tuple[Note, float]]:
+        geo_near = {
+            "near": point(longitude, latitude),
+            "key": "position",
+            "distanceField": "distance",
+            "maxDistance": radius_m,
+            "query": {"user_id": user_id},
+            "spherical": True,
+        }
+        pipeline = [{"$geoNear": geo_near}]
+        if after is not None:
+            distance, last_id = after
+            geo_near["minDistance"] = distance
+            pipeline.append({"$match": {"$or": [
+                {"distance": {"$gt": distance}},
+                {"distance": distance, "_id": {"$gt": last_id}},
+            ]}})
+        # Ties in distance are broken by _id so the cursor is stable
+        pipeline += [{"$sort": {"distance": 1, "_id": 1}}, {"$limit": limit}]
+
+        results = []
+        for doc in Note._get_collection().aggregate(pipeline):
+            distance = doc.pop("distance")
+            results.append((Note._from_son(doc), distance))
+        return results
+
+    def in_box(self, user_id, box, after_id=None, limit=100) -> List[Note]:
+        query = self._box_query(user_id, box)
+        if after_id is not None:
+            query["_id"] = {"$gt": after_id}
+        docs = Note._get_collection().find(query).sort("_id", 1).limit(limit)
+        return [Note._from_son(doc) for doc in docs]
+
+    def box_cells(self, user_id, box, columns, rows, min_cluster) -> List[Dict]:
+        # Longitudes are measured east of the west edge, so boxes across the antimeridian average correctly
+        x = {"$mod": [{"$add": [{"$subtract": [{"$arrayElemAt": ["$position.coordinates", 0]}, box.west]}, 360]}, 360]}
+        y = {"$subtract": [{"$arrayElemAt": ["$position.coordinates", 1]}, box.south]}
+        pipeline = [
+            {"$match": self._box_query(user_id, box)},
+            {"$project": {"x": x, "y": y}},
+            {"$group": {
+                "_id": {
+                    "column": {"$min": [columns - 1, {"$floor": {"$multiply": [{"$divide": ["$x", box.width]}, columns]}}]},
+                    "row": {"$min": [rows - 1, {"$floor": {"$multiply": [{"$divide": ["$y", box.height]}, rows]}}]},
+                },
+                "count": {"$sum": 1},
+                "x": {"$avg": "$x"},
+                "y": {"$avg": "$y"},
+                "ids": {"$push": "$_id"},
+            }},
+            # Only cells below min_cluster keep their ids, at most min_cluster - 1
+            # ($firstN would cap them in $group but needs MongoDB 5.2)
+            {"$set": {"ids": {"$cond": [
+                {"$lt": ["$count", min_cluster]}, {"$slice": ["$ids", min_cluster - 1]}, []
+            ]}}},
+        ]
+        return [
+            {
+                "count": cell["count"],
+                "longitude": (box.west + cell["x"] + 180) % 360 - 180,
+                "latitude": box.south + cell["y"],
+                "ids": cell["ids"],
+            }
+            for cell in Note._get_collection().aggregate(pipeline)
+        ]
+
+
+# In-memory backend
+
+class _MemoryCollection:
+    """
+    Documents stored as their MongoDB representation, keyed by `_id`.
+    Reads return fresh copies, so callers can never mutate stored state.
+    """
+
+    def __init__(self, document_class):
+        self.document_class = document_class
+        self.lock = threading.RLock()
+        self.docs: Dict[ObjectId, dict] = {}
+
+    def put(self, document) -> dict:
+        document.validate()
+        if document.id is None:
+            document.id = ObjectId()
+        doc = document.to_mongo().to_dict()
+        self.docs[doc["_id"]] = copy.deepcopy(doc)
+        return doc
+
+    def load(self, doc: Optional[dict]):
+        return self.document_class._from_son(copy.deepcopy(doc)) if doc is not None else None
+
+
+def _object_id(value) -> Optional[ObjectId]:
+    return value if isinstance(value, ObjectId) else ObjectId(value) if ObjectId.is_valid(value) else None
+
+
+class MemoryUserRepository(UserRepository):
+
+    def __init__(self):
+        self._users = _MemoryCollection(User)
+        self._by_email: Dict[str, ObjectId] = {}
+
+    def get(self, user_id: ObjectId) -> Optional[User]:
+        with self._users.lock:
+            return self._users.load(self._users.docs.get(_object_id(user_id)))
+
+    def get_many(self, user_ids: List[ObjectId]) -> List[User]:
+        with self._users.lock:
+            docs = (self._users.docs.get(_object_id(user_id)) for user_id in set(user_ids))
+            return [self._users.load(doc) for doc in docs if doc is not None]
+
+    def get_by_email(self, email: str) -> Optional[User]:
+        with self._users.lock:
+            return self._users.load(self._users.docs.get(self._by_email.get(email)))
+
+    def _save(self, user: User) -> User:
+        existing = self._by_email.get(user.email)
+        if existing is not None and existing != user.id:
+            raise NotUniqueError(f"User {user.email} already exists")
+        doc = self._users.put(user)
+        self._by_email[doc["email"]] = doc["_id"]
+        return user
+
+    def sign_in(self, email: str, name: str, picture: Optional[str]) -> User:
+        with self._users.lock:
+            user = self.get_by_email(email) or User(
+                email=email, name=name, picture=picture, created_at=datetime.utcnow()
+            )
+            user.last_login = datetime.utcnow()
+            user.last_active = datetime.utcnow()
+            return self._save(user)
+
+    def update(self, user_id: ObjectId, **fields) -> None:
+        with self._users.lock:
+            user = self.get(user_id)
+            if user is not None:
+                for name, value in fields.items():
+                    setattr(user, name, value)
+                self._save(user)
+
+
+class MemoryDiaryRepository(DiaryRepository):
+    """Diaries indexed by (user_id, day_key), with each user's day_keys kept sorted."""
+
+    def __init__(self):
+        self._diaries = _MemoryCollection(Diary)
+        self._by_day: Dict[Tuple[ObjectId, int], ObjectId] = {}
+        self._day_keys: Dict[ObjectId, List[int]] = defaultdict(list)
+
+    def _index(self, doc: dict) -> None:
+        key = (doc["user_id"], doc["day_key"])
+        if key not in self._by_day:
+            bisect.insort(self._day_keys[doc["user_id"]], doc["day_key"])
+        self._by_day[key] = doc["_id"]
+
+    def _unindex(self, doc: dict) -> None:
+        self._by_day.pop((doc["user_id"], doc["day_key"]), None)
+        day_keys = self._day_keys[doc["user_id"]]
+        index = bisect.bisect_left(day_keys, doc["day_key"])
+        if index < len(day_keys) and day_keys[index] == doc["day_key"]:
+            del day_keys[index]
+
+    def _range(self, user_id: ObjectId, start_key: Optional[int], end_key: Optional[int]) -> List[dict]:
+        day_keys = self._day_keys.get(user_id, [])
+        low = bisect.bisect_left(day_keys, start_key) if start_key else 0
+        high = bisect.bisect_right(day_keys, end_key) if end_key else len(day_keys)
+        return [self._diaries.docs[self._by_day[(user_id, key)]] for key in day_keys[low:high]]
+
+    def _owned(self, user_id: ObjectId, diary_id) -> Optional[dict]:
+        doc = self._diaries.docs.get(_object_id(diary_id))
+        return doc if doc is not None and doc["user_id"] == user_id else None
+
+    def get(self, user_id, diary_id) -> Optional[Diary]:
+        with self._diaries.lock:
+            return self._diaries.load(self._owned(user_id, diary_id))
+
+    def get_public(self, refs) -> List[Diary]:
+        with self._diaries.lock:
+            docs = (self._owned(user_id, diary_id) for user_id, diary_id in set(refs))
+            return [self._diaries.load(doc) for doc in docs if doc is not None and doc.get("is_public")]
+
+    def get_by_day(self, user_id, day_key) -> Optional[Diary]:
+        with self._diaries.lock:
+            return self._diaries.load(self._diaries.docs.get(self._by_day.get((user_id, day_key))))
+
+    def get_for_update(self, user_id, diary_id) -> Optional[Diary]:
+        return self.get(user_id, diary_id)
+
+    def list(self, user_id, start_key=None, end_key=None, emotion_code=None, skip=0, limit=100) -> List[Diary]:
+        with self._diaries.lock:
+            docs = reversed(self._range(user_id, start_key, end_key))
+            if emotion_code is not None:
+                docs = (
+                    doc for doc in docs
+                    if any(emotion_code in entry.get("emotions", []) for entry in doc.get("entries", []))
+                )
+            # Like Mongo, a limit of 0 means no limit
+            return [self._diaries.load(doc) for doc in islice(docs, skip, skip + limit if limit else None)]
+
+    def append_entries(self, user_id, day_key, entries, is_public, date, now) -> Diary:
+        with self._diaries.lock:
+            diary = self.get_by_day(user_id, day_key) or Diary(
+                user_id=user_id, day_key=day_key, date=date, created_at=now
+            )
+            diary.entries = list(diary.entries) + list(entries)
+            diary.is_public = is_public
+            diary.updated_at = now
+            return self.save(diary)
+
+    def set_mood(self, diary_id, mood, updated_at) -> None:
+        with self._diaries.lock:
+            doc = self._diaries.docs.get(diary_id)
+            if doc is not None and doc.get("updated_at") == updated_at:
+                doc["mood"] = mood
+
+    def save(self, diary: Diary) -> Diary:
+        with self._diaries.lock:
+            existing = self._by_day.get((diary.user_id.id, diary.day_key))
+            if existing is not None and existing != diary.id:
+                raise NotUniqueError(f"A diary for {diary.day_key} already exists")
+            previous = self._diaries.docs.get(diary.id)
+            if previous is not None:
+                self._unindex(previous)
+            self._index(self._diaries.put(diary))
+            return diary
+
+    def delete(self, user_id, diary_id) -> Optional[Diary]:
+        with self._diaries.lock:
+            doc = self._owned(user_id, diary_id)
+            if doc is None:
+                return None
+            del self._diaries.docs[doc["_id"]]
+            self._unindex(doc)
+            return self._diaries.load(doc)
+
+    def day_moods(self, user_id, start_key, end_key) -> Dict[int, int]:
+        with self._diaries.lock:
+            return {doc["day_key"]: doc.get("mood") or 0 for doc in self._range(user_id, start_key, end_key)}
+
+    def history(self, user_id, start_key=None, end_key=None) -> List[dict]:
+        with self._diaries.lock:
+            return copy.deepcopy(self._range(user_id, start_key, end_key))
+
+    def restore(self, user_id, diary_id=None, day_key=None) -> Optional[Diary]:
+        # Nothing is ever archived in memory
+        return None
+
+
+class MemoryNoteRepository(NoteRepository):
+
+    def __init__(self):
+        self._notes = _MemoryCollection(Note)
+        self._by_user: Dict[ObjectId, List[ObjectId]] = defaultdict(list)
+
+    def create(self, note: Note) -> Note:
+        with self._notes.lock:
+            doc = self._notes.put(note)
+            self._by_user[doc["user_id"]].append(doc["_id"])
+            return note
+
+    def list(self, user_id, emotion_code=None, skip=0, limit=100) -> List[Note]:
+        with self._notes.lock:
+            docs = (self._notes.docs[note_id] for note_id in self._by_user.get(user_id, []))
+            if emotion_code is not None:
+                docs = (doc for doc in docs if emotion_code in doc.get("emotions", []))
+            return [self._notes.load(doc) for doc in islice(docs, skip, skip + limit if limit else None)]
+
+    def get_many(self, user_id, note_ids) -> List[Note]:
+        with self._notes.lock:
+            docs = (self._notes.docs.get(note_id) for note_id in sorted(set(note_ids)))
+            return [self._notes.load(doc) for doc in docs if doc is not None and doc["user_id"] == user_id]
+
+    def _positioned(self, user_id: ObjectId):
+        """The user's notes with a position, as (doc, longitude, latitude)."""
+        for note_id in self._by_user.get(user_id, []):
+            doc = self._notes.docs[note_id]
+            if doc.get("position"):
+                longitude, latitude = doc["position"]["coordinates"]
+                yield doc, longitude, latitude
+
+    def nearby(self, user_id, longitude, latitude, radius_m, after=None, limit=50) -> List[Tuple[Note, float]]:
+        with self._notes.lock:
+            found = []
+            for doc, lng, lat in self._positioned(user_id):
+                distance = distance_m((longitude, latitude), (lng, lat))
+                if distance <= radius_m and (after is None or (distance, doc["_id"]) > after):
+                    found.append((distance, doc["_id"], doc))
+            found.sort(key=lambda item: item[:2])
+            return [(self._notes.load(doc), distance) for distance, _, doc in found[:limit]]
+
+    def in_box(self, user_id, box, after_id=None, limit=100) -> List[Note]:
+        with self._notes.lock:
+            docs = sorted(
+                (doc for doc, lng, lat in self._positioned(user_id)
+                 if box.contains(lng, lat) and (after_id is None or doc["_id"] > after_id)),
+                key=lambda doc: doc["_id"]
+            )
+            return [self._notes.load(doc) for doc in docs[:limit]]
+
+    def box_cells(self, user_id, box, columns, rows, min_cluster) -> List[Dict]:
+        with self._notes.lock:
+            cells: Dict[Tuple[int, int], Dict] = {}
+            for doc, lng, lat in self._positioned(user_id):
+                if not box.contains(lng, lat):
+                    continue
+                cell = cells.setdefault(box.cell_of(lng, lat, columns, rows), {"count": 0, "x": 0.0, "y": 0.0, "ids": []})
+                cell["count"] += 1
+                cell["x"] += (lng - box.west) % 360
+                cell["y"] += lat - box.south
+                if len(cell["ids"]) < min_cluster - 1:
+                    cell["ids"].append(doc["_id"])
+            return [
+                {
+                    "count": cell["count"],
+                    "longitude": (box.west + cell["x"] / cell["count"] + 180) % 360 - 180,
+                    "latitude": box.south + cell["y"] / cell["count"],
+                    "ids": cell["ids"] if cell["count"] < min_cluster else [],
+                }
+                for cell in cells.values()
+            ]
+
+
+def mongo_storage() -> Storage:
+    return Storage(MongoUserRepository(), MongoDiaryRepository(), MongoNoteRepository())
+
+
+def memory_storage() -> Storage:
+    return Storage(MemoryUserRepository(), MemoryDiaryRepository(), MemoryNoteRepository())
+
+
+_storage: Optional[Storage] = None
+
+
+def get_storage() -> Storage:
+    """Returns the repositories of the configured `STORAGE_BACKEND`."""
+    global _storage
+    if _storage is None:
+        _storage = memory_storage() if get_settings().STORAGE_BACKEND == "memory" else mongo_storage()
+    return _storage
+
+
+def configure_storage(storage: Storage) -> None:
+    """Replaces the storage backend, e.g. with a fresh in-memory one per test."""
+    global _storage
+    _storage = storage
@@ -0,0 +1,138 @@
+# app/utils/revocation.py
+import asyncio
+import hashlib
+import logging
+import math
+import threading
+from datetime import datetime, timedelta
+from typing import Iterable, Optional
+
+from anyio import to_thread
+from mongoengine.queryset.visitor import Q
+
+from app.models.token import RefreshToken
+from app.utils.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+# Overlap applied to the sync cursor to tolerate clock skew between workers
+SYNC_OVERLAP = timedelta(seconds=30)
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over string keys."""
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.hash_count):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, key: str) -> None:
+        for position in self._positions(key):
+            self._bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key: str) -> bool:
+        return all(self._bits[p >> 3] & (1 << (p & 7)) for p in self._positions(key))
+
+
+class RevocationCache:
+    """
+    In-process mirror of revoked refresh token `jti`s and families.
+
+    Checks are answered from a Bloom filter, so the common "not revoked"
+    case never touches the database; only a possible hit is confirmed
+    against Mongo. The filter is synced incrementally from `revoked_at` and
+    rebuilt periodically so entries removed by the TTL index age out.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._filter: Optional[BloomFilter] = None
+        self._synced_until: Optional[datetime] = None
+
+    @staticmethod
+    def _new_filter() -> BloomFilter:
+        settings = get_settings()
+        return BloomFilter(settings.REVOCATION_BLOOM_CAPACITY, settings.REVOCATION_BLOOM_ERROR_RATE)
+
+    def add(self, *keys: Optional[str]) -> None:
+        with self._lock:
+            if self._filter is None:
+                self._filter = self._new_filter()
+            for key in keys:
+                if key:
+                    self._filter.add(key)
+
+    def might_be_revoked(self, keys: Iterable[Optional[str]]) -> bool:
+        bloom = self._filter
+        if bloom is None:
+            # Not loaded yet: let the database decide
+            return True
+        return any(key in bloom for key in keys if key)
+
+    def is_revoked(self, jti: Optional[str] = None, family_id: Optional[str] = None) -> bool:
+        """Returns whether a token or its family is revoked."""
+        if not self.might_be_revoked((jti, family_id)):
+            return False
+
+        conditions = [Q(jti=jti)] if jti else []
+        if family_id:
+            conditions.append(Q(family_id=family_id))
+        if not conditions:
+            return False
+        query = conditions[0] if len(conditions) == 1 else conditions[0] | conditions[1]
+        return RefreshToken.objects(query, revoked_at__ne=None).only("id").first() is not None
+
+    def rebuild(self) -> None:
+        """Reloads every revoked token into a fresh filter."""
+        started = datetime.utcnow()
+        bloom = self._new_filter()
+        count = 0
+        for token in RefreshToken.objects(revoked_at__ne=None).only("jti", "family_id"):
+            bloom.add(token.jti)
+            bloom.add(token.family_id)
+            count += 1
+        with self._lock:
+            self._filter = bloom
+            self._synced_until = started
+        logger.info("Revocation cache rebuilt with %d tokens", count)
+
+    def sync(self) -> None:
+        """Adds tokens revoked since the last sync."""
+        if self._synced_until is None:
+            self.rebuild()
+            return
+
+        started = datetime.utcnow()
+        tokens = RefreshToken.objects(
+            revoked_at__gte=self._synced_until - SYNC_OVERLAP
+        ).only("jti", "family_id")
+        for token in tokens:
+            self.add(token.jti, token.family_id)
+        self._synced_until = started
+
+    async def run_sync_loop(self) -> None:
+        """Background task keeping the cache in sync; started from the app lifespan."""
+        settings = get_settings()
+        last_rebuild = asyncio.get_running_loop().time()
+        while True:
+            await asyncio.sleep(settings.REVOCATION_SYNC_SECONDS)
+            try:
+                now = asyncio.get_running_loop().time()
+                if now - last_rebuild >= settings.REVOCATION_REBUILD_SECONDS:
+                    await to_thread.run_sync(self.rebuild)
+                    last_rebuild = now
+                else:
+                    await to_thread.run_sync(self.sync)
+            except Exception:
+                logger.exception("Revocation cache sync failed")
+
+
+revocation_cache = RevocationCache()
@@ -0,0 +1,84 @@
+# app/utils/slow_query.py
+"""
+Slow MongoDB command log built on pymongo command monitoring.
+
+Commands slower than `MONGO_SLOW_QUERY_MS` (or the per-collection value in
+`MONGO_SLOW_QUERY_OVERRIDES`) are logged to the "app.mongo" logger with the
+command's shape: its keys and operators with every value replaced by "?",
+so similar queries group together and no user data reaches the logs.
+"""
+import logging
+from typing import Any, Dict, Tuple
+
+from pymongo import monitoring
+
+from app.utils.config import get_settings
+from app.utils.profiling import current_profile
+
+# Command fields that carry no information about the query itself
+_IGNORED_FIELDS = {"lsid", "$db", "$clusterTime", "$readPreference", "txnNumber", "documents", "cursor"}
+
+
+def query_shape(value: Any) -> Any:
+    """Replaces every value with "?" while keeping keys and operators."""
+    if isinstance(value, dict):
+        return {key: query_shape(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        shapes = []
+        for item in value:
+            shape = query_shape(item)
+            if shape not in shapes:
+                shapes.append(shape)
+        return shapes
+    return "?"
+
+
+class SlowQueryListener(monitoring.CommandListener):
+    """Times every command and logs the slow ones."""
+
+    def __init__(self):
+        settings = get_settings()
+        self.threshold_ms = settings.MONGO_SLOW_QUERY_MS
+        self.overrides = settings.MONGO_SLOW_QUERY_OVERRIDES
+        self.logger = logging.getLogger("app.mongo")
+        self._commands: Dict[Tuple, Tuple[str, str, dict]] = {}
+
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        if self.threshold_ms <= 0 and not self.overrides:
+            return
+        collection = event.command.get(event.command_name)
+        self._commands[(event.connection_id, event.request_id)] = (
+            event.database_name,
+            collection if isinstance(collection, str) else "",
+            event.command
+        )
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        self._finish(event, failed=False)
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        self._finish(event, failed=True)
+
+    def _finish(self, event, failed: bool) -> None:
+        started = self._commands.pop((event.connection_id, event.request_id), None)
+        duration_ms = event.duration_micros / 1000
+
+        profile = current_profile.get()
+        if profile is not None:
+            profile.record_mongo(duration_ms)
+
+        if started is None:
+            return
+        database, collection, command = started
+        threshold = self.overrides.get(collection, self.threshold_ms)
+        if threshold <= 0 or duration_ms < threshold:
+            return
+
+        self.logger.warning("slow query", extra={
+            "command": event.command_name,
+            "database": database,
+            "collection": collection,
+            "duration_ms": round(duration_ms, 2),
+            "failed": failed,
+            "shape": query_shape({k: v for k, v in command.items() if k not in _IGNORED_FIELDS}),
+        })
@@ -0,0 +1,247 @@
+# app/utils/sync.py
+"""
+Change notifications for multi-device sync.
+
+Each worker tails one MongoDB change stream over `diaries` and `notes` and
+fans the events out to the subscribers of the owning user. On a standalone
+server, where change streams are unavailable, it falls back to polling
+`updated_at`. Events carry only the document type, ID and operation;
+clients fetch the document itself when they need it.
+
+Recent events are kept in a ring buffer so a reconnecting client can replay
+what it missed from its last event ID. When that ID is no longer buffered,
+or a subscriber falls too far behind, the client gets a `resync` event and
+should refetch its lists.
+"""
+import asyncio
+import logging
+import threading
+from collections import defaultdict, deque
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Set, Tuple
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+from app.models.diary import Diary
+from app.models.note import Note
+from app.utils.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+# Collection name to the event type sent to clients
+COLLECTION_TYPES = {"diaries": "diary", "notes": "note"}
+OPERATIONS = {"insert": "insert", "update": "update", "replace": "update", "delete": "delete"}
+
+# Server error codes: change streams unsupported, resume point no longer in the oplog
+CHANGE_STREAM_UNSUPPORTED = 40573
+CHANGE_STREAM_HISTORY_LOST = (260, 280, 286)
+
+# Overlap applied to the polling cursor to tolerate clock skew between writers
+POLL_OVERLAP = timedelta(seconds=5)
+
+Event = Tuple[Optional[str], Dict]
+RESYNC_EVENT: Event = (None, {"type": "resync"})
+
+
+class Subscriber:
+    """One connected client stream of a user."""
+
+    def __init__(self, user_id: str, queue_size: int):
+        self.user_id = user_id
+        self.queue: "asyncio.Queue[Event]" = asyncio.Queue(maxsize=queue_size)
+
+    def put(self, event: Event) -> None:
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Too far behind: drop the backlog and let the client refetch
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESYNC_EVENT)
+
+
+class ChangeHub:
+    """Per-worker fan-out of diary and note changes to subscribed clients."""
+
+    def __init__(self):
+        self.mode: Optional[str] = None  # change_stream or polling
+        self._subscribers: Dict[str, Set[Subscriber]] = defaultdict(set)
+        self._buffer: deque = deque()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """Starts the watcher thread; called from the app lifespan."""
+        self._loop = asyncio.get_running_loop()
+        self._buffer = deque(maxlen=get_settings().SYNC_BUFFER_SIZE)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="change-hub", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def subscribe(self, user_id: str, last_event_id: Optional[str] = None) -> Subscriber:
+        """Registers a client, replaying buffered events after `last_event_id`."""
+        subscriber = Subscriber(user_id, get_settings().SYNC_QUEUE_SIZE)
+        if last_event_id:
+            ids = [event_id for event_id, _, _ in self._buffer]
+            if last_event_id in ids:
+                for event_id, owner, payload in list(self._buffer)[ids.index(last_event_id) + 1:]:
+                    if owner == user_id:
+                        subscriber.put((event_id, payload))
+            else:
+                subscriber.put(RESYNC_EVENT)
+        self._subscribers[user_id].add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        subscribers = self._subscribers.get(subscriber.user_id)
+        if subscribers is not None:
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self._subscribers[subscriber.user_id]
+
+    def stats(self) -> Dict:
+        return {
+            "mode": self.mode,
+            "users": len(self._subscribers),
+            "subscribers": sum(len(s) for s in self._subscribers.values()),
+            "buffered_events": len(self._buffer),
+        }
+
+    # Event loop side
+
+    def _dispatch(self, event_id: Optional[str], user_id: Optional[str], payload: Dict) -> None:
+        if user_id is None:
+            for subscribers in self._subscribers.values():
+                for subscriber in subscribers:
+                    subscriber.put(RESYNC_EVENT)
+            return
+        self._buffer.append((event_id, user_id, payload))
+        for subscriber in self._subscribers.get(user_id, ()):
+            subscriber.put((event_id, payload))
+
+    # Watcher thread side
+
+    def _publish(self, event_id: Optional[str], user_id: Optional[str], payload: Dict) -> None:
+        self._loop.call_soon_threadsafe(self._dispatch, event_id, user_id, payload)
+
+    def _run(self) -> None:
+        try:
+            try:
+                self._watch()
+            except OperationFailure as e:
+                if e.code != CHANGE_STREAM_UNSUPPORTED:
+                    raise
+                logger.info("Change streams unavailable, polling updated_at instead")
+                self._poll()
+        except Exception:
+            logger.exception("Change hub stopped")
+            self.mode = None
+
+    def _watch(self) -> None:
+        settings = get_settings()
+        pipeline = [
+            {"$match": {
+                "ns.coll": {"$in": list(COLLECTION_TYPES)},
+                "operationType": {"$in": list(OPERATIONS)},
+                # Archiving marks diaries before moving them to cold storage
+                "updateDescription.updatedFields.archived_at": {"$exists": False},
+            }},
+            {"$project": {
+                "operationType": 1, "ns": 1, "documentKey": 1,
+                "fullDocument.user_id": 1, "fullDocumentBeforeChange.user_id": 1,
+                "fullDocumentBeforeChange.archived_at": 1, "fullDocumentBeforeChange.deleted_at": 1,
+                "updateDescription.updatedFields.deleted_at": 1, "updateDescription.updatedFields.deleted_by": 1,
+            }},
+        ]
+        options = {"full_document": "updateLookup", "max_await_time_ms": 1000}
+        if settings.SYNC_PRE_IMAGES:
+            options["full_document_before_change"] = "whenAvailable"
+
+        resume_token = None
+        while not self._stop.is_set():
+            try:
+                with Diary._get_db().watch(pipeline, resume_after=resume_token, **options) as stream:
+                    self.mode = "change_stream"
+                    while not self._stop.is_set():
+                        change = stream.try_next()
+                        if change is not None:
+                            self._handle_change(change)
+                        resume_token = stream.resume_token
+            except OperationFailure as e:
+                if e.code == CHANGE_STREAM_UNSUPPORTED:
+                    raise
+                if e.code in CHANGE_STREAM_HISTORY_LOST:
+                    resume_token = None
+                    self._publish(None, None, {})
+                logger.exception("Change stream failed")
+                self._stop.wait(1)
+            except PyMongoError:
+                logger.exception("Change stream failed")
+                self._stop.wait(1)
+
+    def _handle_change(self, change: Dict) -> None:
+        operation = change["operationType"]
+        document = change.get("fullDocument") or change.get("fullDocumentBeforeChange") or {}
+        user_id = document.get("user_id")
+        marked = (change.get("updateDescription") or {}).get("updatedFields") or {}
+        if "deleted_at" in marked:
+            # Repository deletes mark the document with its owner first; by the
+            # time the update is read the document is usually gone
+            operation, user_id = "delete", marked.get("deleted_by")
+        elif operation == "delete" and (document.get("archived_at") or document.get("deleted_at")):
+            # Archived, or already announced by its mark
+            return
+        # Other deletes only carry an owner when pre-images are enabled
+        if user_id is None:
+            return
+        self._publish(change["_id"]["_data"], str(user_id), {
+            "type": COLLECTION_TYPES[change["ns"]["coll"]],
+            "id": str(change["documentKey"]["_id"]),
+            "op": OPERATIONS[operation],
+        })
+
+    def _poll(self) -> None:
+        """
+        Fallback for standalone servers. Hard deletes are not visible here,
+        so clients should also refetch their lists when they reconnect.
+        """
+        self.mode = "polling"
+        interval = get_settings().SYNC_POLL_SECONDS
+        since = datetime.utcnow()
+        seen: Dict[str, datetime] = {}
+
+        while not self._stop.wait(interval):
+            started = datetime.utcnow()
+            if not self._subscribers:
+                since = started
+                continue
+            try:
+                for document_class, event_type in ((Diary, "diary"), (Note, "note")):
+                    documents = document_class._get_collection().find(
+                        {"updated_at": {"$gt": since - POLL_OVERLAP}},
+                        {"user_id": 1, "updated_at": 1}
+                    ).sort("updated_at", 1)
+                    for doc in documents:
+                        event_id = f"{event_type}:{doc['_id']}:{doc['updated_at'].isoformat()}"
+                        if event_id in seen:
+                            continue
+                        seen[event_id] = doc["updated_at"]
+                        self._publish(event_id, str(doc["user_id"]), {
+                            "type": event_type, "id": str(doc["_id"]), "op": "update"
+                        })
+            except PyMongoError:
+                logger.exception("Change polling failed")
+                continue
+            since = started
+            horizon = since - 2 * POLL_OVERLAP
+            seen = {event_id: at for event_id, at in seen.items() if at >= horizon}
+
+
+change_hub = ChangeHub()
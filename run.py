@@ -1,14 +1,28 @@
 # run.py
 import uvicorn
-from app import app
 from app.utils.config import get_settings
 
 settings = get_settings()
 
 if __name__ == "__main__":
-    uvicorn.run(
-        "app:app",
-        host=settings.SERVER_HOST,
-        port=settings.SERVER_PORT,
-        reload=settings.DEBUG_MODE
-    )
+    if settings.DEBUG_MODE:
+        # Development: single process with auto reload
+        uvicorn.run(
+            "app:app",
+            host=settings.SERVER_HOST,
+            port=settings.SERVER_PORT,
+            reload=True
+        )
+    else:
+        # Production: one worker process per core, drained gracefully on SIGTERM
+        uvicorn.run(
+            "app:app",
+            host=settings.SERVER_HOST,
+            port=settings.SERVER_PORT,
+            workers=settings.server_workers,
+            loop=settings.SERVER_LOOP,
+            http=settings.SERVER_HTTP,
+            timeout_graceful_shutdown=settings.GRACEFUL_SHUTDOWN_SECONDS,
+            access_log=False,  # RequestLoggingMiddleware writes sampled access logs
+            proxy_headers=True
+        )
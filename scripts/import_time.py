@@ -0,0 +1,144 @@
+# scripts/import_time.py
+"""
+Import-time benchmark for cold starts.
+
+Runs `python -X importtime -c "import app"` in a fresh interpreter, parses
+the report and fails when the total exceeds the budget:
+
+    python scripts/import_time.py --budget-ms 1200 --top 15
+
+The child process inherits the environment, so the settings required by
+`app` must be available (e.g. through `.env`).
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+from dataclasses import dataclass
+from typing import List, Optional
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_BUDGET_MS = 1200
+DEFAULT_RUNS = 3
+
+# Top-level packages that app code must only import on the paths that need
+# them. Libraries may still load them, e.g. mongoengine.fields imports PIL
+LAZY_MODULES = ("google", "requests", "PIL", "numpy")
+
+
+@dataclass
+class ImportRecord:
+    module: str
+    self_us: int
+    cumulative_us: int
+    depth: int
+
+
+def parse_importtime(stderr: str) -> List[ImportRecord]:
+    """Parses `-X importtime` output into records, in import order."""
+    records = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        try:
+            self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+            records.append(ImportRecord(
+                module=name.strip(),
+                self_us=int(self_us),
+                cumulative_us=int(cumulative_us),
+                depth=(len(name) - len(name.lstrip())) // 2,
+            ))
+        except ValueError:
+            continue
+    return records
+
+
+def measure(module: str = "app") -> List[ImportRecord]:
+    """Imports `module` in a fresh interpreter and returns its import records."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=PROJECT_ROOT,
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+    return parse_importtime(result.stderr)
+
+
+def importers(records: List[ImportRecord]) -> List[Optional[str]]:
+    """
+    The module that imported each record, or None at the top level. A
+    module's own imports are listed before it, one level deeper.
+    """
+    parents: List[Optional[str]] = [None] * len(records)
+    stack: List[ImportRecord] = []
+    for index in range(len(records) - 1, -1, -1):
+        record = records[index]
+        while stack and stack[-1].depth >= record.depth:
+            stack.pop()
+        parents[index] = stack[-1].module if stack else None
+        stack.append(record)
+    return parents
+
+
+def eager_lazy_modules(records: List[ImportRecord], package: str = "app") -> List[str]:
+    """Modules of `LAZY_MODULES` that code in `package` imported at startup."""
+    return sorted({
+        record.module
+        for record, parent in zip(records, importers(records))
+        if record.module.split(".")[0] in LAZY_MODULES
+        and parent is not None and parent.split(".")[0] == package
+    })
+
+
+def measure_runs(module: str = "app", runs: int = DEFAULT_RUNS) -> List[List[ImportRecord]]:
+    """Measures several runs, fastest first; the median smooths out disk cache effects."""
+    return sorted((measure(module) for _ in range(max(runs, 1))), key=total_ms)
+
+
+def total_ms(records: List[ImportRecord]) -> float:
+    """Total import time: the sum of top-level cumulative times."""
+    return sum(r.cumulative_us for r in records if r.depth == 0) / 1000
+
+
+def format_report(records: List[ImportRecord], top: int) -> str:
+    lines = [f"Total import time: {total_ms(records):.1f} ms", ""]
+    lines.append(f"{'cumulative ms':>14} {'self ms':>9}  module")
+    for record in sorted(records, key=lambda r: r.cumulative_us, reverse=True)[:top]:
+        lines.append(
+            f"{record.cumulative_us / 1000:>14.1f} {record.self_us / 1000:>9.1f}  {record.module}"
+        )
+    return "\n".join(lines)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Measure and enforce the import-time budget")
+    parser.add_argument("--module", default="app")
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS)
+    parser.add_argument("--runs", type=int, default=DEFAULT_RUNS)
+    parser.add_argument("--top", type=int, default=20)
+    args = parser.parse_args()
+
+    runs = measure_runs(args.module, args.runs)
+    median = runs[len(runs) // 2]
+
+    print(format_report(median, args.top))
+    print(f"\nRuns: {', '.join(f'{total_ms(r):.1f}' for r in runs)} ms "
+          f"(median {statistics.median(total_ms(r) for r in runs):.1f} ms)")
+
+    forbidden = eager_lazy_modules(median, args.module.split(".")[0])
+    if forbidden:
+        print(f"FAIL: lazily loaded modules imported at startup: {', '.join(forbidden)}")
+        sys.exit(1)
+    if total_ms(median) > args.budget_ms:
+        print(f"FAIL: import time exceeds budget of {args.budget_ms:.0f} ms")
+        sys.exit(1)
+    print(f"OK: within budget of {args.budget_ms:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+# scripts/signin_benchmark.py
+"""
+Concurrent sign-in benchmark.
+
+Compares the previous sign-in flow (find the user, save it when new, then
+save the login times) with the single atomic upsert of
+`MongoUserRepository.sign_in`, with several threads signing in to the same
+account at once:
+
+    python scripts/signin_benchmark.py --concurrency 16 --rounds 200
+
+Each round is run twice: as a first sign-in, where every thread races to
+create the account, and as a returning sign-in of an existing account.
+The report shows latency percentiles, MongoDB commands per sign-in and
+failed sign-ins per flow.
+
+Runs against a scratch database (`--database`, whose `users` collection
+is dropped before and after) on the server in `MONGODB_URL`. Importing `app` reads the settings, so
+they must be available (e.g. through `.env`).
+"""
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from pymongo import monitoring
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.models.user import User  # noqa: E402
+from app.utils.repositories import MongoUserRepository  # noqa: E402
+
+DEFAULT_DATABASE = "migo_signin_benchmark"
+# Commands drivers send on their own, not part of a sign-in
+IGNORED_COMMANDS = {"hello", "ismaster", "isMaster", "ping", "endSessions", "saslStart", "saslContinue"}
+
+
+class CommandCounter(monitoring.CommandListener):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def started(self, event):
+        if event.command_name not in IGNORED_COMMANDS:
+            with self._lock:
+                self.count += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def legacy_sign_in(email: str, name: str, picture: Optional[str]) -> User:
+    """The sign-in flow before the atomic upsert."""
+    user = User.objects(email=email).first()
+    if not user:
+        user = User(email=email, name=name, picture=picture, created_at=datetime.utcnow())
+        user.save()
+    user.last_login = datetime.utcnow()
+    user.last_active = datetime.utcnow()
+    user.save()
+    return user
+
+
+def run_round(sign_in: Callable, email: str, concurrency: int, pool: ThreadPoolExecutor) -> List:
+    """Signs in `concurrency` threads to one account at the same moment."""
+    barrier = threading.Barrier(concurrency)
+
+    def one():
+        barrier.wait()
+        started = time.perf_counter()
+        try:
+            sign_in(email, "Benchmark", None)
+            return time.perf_counter() - started, None
+        except Exception as e:
+            return time.perf_counter() - started, type(e).__name__
+
+    return [future.result() for future in [pool.submit(one) for _ in range(concurrency)]]
+
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))] if ordered else 0.0
+
+
+def benchmark(name: str, sign_in: Callable, args, counter: CommandCounter) -> List[Dict]:
+    User.drop_collection()
+    User.ensure_indexes()
+    results = []
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        for phase in ("first", "returning"):
+            latencies, errors = [], Counter()
+            commands_before = counter.count
+            started = time.perf_counter()
+            for round_number in range(args.rounds):
+                email = f"signin-{round_number}@benchmark.invalid"
+                for latency, error in run_round(sign_in, email, args.concurrency, pool):
+                    latencies.append(latency)
+                    if error:
+                        errors[error] += 1
+            elapsed = time.perf_counter() - started
+            calls = args.rounds * args.concurrency
+            results.append({
+                "flow": name,
+                "phase": phase,
+                "sign_ins_per_s": calls / elapsed,
+                "p50_ms": statistics.median(latencies) * 1000,
+                "p95_ms": percentile(latencies, 95) * 1000,
+                "p99_ms": percentile(latencies, 99) * 1000,
+                "commands": (counter.count - commands_before) / calls,
+                "errors": dict(errors),
+            })
+    return results
+
+
+def format_report(results: List[Dict]) -> str:
+    lines = [
+        f"{'flow':<8} {'phase':<10} {'ops/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+        f"{'cmds/op':>8}  errors"
+    ]
+    for r in results:
+        errors = ", ".join(f"{name}: {count}" for name, count in r["errors"].items()) or "-"
+        lines.append(
+            f"{r['flow']:<8} {r['phase']:<10} {r['sign_ins_per_s']:>8.0f} {r['p50_ms']:>8.2f} "
+            f"{r['p95_ms']:>8.2f} {r['p99_ms']:>8.2f} {r['commands']:>8.2f}  {errors}"
+        )
+    return "\n".join(lines)
+
+
+def main() -> None:
+    import certifi
+    from dotenv import load_dotenv
+    from mongoengine import connect, disconnect
+
+    parser = argparse.ArgumentParser(description="Benchmark concurrent sign-ins of the same account")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--rounds", type=int, default=200)
+    parser.add_argument("--database", default=DEFAULT_DATABASE)
+    args = parser.parse_args()
+
+    load_dotenv()
+    counter = CommandCounter()
+    disconnect()
+    connect(
+        db=args.database,
+        host=os.getenv("MONGODB_URL", "mongodb://localhost:27017"),
+        tlsCAFile=certifi.where(),
+        event_listeners=[counter]
+    )
+    # A database name in MONGODB_URL takes precedence; never drop real users
+    if User._get_db().name != args.database:
+        sys.exit(f"MONGODB_URL selects database {User._get_db().name}, expected {args.database}")
+    try:
+        results = benchmark("legacy", legacy_sign_in, args, counter)
+        results += benchmark("atomic", MongoUserRepository().sign_in, args, counter)
+        print(format_report(results))
+    finally:
+        User.drop_collection()
+        disconnect()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,20 @@
+# tests/conftest.py
+import os
+
+# Settings without defaults; the tests never connect to these services
+REQUIRED_SETTINGS = {
+    "MONGODB_URL": "mongodb://localhost:27017/migo_test",
+    "DATABASE_NAME": "migo_test",
+    "GOOGLE_CLIENT_ID": "test-client-id",
+    "GOOGLE_REDIRECT_URI": "http://localhost/callback",
+    "JWT_SECRET_KEY": "test-secret",
+    "JWT_ALGORITHM": "HS256",
+    "ACCESS_TOKEN_EXPIRE_MINUTES": "30",
+    "REFRESH_TOKEN_EXPIRE_MINUTES": "43200",
+    "SERVER_HOST": "127.0.0.1",
+    "SERVER_PORT": "8000",
+    "DEBUG_MODE": "false",
+}
+
+for name, value in REQUIRED_SETTINGS.items():
+    os.environ.setdefault(name, value)
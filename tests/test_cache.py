@@ -0,0 +1,148 @@
+# tests/test_cache.py
+"""
+Response cache against the in-process LRU backend and the Redis backend.
+
+The Redis backend runs against fakeredis, a local stand-in for a Redis
+server including its Lua scripting; the tests are skipped without it.
+"""
+import pytest
+
+from app.utils.cache import CacheBackend, DisabledCacheBackend, LRUCacheBackend, RedisCacheBackend, ResponseCache
+from app.utils.config import get_settings
+
+TTL = 30
+
+
+def redis_backend(server=None) -> RedisCacheBackend:
+    fakeredis = pytest.importorskip("fakeredis")
+    client = fakeredis.FakeRedis(server=server) if server else fakeredis.FakeRedis()
+    return RedisCacheBackend("redis://stand-in", client=client)
+
+
+@pytest.fixture(params=["lru", "redis"])
+def backend(request) -> CacheBackend:
+    return LRUCacheBackend(max_entries=100) if request.param == "lru" else redis_backend()
+
+
+@pytest.fixture
+def cache(backend) -> ResponseCache:
+    cache = ResponseCache()
+    cache.configure(backend)
+    return cache
+
+
+class Builder:
+    def __init__(self, value: bytes = b"value"):
+        self.value = value
+        self.calls = 0
+
+    def __call__(self) -> bytes:
+        self.calls += 1
+        return self.value
+
+
+def test_builds_on_miss_and_serves_hits(cache):
+    build = Builder(b'{"id": 1}')
+
+    assert cache.get_or_build("diary:u:1", build, TTL) == b'{"id": 1}'
+    assert cache.get_or_build("diary:u:1", build, TTL) == b'{"id": 1}'
+
+    assert build.calls == 1
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_invalidate_drops_the_value(cache):
+    cache.get_or_build("diary:u:1", Builder(b"old"), TTL)
+
+    cache.invalidate("diary:u:1")
+
+    assert cache.get_or_build("diary:u:1", Builder(b"new"), TTL) == b"new"
+
+
+def test_invalidate_only_drops_the_given_keys(cache):
+    cache.get_or_build("diary:u:1", Builder(b"one"), TTL)
+    cache.get_or_build("diary:u:2", Builder(b"two"), TTL)
+
+    cache.invalidate("diary:u:1")
+    build = Builder(b"rebuilt")
+
+    assert cache.get_or_build("diary:u:2", build, TTL) == b"two"
+    assert build.calls == 0
+
+
+def test_value_built_across_an_invalidation_is_not_stored(cache):
+    def slow_build() -> bytes:
+        # A write lands while the response is being built
+        cache.invalidate("diary:u:1")
+        return b"stale"
+
+    assert cache.get_or_build("diary:u:1", slow_build, TTL) == b"stale"
+    assert cache.get_or_build("diary:u:1", Builder(b"fresh"), TTL) == b"fresh"
+
+
+def test_invalidation_by_another_worker_rejects_stale_writes():
+    fakeredis = pytest.importorskip("fakeredis")
+    server = fakeredis.FakeServer()
+    worker, other_worker = ResponseCache(), ResponseCache()
+    worker.configure(redis_backend(server))
+    other_worker.configure(redis_backend(server))
+
+    def slow_build() -> bytes:
+        other_worker.invalidate("me:u")
+        return b"stale"
+
+    worker.get_or_build("me:u", slow_build, TTL)
+
+    assert other_worker.get_or_build("me:u", Builder(b"fresh"), TTL) == b"fresh"
+    assert worker.get_or_build("me:u", Builder(b"unused"), TTL) == b"fresh"
+
+
+def test_lru_evicts_the_least_recently_used_entry():
+    backend = LRUCacheBackend(max_entries=2)
+    for key in ("a", "b"):
+        backend.set(key, key.encode(), TTL, backend.lookup(key)[1])
+    backend.lookup("a")
+    backend.set("c", b"c", TTL, backend.lookup("c")[1])
+
+    assert backend.lookup("a")[0] == b"a"
+    assert backend.lookup("b")[0] is None
+    assert backend.lookup("c")[0] == b"c"
+
+
+def test_backend_failures_are_misses():
+    class BrokenBackend(CacheBackend):
+        def lookup(self, key):
+            raise ConnectionError("down")
+
+        def set(self, key, value, ttl, generation):
+            raise ConnectionError("down")
+
+        def invalidate(self, keys):
+            raise ConnectionError("down")
+
+    cache = ResponseCache()
+    cache.configure(BrokenBackend())
+
+    assert cache.get_or_build("me:u", Builder(b"value"), TTL) == b"value"
+    cache.invalidate("me:u")
+    assert cache.errors == 2
+
+
+def test_stats_report_the_hit_rate(cache):
+    for _ in range(4):
+        cache.get_or_build("me:u", Builder(), TTL)
+
+    stats = cache.stats()
+
+    assert (stats["hits"], stats["misses"], stats["hit_rate"]) == (3, 1, 0.75)
+
+
+@pytest.mark.parametrize("workers, expected", [("1", LRUCacheBackend), ("4", DisabledCacheBackend)])
+def test_memory_cache_is_disabled_with_several_workers(monkeypatch, workers, expected):
+    monkeypatch.setenv("CACHE_BACKEND", "memory")
+    monkeypatch.setenv("SERVER_WORKERS", workers)
+    get_settings.cache_clear()
+    try:
+        assert isinstance(ResponseCache().backend, expected)
+    finally:
+        get_settings.cache_clear()
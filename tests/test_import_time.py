@@ -0,0 +1,30 @@
+# tests/test_import_time.py
+"""The cold-start budget of scripts/import_time.py, enforced on every test run."""
+from scripts.import_time import (
+    DEFAULT_BUDGET_MS, eager_lazy_modules, measure_runs, parse_importtime, total_ms
+)
+
+REPORT = """\
+import time: self [us] | cumulative | imported package
+import time:       100 |        100 |       PIL._version
+import time:       300 |        400 |     PIL
+import time:       200 |        600 |   mongoengine.fields
+import time:       150 |        150 |     requests
+import time:        50 |        200 |   app.utils.auth
+import time:       100 |        900 | app
+"""
+
+
+def test_only_imports_by_app_code_are_flagged():
+    records = parse_importtime(REPORT)
+
+    assert total_ms(records) == 0.9
+    assert eager_lazy_modules(records) == ["requests"]
+
+
+def test_app_imports_within_budget():
+    # Noise from the tests running alongside only adds time, so the fastest run counts
+    fastest = measure_runs("app")[0]
+
+    assert eager_lazy_modules(fastest) == []
+    assert total_ms(fastest) <= DEFAULT_BUDGET_MS
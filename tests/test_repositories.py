@@ -0,0 +1,359 @@
+# tests/test_repositories.py
+"""
+The repository contract, run against every storage backend.
+
+The Mongo backend runs against mongomock, a local stand-in for MongoDB,
+or against a real server when `MONGODB_TEST_URL` is set; its database is
+dropped after each test. Geo queries only run against a real server, as
+mongomock supports neither `$geoWithin` nor `$geoNear`.
+"""
+import os
+from datetime import datetime, timedelta
+
+import pytest
+from bson import ObjectId
+from mongoengine import NotUniqueError, connect, disconnect
+
+from app.models.diary import Diary, DiaryEntry
+from app.models.note import Note
+from app.utils import archive
+from app.utils.geo import Box, distance_m, point
+from app.utils.repositories import Storage, memory_storage, mongo_storage
+
+TEST_DATABASE = "migo_repository_test"
+
+
+@pytest.fixture
+def mongo():
+    url = os.getenv("MONGODB_TEST_URL")
+    if url:
+        client = connect(TEST_DATABASE, host=url)
+    else:
+        mongomock = pytest.importorskip("mongomock")
+        client = connect(TEST_DATABASE, host="mongodb://localhost", mongo_client_class=mongomock.MongoClient)
+    yield mongo_storage()
+    client.drop_database(TEST_DATABASE)
+    disconnect()
+
+
+@pytest.fixture(params=["memory", "mongo"])
+def storage(request) -> Storage:
+    if request.param == "memory":
+        return memory_storage()
+    return request.getfixturevalue("mongo")
+
+
+@pytest.fixture(params=["memory", "mongo"])
+def geo_storage(request) -> Storage:
+    """Geo queries need a real server: mongomock has neither $geoWithin nor $geoNear."""
+    if request.param == "memory":
+        return memory_storage()
+    if not os.getenv("MONGODB_TEST_URL"):
+        pytest.skip("Geo queries need MONGODB_TEST_URL")
+    storage = request.getfixturevalue("mongo")
+    Note.ensure_indexes()
+    return storage
+
+
+@pytest.fixture
+def user_id(storage) -> ObjectId:
+    return storage.users.sign_in("writer@example.com", "Writer", None).id
+
+
+def entry(*emotions: int, **fields) -> DiaryEntry:
+    return DiaryEntry(id=ObjectId(), emotions=list(emotions), **fields)
+
+
+def add_diary(
+    storage: Storage, user_id: ObjectId, day_key: int, *entries: DiaryEntry, is_public: bool = False
+) -> Diary:
+    now = datetime.utcnow()
+    date = datetime.strptime(str(day_key), "%Y%m%d")
+    return storage.diaries.append_entries(user_id, day_key, list(entries) or [entry()], is_public, date, now)
+
+
+# Users
+
+def test_sign_in_creates_the_user_once(storage):
+    first = storage.users.sign_in("a@example.com", "A", None)
+    again = storage.users.sign_in("a@example.com", "Changed", None)
+
+    assert again.id == first.id
+    assert again.name == "A"
+    assert storage.users.get_by_email("a@example.com").id == first.id
+
+
+def test_update_sets_fields(storage, user_id):
+    storage.users.update(user_id, timezone="Asia/Taipei")
+
+    assert storage.users.get(user_id).timezone == "Asia/Taipei"
+
+
+def test_unknown_users_are_none(storage):
+    assert storage.users.get(ObjectId()) is None
+    assert storage.users.get_by_email("nobody@example.com") is None
+
+
+def test_get_many_skips_unknown_users(storage, user_id):
+    other = storage.users.sign_in("other@example.com", "Other", None).id
+
+    assert sorted(user.id for user in storage.users.get_many([user_id, other, ObjectId()])) == sorted([user_id, other])
+
+
+# Diaries
+
+def test_one_diary_per_day(storage, user_id):
+    first = add_diary(storage, user_id, 20240105, entry(1))
+    second = add_diary(storage, user_id, 20240105, entry(2))
+
+    assert second.id == first.id
+    assert [e.emotions for e in storage.diaries.get_by_day(user_id, 20240105).entries] == [[1], [2]]
+
+
+def test_saving_a_second_diary_for_a_day_is_rejected(storage, user_id):
+    add_diary(storage, user_id, 20240105)
+
+    with pytest.raises(NotUniqueError):
+        storage.diaries.save(Diary(user_id=user_id, day_key=20240105, entries=[entry()]))
+
+
+def test_list_is_newest_day_first_with_skip_and_limit(storage, user_id):
+    for day_key in (20240103, 20240101, 20240105, 20240104, 20240102):
+        add_diary(storage, user_id, day_key)
+
+    def day_keys(**kwargs):
+        return [diary.day_key for diary in storage.diaries.list(user_id, **kwargs)]
+
+    assert day_keys() == [20240105, 20240104, 20240103, 20240102, 20240101]
+    assert day_keys(skip=1, limit=2) == [20240104, 20240103]
+    assert day_keys(skip=4, limit=10) == [20240101]
+    assert day_keys(skip=5) == []
+    assert day_keys(limit=0) == [20240105, 20240104, 20240103, 20240102, 20240101]
+    assert day_keys(start_key=20240102, end_key=20240104) == [20240104, 20240103, 20240102]
+
+
+def test_list_filters_by_emotion(storage, user_id):
+    add_diary(storage, user_id, 20240101, entry(1))
+    add_diary(storage, user_id, 20240102, entry(2), entry(3))
+    add_diary(storage, user_id, 20240103, entry(3))
+
+    assert [d.day_key for d in storage.diaries.list(user_id, emotion_code=3)] == [20240103, 20240102]
+
+
+def test_diaries_are_private_to_their_user(storage, user_id):
+    diary = add_diary(storage, user_id, 20240101)
+    other = storage.users.sign_in("other@example.com", "Other", None).id
+
+    assert storage.diaries.get(other, str(diary.id)) is None
+    assert storage.diaries.list(other) == []
+    assert storage.diaries.delete(other, str(diary.id)) is None
+
+
+def test_delete_returns_the_diary(storage, user_id):
+    diary = add_diary(storage, user_id, 20240101)
+
+    deleted = storage.diaries.delete(user_id, str(diary.id))
+
+    assert deleted.id == diary.id
+    assert storage.diaries.get(user_id, str(diary.id)) is None
+    # The day can be written again
+    assert add_diary(storage, user_id, 20240101).id != diary.id
+
+
+def test_calendar_maps_days_to_moods(storage, user_id):
+    for day_key, code in ((20240101, 1), (20240215, 2), (20250101, 3)):
+        diary = add_diary(storage, user_id, day_key, entry(code))
+        storage.diaries.set_mood(diary.id, code, diary.updated_at)
+
+    assert storage.diaries.day_moods(user_id, 20240101, 20241231) == {20240101: 1, 20240215: 2}
+
+
+def test_set_mood_skips_diaries_modified_since(storage, user_id):
+    diary = add_diary(storage, user_id, 20240101, entry(1))
+    add_diary(storage, user_id, 20240101, entry(2))
+
+    storage.diaries.set_mood(diary.id, 1, diary.updated_at - timedelta(seconds=1))
+
+    assert storage.diaries.day_moods(user_id, 20240101, 20240101) == {20240101: 0}
+
+
+def test_history_returns_the_projected_fields_in_range(storage, user_id):
+    add_diary(storage, user_id, 20240101, entry(1, writing_time_seconds=30, imported_data={"steps": 100}))
+    add_diary(storage, user_id, 20240102, entry(2))
+    add_diary(storage, user_id, 20240110, entry(3))
+
+    docs = sorted(storage.diaries.history(user_id, 20240101, 20240105), key=lambda doc: doc["day_key"])
+
+    assert [doc["day_key"] for doc in docs] == [20240101, 20240102]
+    first = docs[0]["entries"][0]
+    assert (first["emotions"], first["writing_time_seconds"], first["imported_data"]) == ([1], 30, {"steps": 100})
+    assert sorted(doc["day_key"] for doc in storage.diaries.history(user_id)) == [20240101, 20240102, 20240110]
+
+
+def test_get_public_returns_public_diaries_of_their_authors(storage, user_id):
+    other = storage.users.sign_in("other@example.com", "Other", None).id
+    public = add_diary(storage, user_id, 20240101, is_public=True)
+    private = add_diary(storage, user_id, 20240102)
+    others = add_diary(storage, other, 20240101, is_public=True)
+
+    diaries = storage.diaries.get_public([
+        (user_id, public.id), (user_id, private.id), (user_id, others.id), (other, others.id), (user_id, ObjectId())
+    ])
+
+    assert sorted(diary.id for diary in diaries) == sorted([public.id, others.id])
+
+
+def test_get_public_reads_archived_diaries(mongo, monkeypatch):
+    monkeypatch.setattr(archive, "archive_cutoff_key", lambda: 20230101)
+    user_id = mongo.users.sign_in("writer@example.com", "Writer", None).id
+    old = [add_diary(mongo, user_id, day_key, is_public=True) for day_key in (20200501, 20200502, 20200601)]
+    private = add_diary(mongo, user_id, 20200503)
+    hot = add_diary(mongo, user_id, 20240101, is_public=True)
+    assert archive.archive_old_diaries()["archived"] == 4
+
+    diaries = mongo.diaries.get_public([(user_id, diary.id) for diary in old + [private, hot]])
+
+    assert sorted(diary.id for diary in diaries) == sorted(diary.id for diary in old + [hot])
+
+
+def test_list_merges_restored_diaries_with_the_archives_by_day(mongo, monkeypatch):
+    monkeypatch.setattr(archive, "archive_cutoff_key", lambda: 20230101)
+    monkeypatch.setattr("app.utils.repositories.archive_cutoff_key", lambda: 20230101)
+    user_id = mongo.users.sign_in("writer@example.com", "Writer", None).id
+    restored = add_diary(mongo, user_id, 20200501)
+    for day_key in (20200601, 20211201):
+        add_diary(mongo, user_id, day_key)
+    archive.archive_old_diaries()
+    add_diary(mongo, user_id, 20240101)
+    # Stays hot until the next archive run
+    assert mongo.diaries.get_for_update(user_id, str(restored.id)).day_key == 20200501
+
+    def day_keys(**kwargs):
+        return [diary.day_key for diary in mongo.diaries.list(user_id, **kwargs)]
+
+    assert day_keys() == [20240101, 20211201, 20200601, 20200501]
+    assert day_keys(skip=1, limit=2) == [20211201, 20200601]
+    assert day_keys(skip=3, limit=2) == [20200501]
+    assert day_keys(start_key=20200515) == [20240101, 20211201, 20200601]
+
+
+def test_reads_return_copies(storage, user_id):
+    diary = add_diary(storage, user_id, 20240101, entry(1))
+
+    diary.entries.append(entry(2))
+
+    assert len(storage.diaries.get(user_id, str(diary.id)).entries) == 1
+
+
+# Notes
+
+def add_note(storage: Storage, user_id: ObjectId, content: str, *emotions: int) -> Note:
+    return storage.notes.create(Note(user_id=user_id, content=content, content_type="text", emotions=list(emotions)))
+
+
+def test_notes_list_in_insertion_order_with_skip_and_limit(storage, user_id):
+    for content in ("a", "b", "c", "d"):
+        add_note(storage, user_id, content)
+
+    def contents(**kwargs):
+        return [note.content for note in storage.notes.list(user_id, **kwargs)]
+
+    assert contents() == ["a", "b", "c", "d"]
+    assert contents(skip=1, limit=2) == ["b", "c"]
+    assert contents(skip=4) == []
+
+
+def test_notes_filter_by_emotion(storage, user_id):
+    add_note(storage, user_id, "a", 1)
+    add_note(storage, user_id, "b", 2)
+    add_note(storage, user_id, "c", 1, 2)
+
+    assert [note.content for note in storage.notes.list(user_id, emotion_code=1)] == ["a", "c"]
+
+
+def test_get_many_returns_only_the_users_notes_in_id_order(storage, user_id):
+    notes = [add_note(storage, user_id, content) for content in ("a", "b")]
+    other = storage.users.sign_in("other@example.com", "Other", None).id
+    foreign = add_note(storage, other, "x")
+
+    found = storage.notes.get_many(user_id, [notes[1].id, foreign.id, notes[0].id])
+
+    assert [note.content for note in found] == ["a", "b"]
+
+
+# Note positions
+
+def place(storage: Storage, user_id: ObjectId, content: str, longitude: float, latitude: float) -> Note:
+    return storage.notes.create(Note(
+        user_id=user_id, content=content, content_type="text", position=point(longitude, latitude)
+    ))
+
+
+def test_in_box_pages_by_id(geo_storage):
+    user_id = ObjectId()
+    for index in range(5):
+        place(geo_storage, user_id, str(index), 121.5 + index / 100, 25.0)
+    place(geo_storage, user_id, "outside", 130.0, 25.0)
+    place(geo_storage, ObjectId(), "foreign", 121.5, 25.0)
+    box = Box(west=121.0, south=24.0, east=122.0, north=26.0)
+
+    pages, after_id = [], None
+    while True:
+        page = geo_storage.notes.in_box(user_id, box, after_id, limit=2)
+        if not page:
+            break
+        pages.append([note.content for note in page])
+        after_id = page[-1].id
+
+    assert pages == [["0", "1"], ["2", "3"], ["4"]]
+
+
+def test_in_box_across_the_antimeridian(geo_storage):
+    user_id = ObjectId()
+    for content, longitude in (("east", 179.5), ("west", -179.5), ("far", 0.0)):
+        place(geo_storage, user_id, content, longitude, 10.0)
+    box = Box(west=170.0, south=0.0, east=-170.0, north=20.0)
+
+    assert [note.content for note in geo_storage.notes.in_box(user_id, box)] == ["east", "west"]
+
+
+def test_box_cells_keep_ids_of_sparse_cells_only(geo_storage):
+    user_id = ObjectId()
+    for index in range(4):
+        place(geo_storage, user_id, f"dense{index}", 1.0 + index / 100, 1.0)
+    sparse = [place(geo_storage, user_id, f"sparse{index}", 9.0, 9.0 + index / 100) for index in range(2)]
+    box = Box(west=0.0, south=0.0, east=10.0, north=10.0)
+
+    cells = sorted(geo_storage.notes.box_cells(user_id, box, 2, 2, min_cluster=3), key=lambda cell: cell["count"])
+
+    assert [(cell["count"], sorted(cell["ids"])) for cell in cells] == [
+        (2, sorted(note.id for note in sparse)), (4, [])
+    ]
+    assert cells[1]["longitude"] == pytest.approx(1.015)
+
+
+def test_box_cells_average_across_the_antimeridian(geo_storage):
+    user_id = ObjectId()
+    for longitude in (179.0, -179.0):
+        place(geo_storage, user_id, str(longitude), longitude, 10.0)
+    box = Box(west=170.0, south=0.0, east=-170.0, north=20.0)
+
+    [cell] = geo_storage.notes.box_cells(user_id, box, 1, 1, min_cluster=2)
+
+    assert cell["count"] == 2
+    assert abs(cell["longitude"]) == pytest.approx(180.0)
+    assert cell["ids"] == []
+
+
+def test_nearby_pages_by_distance(geo_storage):
+    user_id = ObjectId()
+    for content, offset in (("near", 0.001), ("middle", 0.002), ("far", 0.003), ("outside", 1.0)):
+        place(geo_storage, user_id, content, 121.5 + offset, 25.0)
+
+    first = geo_storage.notes.nearby(user_id, 121.5, 25.0, radius_m=1000, limit=2)
+    note, distance = first[-1]
+    rest = geo_storage.notes.nearby(user_id, 121.5, 25.0, radius_m=1000, after=(distance, note.id), limit=2)
+
+    assert [note.content for note, _ in first] == ["near", "middle"]
+    assert [note.content for note, _ in rest] == ["far"]
+    assert first[0][1] == pytest.approx(distance_m((121.5, 25.0), (121.501, 25.0)), rel=1e-3)
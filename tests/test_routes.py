@@ -0,0 +1,88 @@
+# tests/test_routes.py
+"""
+Requests through the application against the Mongo backend, on mongomock
+or on the server in `MONGODB_TEST_URL`. The lifespan is not run, so no
+connection pools, change streams or revocation sync are started.
+"""
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+from mongoengine import connect, disconnect
+
+from app import app
+from app.models.feed import Follow
+from app.models.media import Media
+from app.models.user import User
+from app.utils.auth import create_access_token
+from app.utils.repositories import configure_storage, mongo_storage
+
+TEST_DATABASE = "migo_route_test"
+
+
+@pytest.fixture
+def client():
+    url = os.getenv("MONGODB_TEST_URL")
+    if url:
+        connection = connect(TEST_DATABASE, host=url)
+    else:
+        mongomock = pytest.importorskip("mongomock")
+        connection = connect(TEST_DATABASE, host="mongodb://localhost", mongo_client_class=mongomock.MongoClient)
+    configure_storage(mongo_storage())
+    yield TestClient(app)
+    connection.drop_database(TEST_DATABASE)
+    disconnect()
+
+
+def sign_in(email: str) -> User:
+    return User(email=email, name=email.split("@")[0]).save()
+
+
+def headers(user: User) -> dict:
+    token = create_access_token({"sub": user.email, "uid": str(user.id)})
+    return {"Authorization": f"Bearer {token}"}
+
+
+def test_follow_and_unfollow_return_no_content(client):
+    reader, writer = sign_in("reader@example.com"), sign_in("writer@example.com")
+
+    followed = client.put(f"/feed/following/{writer.id}", headers=headers(reader))
+    assert followed.status_code == 204
+    assert Follow.objects(follower_id=reader.id, followee_id=writer.id).count() == 1
+
+    unfollowed = client.delete(f"/feed/following/{writer.id}", headers=headers(reader))
+    assert unfollowed.status_code == 204
+    assert Follow.objects.count() == 0
+    assert client.delete(f"/feed/following/{writer.id}", headers=headers(reader)).status_code == 404
+
+
+def test_deleting_a_diary_and_an_entry_return_no_content(client):
+    user = sign_in("writer@example.com")
+    created = client.post("/diaries/", json={
+        "date": "2024-03-21T00:00:00", "entries": [{"title": "a"}, {"title": "b"}]
+    }, headers=headers(user))
+    assert created.status_code == 201
+    diary = created.json()
+
+    removed = client.delete(f"/diaries/{diary['_id']}/entries/{diary['entries'][0]['_id']}", headers=headers(user))
+    assert removed.status_code == 204
+
+    assert client.delete(f"/diaries/{diary['_id']}", headers=headers(user)).status_code == 204
+    assert client.delete(f"/diaries/{diary['_id']}", headers=headers(user)).status_code == 404
+
+
+def test_media_is_only_readable_by_its_uploader(client):
+    owner, other = sign_in("owner@example.com"), sign_in("other@example.com")
+    media = Media(type="image", url="/static/media/ab/ab.jpg", storage_key="ab/ab.jpg", uploaded_by=owner).save()
+
+    assert client.get(f"/media/{media.id}", headers=headers(owner)).status_code == 200
+    assert client.get(f"/media/{media.id}", headers=headers(other)).status_code == 404
+    assert client.get("/media/not-an-id", headers=headers(owner)).status_code == 404
+    assert client.get(f"/media/{media.id}").status_code == 401
+
+
+def test_unsupported_image_formats_are_rejected(client):
+    user = sign_in("writer@example.com")
+
+    uploaded = client.post("/media/", content=b"heic", headers={**headers(user), "Content-Type": "image/heic"})
+    assert uploaded.status_code == 415
@@ -0,0 +1,58 @@
+# tests/test_sync.py
+"""Change stream events translated into the notifications sent to clients."""
+from bson import ObjectId
+
+from app.utils.sync import ChangeHub
+
+
+def notifications(*changes):
+    hub, published = ChangeHub(), []
+    hub._publish = lambda event_id, user_id, payload: published.append((user_id, payload))
+    for change in changes:
+        hub._handle_change(change)
+    return published
+
+
+def change(operation, document_id, event="e1", **fields):
+    return {
+        "_id": {"_data": event}, "operationType": operation, "ns": {"coll": "diaries"},
+        "documentKey": {"_id": document_id}, **fields,
+    }
+
+
+def test_marked_deletes_reach_the_owner_without_pre_images():
+    owner, diary_id = ObjectId(), ObjectId()
+
+    published = notifications(
+        # The document is gone when the update is read, so there is no fullDocument
+        change("update", diary_id, "e1", fullDocument=None, updateDescription={
+            "updatedFields": {"deleted_at": "2024-03-21T00:00:00", "deleted_by": owner}
+        }),
+        change("delete", diary_id, "e2"),
+    )
+
+    assert published == [(str(owner), {"type": "diary", "id": str(diary_id), "op": "delete"})]
+
+
+def test_deletes_are_announced_once_with_pre_images():
+    owner, diary_id = ObjectId(), ObjectId()
+
+    published = notifications(
+        change("update", diary_id, "e1", fullDocument={"user_id": owner}, updateDescription={
+            "updatedFields": {"deleted_at": "2024-03-21T00:00:00", "deleted_by": owner}
+        }),
+        change("delete", diary_id, "e2", fullDocumentBeforeChange={"user_id": owner, "deleted_at": "2024-03-21"}),
+        change("delete", ObjectId(), "e3", fullDocumentBeforeChange={"user_id": owner, "archived_at": "2024-03-21"}),
+    )
+
+    assert [payload["op"] for _, payload in published] == ["delete"]
+
+
+def test_updates_reach_the_owner():
+    owner, diary_id = ObjectId(), ObjectId()
+
+    published = notifications(change("update", diary_id, fullDocument={"user_id": owner}, updateDescription={
+        "updatedFields": {"entries": []}
+    }))
+
+    assert published == [(str(owner), {"type": "diary", "id": str(diary_id), "op": "update"})]